@@ -2,26 +2,83 @@
 Main FastAPI application
 """
 
+import uuid
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from pathlib import Path
 
-from app.api.routes import generation, voice
-from app.core.logger import app_logger, api_logger
+from app.api.routes import generation, voice, jobs, conversations, metrics
+from app.core.logger import app_logger, api_logger, request_id_var
+from app.core.http_client import http_client
+from app.core.metrics import metrics as metrics_registry
+from app.services.manim_service import manim_service
+from app.services.llm_service import llm_service
+from app.services.job_service import job_manager
+from app.services.repair_service import repair_service
+from app.services.conversation_service import conversation_service
+from app.services.prompt_registry import prompt_registry
+from app.services.provider_health import provider_monitor
 
 # 记录应用启动
 app_logger.info("正在启动 Manim-GPT 应用...")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动和释放后台资源"""
+    app_logger.info("启动后台资源...")
+    await http_client.start(["deepseek", "qwen", "dashscope"])
+    http_client.get_httpx_client("openai")
+    manim_service.start()
+    await job_manager.start()
+    try:
+        yield
+    finally:
+        app_logger.info("释放后台资源...")
+        await job_manager.stop()
+        manim_service.shutdown()
+        await http_client.close()
+        # 等待后台日志线程写完已入队的记录
+        await app_logger.complete()
+
 # 创建FastAPI应用
 app = FastAPI(
     title="Manim-GPT",
     description="AI-powered mathematical animation generator using Manim",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app_logger.info("FastAPI 应用已创建")
 
+class RequestIdMiddleware:
+    """为每个请求设置请求ID（沿用客户端传入的X-Request-ID），写入日志记录并随响应返回"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        token = request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-request-id", request_id.encode("latin-1")))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+app.add_middleware(RequestIdMiddleware)
+
 # 设置静态文件
 static_dir = Path("app/static")
 if static_dir.exists():
@@ -44,7 +101,10 @@ else:
 # 注册API路由
 app.include_router(generation.router, prefix="/api", tags=["generation"])
 app.include_router(voice.router, prefix="/api", tags=["voice"])
-app_logger.info("API路由已注册: /api (generation, voice)")
+app.include_router(jobs.router, prefix="/api", tags=["jobs"])
+app.include_router(conversations.router, prefix="/api", tags=["conversations"])
+app.include_router(metrics.router, prefix="/api", tags=["metrics"])
+app_logger.info("API路由已注册: /api (generation, voice, jobs, conversations, metrics)")
 
 @app.get("/")
 async def root():
@@ -79,7 +139,16 @@ async def health_check():
             "services": {
                 "api": "running",
                 "llm": llm_status,
-                "manim": "available"
+                "manim": "available",
+                "render": manim_service.get_stats(),
+                "llm_providers": provider_monitor.get_stats(),
+                "llm_cache": llm_service.get_cache_stats(),
+                "semantic_cache": llm_service.get_semantic_cache_stats(),
+                "http": http_client.get_stats(),
+                "jobs": job_manager.get_stats(),
+                "repair": repair_service.get_stats(),
+                "conversations": conversation_service.get_stats(),
+                "prompts": prompt_registry.get_stats()
             }
         }
         
@@ -94,4 +163,12 @@ async def health_check():
             "error": str(e)
         }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus抓取端点"""
+    return PlainTextResponse(
+        metrics_registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 app_logger.success("Manim-GPT 应用初始化完成") 
@@ -0,0 +1,29 @@
+"""
+Multi-turn conversation API routes
+"""
+
+from fastapi import APIRouter, HTTPException
+
+from app.models.schemas import ConversationResponse
+from app.services.conversation_service import conversation_service
+from app.core.logger import api_logger
+
+router = APIRouter()
+
+@router.get("/conversations/{conversation_id}", response_model=ConversationResponse)
+async def get_conversation(conversation_id: str) -> ConversationResponse:
+    """查询对话的当前代码和历次修改要求"""
+    
+    conversation = conversation_service.get(conversation_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="对话不存在或已过期")
+    return ConversationResponse(**conversation)
+
+@router.delete("/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    """删除对话，之后使用同一ID的请求将从头开始生成"""
+    
+    api_logger.info(f"收到对话删除请求 - ID: {conversation_id}")
+    if not conversation_service.delete(conversation_id):
+        raise HTTPException(status_code=404, detail="对话不存在或已过期")
+    return {"success": True, "conversation_id": conversation_id}
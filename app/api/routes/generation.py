@@ -3,90 +3,248 @@ Animation generation API routes
 """
 
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
-from typing import Dict, Any
+from fastapi.responses import StreamingResponse
+from typing import Dict, Any, AsyncIterator, Awaitable, TypeVar
 import asyncio
+import contextlib
+import json
 import time
 
 from app.models.schemas import (
+    ModelType,
     GenerationRequest, 
     GenerationResponse, 
     PreviewRequest, 
     PreviewResponse,
+    RenderStatusResponse,
     SaveRequest,
     SaveResponse
 )
 from app.services.llm_service import llm_service
 from app.services.manim_service import manim_service
+from app.services.prompt_registry import prompt_registry
+from app.services.llm_metrics import llm_metrics
+from app.services.repair_service import repair_service
+from app.services.conversation_service import conversation_service
+from app.services.admission import AdmissionRejected
 from app.core.logger import api_logger
+from app.core.metrics import STAGE_SECONDS, GENERATIONS_TOTAL
 
 router = APIRouter()
 
+T = TypeVar("T")
+
+# 渲染期间检查客户端连接状态的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 1.0
+
+class ClientDisconnected(Exception):
+    """客户端在渲染完成前断开连接"""
+
+async def _cancel_on_disconnect(req: Request, coro: Awaitable[T]) -> T:
+    """执行渲染协程，客户端断开时取消渲染并结束渲染进程"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await req.is_disconnected():
+                api_logger.warning("客户端已断开，取消渲染任务")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
 @router.post("/generate", response_model=GenerationResponse)
 async def generate_animation(request: GenerationRequest, req: Request) -> GenerationResponse:
     """生成Manim动画"""
     
+    if request.conversation_id:
+        # 同一会话从修改、渲染到保存串行执行，并发请求不会基于同一版本修改而互相覆盖
+        async with conversation_service.lock(request.conversation_id):
+            return await _generate_animation(request, req)
+    return await _generate_animation(request, req)
+
+async def _generate_animation(request: GenerationRequest, req: Request) -> GenerationResponse:
+    """生成代码、验证、渲染并在失败时自动修复"""
+    
     client_ip = req.client.host if req.client else "unknown"
     api_logger.info(f"收到动画生成请求 - 客户端: {client_ip}")
     api_logger.debug(f"请求参数 - 模型: {request.model.value}, 质量: {request.quality.value}, 温度: {request.temperature}")
     api_logger.debug(f"提示词长度: {len(request.prompt)}字符")
     
     start_time = time.time()
+    # 汇总本次请求中全部LLM调用（含竞速、对冲和自动修复）的用量
+    llm_usage = llm_metrics.track_request()
     
     try:
         # 1. 使用LLM生成Manim代码
         api_logger.info("开始调用LLM服务生成代码")
         llm_start = time.time()
         
-        llm_result = await llm_service.generate_manim_code(
-            prompt=request.prompt,
-            model=request.model,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens
+        race_models = (
+            llm_service.race_candidates(request.model, request.race_models, request.race_samples)
+            if request.race and not request.conversation_id else []
         )
+        if request.conversation_id:
+            # 多轮对话：在服务端保存的当前代码上按修改要求编辑
+            llm_result = await conversation_service.generate(
+                conversation_id=request.conversation_id,
+                prompt=request.prompt,
+                model=request.model,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens,
+                use_cache=request.use_cache,
+                quality=request.quality.value
+            )
+        elif len(race_models) > 1:
+            # 竞速模式：多个候选同时生成，第一个通过验证的胜出
+            llm_result = await llm_service.race_manim_code(
+                prompt=request.prompt,
+                models=race_models,
+                validate=manim_service.validate_code,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens,
+                use_cache=request.use_cache,
+                quality=request.quality.value
+            )
+        else:
+            llm_result = await llm_service.generate_manim_code(
+                prompt=request.prompt,
+                model=request.model,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens,
+                use_cache=request.use_cache,
+                quality=request.quality.value
+            )
+        model_used = llm_result.get("model", request.model.value)
+        race_candidates = llm_result.get("candidates")
+        llm_meta = {
+            "conversation_id": llm_result.get("conversation_id"),
+            "edit_mode": llm_result.get("edit_mode"),
+            "prompt_version": llm_result.get("prompt_version"),
+            "semantic_match": llm_result.get("semantic_match"),
+            "llm_usage": llm_usage
+        }
+        prompt_version = llm_meta["prompt_version"]
         
         llm_duration = time.time() - llm_start
         api_logger.info(f"LLM服务调用完成 - 耗时: {llm_duration:.2f}秒, 成功: {llm_result['success']}")
+        STAGE_SECONDS.observe(llm_duration, stage="llm")
+        quality = request.quality.value
         
         if not llm_result["success"]:
             api_logger.error(f"LLM代码生成失败: {llm_result['error']}")
+            GENERATIONS_TOTAL.inc(model=model_used, quality=quality, status="llm_error")
             return GenerationResponse(
                 success=False,
                 message="代码生成失败",
-                error=llm_result["error"]
+                error=llm_result["error"],
+                race_candidates=race_candidates,
+                execution_time=time.time() - start_time,
+                **llm_meta
             )
         
         generated_code = llm_result["code"]
         api_logger.debug(f"生成代码长度: {len(generated_code)}字符")
         
-        # 2. 验证生成的代码
+        # 2. 验证生成的代码（竞速模式下已在生成时验证）
         api_logger.info("开始验证生成的代码")
-        validation_result = manim_service.validate_code(generated_code)
+        validation_result = llm_result.get("validation") or manim_service.validate_code(generated_code)
         
-        if not validation_result["valid"]:
+        if not validation_result["valid"] and not request.auto_repair:
             api_logger.warning(f"代码验证失败: {validation_result['error']}")
+            prompt_registry.record_render(prompt_version, False)
+            GENERATIONS_TOTAL.inc(model=model_used, quality=quality, status="invalid_code")
             return GenerationResponse(
                 success=False,
                 message="生成的代码无效",
                 code=generated_code,
-                error=validation_result["error"]
+                error=validation_result["error"],
+                model_used=model_used,
+                race_candidates=race_candidates,
+                execution_time=time.time() - start_time,
+                **llm_meta
             )
         
-        api_logger.info("代码验证通过")
-        
         # 3. 执行Manim代码生成视频
-        api_logger.info("开始调用Manim服务生成视频")
+        def render(code: str) -> Awaitable[Dict[str, Any]]:
+            if request.progressive:
+                # 渐进模式：只等待草稿，最终视频在后台渲染，不随客户端断开而取消
+                return manim_service.start_progressive_render(code=code, quality=request.quality)
+            return manim_service.execute_manim_code(
+                code=code,
+                quality=request.quality,
+                session_id=request.session_id
+            )
+        
         manim_start = time.time()
+        manim_result = None
+        if validation_result["valid"]:
+            api_logger.info("代码验证通过")
+            api_logger.info("开始调用Manim服务生成视频")
+            if request.progressive:
+                manim_result = await render(generated_code)
+            else:
+                manim_result = await _cancel_on_disconnect(req, render(generated_code))
+            failure = None if manim_result["success"] else manim_result["error"]
+        else:
+            api_logger.warning(f"代码验证失败，尝试自动修复: {validation_result['error']}")
+            failure = validation_result["error"]
         
-        manim_result = await manim_service.execute_manim_code(
-            code=generated_code,
-            quality=request.quality
-        )
+        # 4. 失败时自动修复：把错误交给LLM修复，验证后重新渲染
+        repair_attempts = None
+        if failure and request.auto_repair:
+            repair_result = await _cancel_on_disconnect(req, repair_service.repair(
+                prompt=request.prompt,
+                code=generated_code,
+                error=failure,
+                render=render,
+                model=ModelType(model_used),
+                max_tokens=request.max_tokens
+            ))
+            repair_attempts = repair_result["attempts"]
+            generated_code = repair_result["code"]
+            if repair_result["render_result"] is not None:
+                manim_result = repair_result["render_result"]
+            if manim_result is None:
+                # 修复后的代码始终未通过验证
+                prompt_registry.record_render(prompt_version, False)
+                GENERATIONS_TOTAL.inc(model=model_used, quality=quality, status="invalid_code")
+                return GenerationResponse(
+                    success=False,
+                    message="生成的代码无效",
+                    code=generated_code,
+                    error=repair_result["error"],
+                    repair_attempts=repair_attempts,
+                    model_used=model_used,
+                    race_candidates=race_candidates,
+                    execution_time=time.time() - start_time,
+                    **llm_meta
+                )
         
         manim_duration = time.time() - manim_start
         total_duration = time.time() - start_time
         
         api_logger.info(f"Manim服务调用完成 - 耗时: {manim_duration:.2f}秒, 成功: {manim_result['success']}")
         api_logger.info(f"整个生成流程完成 - 总耗时: {total_duration:.2f}秒")
+        prompt_registry.record_render(prompt_version, manim_result["success"])
+        GENERATIONS_TOTAL.inc(
+            model=model_used,
+            quality=quality,
+            status="success" if manim_result["success"] else "render_error"
+        )
+        if manim_result["success"] and request.conversation_id:
+            conversation_service.commit_turn(
+                request.conversation_id, request.prompt, llm_meta["edit_mode"], generated_code
+            )
+        if manim_result["success"] and llm_meta["edit_mode"] in (None, "new"):
+            # 多轮对话中的修改要求不是完整描述，不加入语义缓存
+            await llm_service.remember_success(
+                request.prompt, generated_code, model_used, prompt_version, quality
+            )
         
         if manim_result["success"]:
             api_logger.success(f"动画生成成功 - 输出文件: {manim_result['video_path']}")
@@ -94,7 +252,16 @@ async def generate_animation(request: GenerationRequest, req: Request) -> Genera
                 success=True,
                 message=manim_result["message"],
                 code=generated_code,
-                video_path=manim_result["video_path"]
+                video_path=manim_result["video_path"],
+                resource_usage=manim_result.get("resource_usage"),
+                draft_path=manim_result.get("draft_path"),
+                render_id=manim_result.get("render_id"),
+                render_status=manim_result.get("render_status"),
+                repair_attempts=repair_attempts,
+                model_used=model_used,
+                race_candidates=race_candidates,
+                execution_time=total_duration,
+                **llm_meta
             )
         else:
             api_logger.error(f"Manim执行失败: {manim_result['error']}")
@@ -102,18 +269,177 @@ async def generate_animation(request: GenerationRequest, req: Request) -> Genera
                 success=False,
                 message=manim_result["message"],
                 code=generated_code,
-                error=manim_result["error"]
+                error=manim_result["error"],
+                resource_usage=manim_result.get("resource_usage"),
+                repair_attempts=repair_attempts,
+                model_used=model_used,
+                race_candidates=race_candidates,
+                execution_time=total_duration,
+                **llm_meta
             )
     
+    except AdmissionRejected as e:
+        api_logger.warning(f"渲染繁忙，拒绝生成请求: {str(e)}")
+        raise _render_busy(e)
+    except ClientDisconnected:
+        # 客户端已离开，无需再返回内容
+        raise HTTPException(status_code=499, detail="客户端已断开连接")
     except Exception as e:
         total_duration = time.time() - start_time
         api_logger.error(f"动画生成过程异常 - 耗时: {total_duration:.2f}秒, 错误: {str(e)}", exc_info=True)
         return GenerationResponse(
             success=False,
             message="生成过程中发生错误",
-            error=str(e)
+            error=str(e),
+            execution_time=total_duration,
+            llm_usage=llm_usage
         )
 
+# SSE心跳间隔（秒），防止代理在长时间渲染期间断开连接
+SSE_HEARTBEAT_INTERVAL = 15
+
+def _render_busy(error: AdmissionRejected) -> HTTPException:
+    """渲染繁忙时返回429并附带Retry-After"""
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条SSE消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/generate/stream")
+async def generate_animation_stream(request: GenerationRequest, req: Request) -> StreamingResponse:
+    """流式生成Manim动画
+    
+    通过SSE依次推送：token（代码增量）、code（完整代码）、validation（验证结果）、
+    progress（渲染进度）、done（视频地址）或 error。
+    """
+    
+    client_ip = req.client.host if req.client else "unknown"
+    api_logger.info(f"收到流式动画生成请求 - 客户端: {client_ip}")
+    api_logger.debug(f"请求参数 - 模型: {request.model.value}, 质量: {request.quality.value}, 温度: {request.temperature}")
+    
+    async def event_stream() -> AsyncIterator[str]:
+        start_time = time.time()
+        llm_usage = llm_metrics.track_request()
+        render_task = None
+        
+        try:
+            # 1. 流式生成代码
+            llm_result = None
+            async for event in llm_service.stream_manim_code(
+                prompt=request.prompt,
+                model=request.model,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens,
+                use_cache=request.use_cache,
+                quality=request.quality.value
+            ):
+                if event["type"] == "token":
+                    yield _sse_event("token", {"content": event["content"]})
+                else:
+                    llm_result = event
+            
+            model_used = (llm_result or {}).get("model", request.model.value)
+            quality = request.quality.value
+            STAGE_SECONDS.observe(time.time() - start_time, stage="llm")
+            
+            if not llm_result or not llm_result["success"]:
+                error = llm_result["error"] if llm_result else "LLM未返回结果"
+                api_logger.error(f"流式代码生成失败: {error}")
+                GENERATIONS_TOTAL.inc(model=model_used, quality=quality, status="llm_error")
+                yield _sse_event("error", {"message": "代码生成失败", "error": error})
+                return
+            
+            generated_code = llm_result["code"]
+            api_logger.info(f"流式代码生成完成 - 耗时: {time.time() - start_time:.2f}秒")
+            yield _sse_event("code", {"code": generated_code})
+            
+            # 2. 验证代码
+            validation_result = manim_service.validate_code(generated_code)
+            yield _sse_event("validation", validation_result)
+            
+            if not validation_result["valid"]:
+                api_logger.warning(f"代码验证失败: {validation_result['error']}")
+                prompt_registry.record_render(llm_result.get("prompt_version"), False)
+                GENERATIONS_TOTAL.inc(model=model_used, quality=quality, status="invalid_code")
+                yield _sse_event("error", {"message": "生成的代码无效", "error": validation_result["error"]})
+                return
+            
+            # 3. 渲染视频，期间转发进度
+            progress_queue: asyncio.Queue = asyncio.Queue()
+            render_task = asyncio.create_task(manim_service.execute_manim_code(
+                code=generated_code,
+                quality=request.quality,
+                progress_callback=progress_queue.put_nowait,
+                session_id=request.session_id
+            ))
+            
+            while not render_task.done() or not progress_queue.empty():
+                get_task = asyncio.ensure_future(progress_queue.get())
+                done, _ = await asyncio.wait(
+                    {get_task, render_task},
+                    timeout=SSE_HEARTBEAT_INTERVAL,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if get_task in done:
+                    yield _sse_event("progress", get_task.result())
+                else:
+                    get_task.cancel()
+                    if not done:
+                        yield ": keep-alive\n\n"
+            
+            manim_result = render_task.result()
+            total_duration = time.time() - start_time
+            api_logger.info(f"流式生成流程完成 - 总耗时: {total_duration:.2f}秒, 成功: {manim_result['success']}")
+            prompt_registry.record_render(llm_result.get("prompt_version"), manim_result["success"])
+            GENERATIONS_TOTAL.inc(
+                model=model_used,
+                quality=quality,
+                status="success" if manim_result["success"] else "render_error"
+            )
+            if manim_result["success"]:
+                await llm_service.remember_success(
+                    request.prompt, generated_code, model_used, llm_result.get("prompt_version"), quality
+                )
+            
+            if manim_result["success"]:
+                yield _sse_event("done", {
+                    "message": manim_result["message"],
+                    "video_path": manim_result["video_path"],
+                    "video_url": f"/{manim_result['video_path']}",
+                    "execution_time": total_duration,
+                    "resource_usage": manim_result.get("resource_usage"),
+                    "llm_usage": llm_usage
+                })
+            else:
+                yield _sse_event("error", {"message": manim_result["message"], "error": manim_result["error"]})
+        
+        except AdmissionRejected as e:
+            api_logger.warning(f"渲染繁忙，拒绝流式生成请求: {str(e)}")
+            yield _sse_event("error", {"message": "渲染服务繁忙", "error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            api_logger.error(f"流式生成过程异常: {str(e)}", exc_info=True)
+            yield _sse_event("error", {"message": "生成过程中发生错误", "error": str(e)})
+        
+        finally:
+            # 客户端断开时停止仍在进行的渲染
+            if render_task and not render_task.done():
+                api_logger.warning("客户端已断开，取消渲染任务")
+                render_task.cancel()
+                # 等待渲染清理（结束渲染进程、删除工作目录）完成
+                with contextlib.suppress(asyncio.CancelledError):
+                    await render_task
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/preview", response_model=PreviewResponse)
 async def preview_animation(request: PreviewRequest, req: Request) -> PreviewResponse:
     """预览Manim动画"""
@@ -141,10 +467,17 @@ async def preview_animation(request: PreviewRequest, req: Request) -> PreviewRes
         
         # 执行代码生成预览
         api_logger.info("开始执行代码生成预览")
-        result = await manim_service.execute_manim_code(
-            code=request.code,
-            quality=request.quality
-        )
+        if request.progressive:
+            result = await manim_service.start_progressive_render(
+                code=request.code,
+                quality=request.quality
+            )
+        else:
+            result = await _cancel_on_disconnect(req, manim_service.execute_manim_code(
+                code=request.code,
+                quality=request.quality,
+                session_id=request.session_id
+            ))
         
         duration = time.time() - start_time
         api_logger.info(f"预览生成完成 - 耗时: {duration:.2f}秒, 成功: {result['success']}")
@@ -153,15 +486,25 @@ async def preview_animation(request: PreviewRequest, req: Request) -> PreviewRes
             api_logger.success(f"预览生成成功 - 输出文件: {result['video_path']}")
             return PreviewResponse(
                 success=True,
-                video_path=result["video_path"]
+                video_path=result["video_path"],
+                resource_usage=result.get("resource_usage"),
+                draft_path=result.get("draft_path"),
+                render_id=result.get("render_id"),
+                render_status=result.get("render_status")
             )
         else:
             api_logger.error(f"预览生成失败: {result['error']}")
             return PreviewResponse(
                 success=False,
-                error=result["error"]
+                error=result["error"],
+                resource_usage=result.get("resource_usage")
             )
     
+    except AdmissionRejected as e:
+        api_logger.warning(f"渲染繁忙，拒绝预览请求: {str(e)}")
+        raise _render_busy(e)
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="客户端已断开连接")
     except Exception as e:
         duration = time.time() - start_time
         api_logger.error(f"预览生成过程异常 - 耗时: {duration:.2f}秒, 错误: {str(e)}", exc_info=True)
@@ -170,6 +513,14 @@ async def preview_animation(request: PreviewRequest, req: Request) -> PreviewRes
             error=str(e)
         )
 
+@router.get("/renders/{render_id}", response_model=RenderStatusResponse)
+async def get_render_status(render_id: str) -> RenderStatusResponse:
+    """查询渐进渲染的最终视频状态，完成后客户端用video_path替换草稿"""
+    status = manim_service.get_render_status(render_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="渲染任务不存在")
+    return RenderStatusResponse(**status)
+
 @router.post("/save", response_model=SaveResponse)
 async def save_animation(request: SaveRequest, req: Request) -> SaveResponse:
     """保存动画视频"""
@@ -239,7 +590,8 @@ async def validate_manim_code(code: str, req: Request) -> Dict[str, Any]:
             api_logger.warning(f"代码验证失败: {result['error']}")
             return {
                 "valid": result["valid"],
-                "error": result["error"]
+                "error": result["error"],
+                "problems": result.get("problems", [])
             }
     
     except Exception as e:
@@ -0,0 +1,45 @@
+"""
+Asynchronous generation job API routes
+"""
+
+from fastapi import APIRouter, HTTPException, Request
+
+from app.models.schemas import JobRequest, JobResponse
+from app.services.job_service import job_manager, JobQueueFull
+from app.core.logger import api_logger
+
+router = APIRouter()
+
+@router.post("/jobs", response_model=JobResponse, status_code=202)
+async def create_job(request: JobRequest, req: Request) -> JobResponse:
+    """提交异步动画生成任务"""
+    
+    client_ip = req.client.host if req.client else "unknown"
+    api_logger.info(f"收到异步生成任务 - 客户端: {client_ip}, 模型: {request.model.value}, 优先级: {request.priority}")
+    
+    try:
+        job = job_manager.submit(request)
+    except JobQueueFull as e:
+        api_logger.warning(f"任务提交被拒绝: {str(e)}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    return JobResponse(**job)
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str) -> JobResponse:
+    """查询任务状态"""
+    
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return JobResponse(**job)
+
+@router.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_job(job_id: str) -> JobResponse:
+    """取消任务（执行中的渲染进程会被终止）"""
+    
+    api_logger.info(f"收到任务取消请求 - ID: {job_id}")
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return JobResponse(**job)
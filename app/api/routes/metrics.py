@@ -0,0 +1,15 @@
+"""
+Metrics API routes
+"""
+
+from fastapi import APIRouter
+
+from app.services.llm_metrics import llm_metrics
+
+router = APIRouter()
+
+@router.get("/metrics/llm")
+async def get_llm_metrics():
+    """各模型的令牌用量、估算费用，以及进程启动以来的延迟、首token耗时和单次令牌数直方图"""
+    
+    return llm_metrics.get_stats()
@@ -32,24 +32,135 @@ class Settings(BaseSettings):
     http_proxy: Optional[str] = Field(None, env="HTTP_PROXY")
     https_proxy: Optional[str] = Field(None, env="HTTPS_PROXY")
     
+    # 出站HTTP连接池配置
+    http_pool_limit: int = Field(100, env="HTTP_POOL_LIMIT")
+    http_pool_limit_per_host: int = Field(20, env="HTTP_POOL_LIMIT_PER_HOST")
+    http_dns_cache_ttl: int = Field(300, env="HTTP_DNS_CACHE_TTL")
+    http_keepalive_timeout: float = Field(60.0, env="HTTP_KEEPALIVE_TIMEOUT")
+    http_connect_timeout: float = Field(10.0, env="HTTP_CONNECT_TIMEOUT")
+    llm_request_timeout: float = Field(120.0, env="LLM_REQUEST_TIMEOUT")
+    # 两次读取之间的最长等待（流式响应中为相邻数据块的间隔）
+    llm_read_timeout: float = Field(60.0, env="LLM_READ_TIMEOUT")
+    
+    # 各服务商的最大并发请求数
+    deepseek_max_concurrency: int = Field(8, env="DEEPSEEK_MAX_CONCURRENCY")
+    qwen_max_concurrency: int = Field(8, env="QWEN_MAX_CONCURRENCY")
+    openai_max_concurrency: int = Field(8, env="OPENAI_MAX_CONCURRENCY")
+    
+    # 服务商熔断：连续失败（超时、5xx、429、连接错误）达到阈值后熔断，冷却后放行试探请求
+    llm_breaker_failure_threshold: int = Field(5, env="LLM_BREAKER_FAILURE_THRESHOLD")
+    llm_breaker_reset_seconds: float = Field(30.0, env="LLM_BREAKER_RESET_SECONDS")
+    # 用于路由和对冲的延迟窗口大小，以及计算分位数所需的最少样本
+    llm_latency_window: int = Field(100, env="LLM_LATENCY_WINDOW")
+    llm_latency_min_samples: int = Field(10, env="LLM_LATENCY_MIN_SAMPLES")
+    # 对冲请求：超过主服务商的p90延迟仍未返回时，向另一服务商发出同样的请求，取先成功的结果
+    llm_hedge_enabled: bool = Field(False, env="LLM_HEDGE_ENABLED")
+    llm_hedge_default_delay: float = Field(20.0, env="LLM_HEDGE_DEFAULT_DELAY")
+    
+    # LLM用量统计：覆盖默认估算单价的JSON（{"model": [输入, 缓存输入, 输出]}，美元/百万令牌）
+    llm_pricing: str = Field("", env="LLM_PRICING")
+    
     # Paths
     output_dir: Path = Field(Path("outputs"), env="OUTPUT_DIR")
     temp_dir: Path = Field(Path("temp"), env="TEMP_DIR")
+    cache_dir: Path = Field(Path("cache"), env="CACHE_DIR")
     
     # Server settings
     host: str = Field("0.0.0.0", env="HOST")
     port: int = Field(8000, env="PORT")
     debug: bool = Field(True, env="DEBUG")
     
+    # 日志设置
+    # text为可读文本，json为每行一条JSON记录（便于日志系统采集）
+    log_format: str = Field("text", env="LOG_FORMAT")
+    # 由后台线程写文件，请求路径上只做格式化和入队
+    log_enqueue: bool = Field(True, env="LOG_ENQUEUE")
+    # 异常回溯中输出变量值，未设置时跟随DEBUG；生产环境应关闭，避免泄露密钥等数据
+    log_diagnose: Optional[bool] = Field(None, env="LOG_DIAGNOSE")
+    # 单条日志消息的最大字符数，超出部分截断（如manim输出、LLM返回内容）
+    log_max_message_chars: int = Field(4000, env="LOG_MAX_MESSAGE_CHARS")
+    # 按组件对DEBUG日志采样（如 "manim:0.1,llm:0.5"），未列出的组件全部保留
+    log_debug_sample_rates: str = Field("", env="LOG_DEBUG_SAMPLE_RATES")
+    
     # LLM settings
     default_model: str = Field("deepseek-chat", env="DEFAULT_MODEL")
     max_tokens: int = Field(4000, env="MAX_TOKENS")
     temperature: float = Field(0.7, env="TEMPERATURE")
     
+    # 系统提示词变体及权重（如 "v1:1,v2:1" 做A/B对比），按描述哈希分配
+    prompt_variants: str = Field("v2", env="PROMPT_VARIANTS")
+    
+    # LLM响应缓存设置
+    llm_cache_enabled: bool = Field(True, env="LLM_CACHE_ENABLED")
+    llm_cache_ttl_seconds: int = Field(86400, env="LLM_CACHE_TTL_SECONDS")
+    llm_cache_memory_entries: int = Field(512, env="LLM_CACHE_MEMORY_ENTRIES")
+    llm_cache_disk_entries: int = Field(20000, env="LLM_CACHE_DISK_ENTRIES")
+    # 温度>0的请求默认是否使用缓存（单次请求可通过use_cache覆盖）；
+    # 默认不使用，否则"重新生成"总是得到同一份代码，温度参数不起作用
+    llm_cache_sampled_default: bool = Field(False, env="LLM_CACHE_SAMPLED_DEFAULT")
+    
+    # 语义缓存：与渲染成功过的描述足够相似时直接复用代码，稍低时作为参考示例
+    semantic_cache_enabled: bool = Field(True, env="SEMANTIC_CACHE_ENABLED")
+    # 本地sentence-transformers模型名，为空或未安装时使用哈希向量化（阈值需随向量化方式调整）
+    # 按相似度直接复用代码只在使用向量模型时生效，哈希向量化只复用规范化后完全相同的描述
+    semantic_cache_model: str = Field("", env="SEMANTIC_CACHE_MODEL")
+    semantic_cache_dim: int = Field(1024, env="SEMANTIC_CACHE_DIM")
+    semantic_cache_max_entries: int = Field(5000, env="SEMANTIC_CACHE_MAX_ENTRIES")
+    semantic_cache_reuse_threshold: float = Field(0.95, env="SEMANTIC_CACHE_REUSE_THRESHOLD")
+    semantic_cache_few_shot_threshold: float = Field(0.5, env="SEMANTIC_CACHE_FEW_SHOT_THRESHOLD")
+    
+    # 多轮对话：服务端保存历史和当前代码，历史按令牌预算压缩后发送给模型
+    conversation_context_tokens: int = Field(2000, env="CONVERSATION_CONTEXT_TOKENS")
+    conversation_max_turns: int = Field(50, env="CONVERSATION_MAX_TURNS")
+    conversation_ttl_hours: int = Field(72, env="CONVERSATION_TTL_HOURS")
+    
+    # 竞速生成：同时请求多个模型（逗号分隔，为空时使用请求的模型），取第一个通过验证的结果
+    race_models: str = Field("", env="RACE_MODELS")
+    race_max_candidates: int = Field(4, env="RACE_MAX_CANDIDATES")
+    
+    # 渲染失败后的自动修复（请求中auto_repair开启时生效）
+    repair_max_attempts: int = Field(2, env="REPAIR_MAX_ATTEMPTS")
+    repair_token_budget: int = Field(16000, env="REPAIR_TOKEN_BUDGET")
+    repair_time_limit: float = Field(180.0, env="REPAIR_TIME_LIMIT")
+    # 发送给LLM的错误信息最大长度（保留末尾）
+    repair_error_max_chars: int = Field(3000, env="REPAIR_ERROR_MAX_CHARS")
+    
     # Manim settings
     manim_quality: str = Field("medium_quality", env="MANIM_QUALITY")
     manim_format: str = Field("mp4", env="MANIM_FORMAT")
+
+    # 渲染前静态检查：禁用的类/方法，以及需要关闭的规则（逗号分隔）
+    code_forbidden_names: str = Field("Tex,MathTex,get_axis_labels", env="CODE_FORBIDDEN_NAMES")
+    code_disabled_rules: str = Field("", env="CODE_DISABLED_RULES")
+
+    # 渲染准入控制（并发数为0时按CPU核数自动确定）
+    render_max_concurrency: int = Field(0, env="RENDER_MAX_CONCURRENCY")
+    render_max_queue: int = Field(16, env="RENDER_MAX_QUEUE")
+    render_max_wait: float = Field(30.0, env="RENDER_MAX_WAIT")
+    # 渐进模式的后台最终渲染在繁忙时重试，超过该时长（秒）仍未获得名额则标记为失败
+    render_background_max_wait: float = Field(600.0, env="RENDER_BACKGROUND_MAX_WAIT")
+    
+    # 常驻渲染进程池设置（进程数为0时与渲染并发数一致）
+    render_pool_enabled: bool = Field(True, env="RENDER_POOL_ENABLED")
+    render_pool_size: int = Field(0, env="RENDER_POOL_SIZE")
+    render_worker_max_jobs: int = Field(50, env="RENDER_WORKER_MAX_JOBS")
+    render_worker_max_rss_mb: int = Field(1536, env="RENDER_WORKER_MAX_RSS_MB")
+    render_job_timeout: int = Field(300, env="RENDER_JOB_TIMEOUT")
+    # 单次渲染的CPU时间和内存（地址空间）上限，0表示不限制
+    render_cpu_time_limit: int = Field(240, env="RENDER_CPU_TIME_LIMIT")
+    render_memory_limit_mb: int = Field(4096, env="RENDER_MEMORY_LIMIT_MB")
     
+    # 渲染结果缓存设置
+    render_cache_enabled: bool = Field(True, env="RENDER_CACHE_ENABLED")
+    render_cache_max_mb: int = Field(2048, env="RENDER_CACHE_MAX_MB")
+    render_cache_max_age_hours: int = Field(168, env="RENDER_CACHE_MAX_AGE_HOURS")
+    # 编辑会话的渲染目录闲置多久后清理（分钟），目录中保留manim的分段视频缓存
+    render_session_ttl_minutes: int = Field(60, env="RENDER_SESSION_TTL_MINUTES")
+    
+    # 异步任务队列设置
+    job_max_concurrency: int = Field(2, env="JOB_MAX_CONCURRENCY")
+    job_queue_max_size: int = Field(100, env="JOB_QUEUE_MAX_SIZE")
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -62,6 +173,7 @@ class Settings(BaseSettings):
         # 确保目录存在
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
 
 # 全局设置实例
 settings = Settings()
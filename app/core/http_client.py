@@ -0,0 +1,138 @@
+"""
+应用级共享的HTTP客户端
+
+每个上游服务商复用一个带连接池的 aiohttp.ClientSession，
+避免每次调用都重新进行TCP和TLS握手。会话在FastAPI生命周期钩子中创建和关闭。
+"""
+
+from typing import Dict, Any, Iterable
+
+import aiohttp
+import httpx
+
+from app.core.config import settings
+from app.core.logger import app_logger
+
+class HTTPClientManager:
+    """按服务商管理共享的aiohttp会话"""
+
+    def __init__(self):
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        # OpenAI SDK基于httpx，为其单独维护同样配置的连接池
+        self._httpx_clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _new_stats(self) -> Dict[str, int]:
+        return {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0
+        }
+
+    def _build_trace_config(self, provider: str) -> aiohttp.TraceConfig:
+        """通过trace钩子统计连接复用情况"""
+        stats = self._stats.setdefault(provider, self._new_stats())
+
+        def counter(name: str):
+            async def handler(session, context, params):
+                stats[name] += 1
+            return handler
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(counter("requests"))
+        trace_config.on_connection_create_end.append(counter("connections_created"))
+        trace_config.on_connection_reuseconn.append(counter("connections_reused"))
+        trace_config.on_dns_cache_hit.append(counter("dns_cache_hits"))
+        trace_config.on_dns_cache_miss.append(counter("dns_cache_misses"))
+        return trace_config
+
+    def _create_session(self, provider: str) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=settings.http_pool_limit,
+            limit_per_host=settings.http_pool_limit_per_host,
+            ttl_dns_cache=settings.http_dns_cache_ttl,
+            keepalive_timeout=settings.http_keepalive_timeout,
+            enable_cleanup_closed=True
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=settings.llm_request_timeout,
+            connect=settings.http_connect_timeout,
+            sock_read=settings.llm_read_timeout
+        )
+        app_logger.debug(f"创建共享HTTP会话 - 服务商: {provider}")
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=[self._build_trace_config(provider)]
+        )
+
+    def get_session(self, provider: str) -> aiohttp.ClientSession:
+        """获取服务商对应的共享会话（不存在或已关闭时创建）"""
+        session = self._sessions.get(provider)
+        if session is None or session.closed:
+            session = self._create_session(provider)
+            self._sessions[provider] = session
+        return session
+
+    def get_httpx_client(self, provider: str) -> httpx.AsyncClient:
+        """获取供OpenAI SDK使用的共享httpx客户端"""
+        client = self._httpx_clients.get(provider)
+        if client is None or client.is_closed:
+            stats = self._stats.setdefault(provider, self._new_stats())
+
+            async def count_request(request):
+                stats["requests"] += 1
+
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.http_pool_limit,
+                    max_keepalive_connections=settings.http_pool_limit_per_host,
+                    keepalive_expiry=settings.http_keepalive_timeout
+                ),
+                timeout=httpx.Timeout(
+                    settings.llm_request_timeout,
+                    connect=settings.http_connect_timeout,
+                    read=settings.llm_read_timeout
+                ),
+                event_hooks={"request": [count_request]}
+            )
+            self._httpx_clients[provider] = client
+            app_logger.debug(f"创建共享httpx客户端 - 服务商: {provider}")
+        return client
+
+    async def start(self, providers: Iterable[str]):
+        """预先创建会话"""
+        for provider in providers:
+            self.get_session(provider)
+        app_logger.info(f"共享HTTP会话已创建: {list(self._sessions.keys())}")
+
+    async def close(self):
+        """关闭所有会话"""
+        sessions, self._sessions = self._sessions, {}
+        for provider, session in sessions.items():
+            if not session.closed:
+                await session.close()
+        clients, self._httpx_clients = self._httpx_clients, {}
+        for provider, client in clients.items():
+            await client.aclose()
+        app_logger.info("共享HTTP会话已关闭")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各服务商的连接复用统计"""
+        result = {}
+        for provider, stats in self._stats.items():
+            connections = stats["connections_created"] + stats["connections_reused"]
+            result[provider] = {
+                **stats,
+                "reuse_rate": round(stats["connections_reused"] / connections, 4) if connections else 0.0,
+                "open": (
+                    (provider in self._sessions and not self._sessions[provider].closed)
+                    or (provider in self._httpx_clients and not self._httpx_clients[provider].is_closed)
+                )
+            }
+        return result
+
+# 全局HTTP客户端管理实例
+http_client = HTTPClientManager()
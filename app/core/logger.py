@@ -1,17 +1,96 @@
 """
 应用日志配置模块
+
+日志记录携带请求ID和任务ID，可输出为文本或每行一条JSON。文件写入默认由后台线程完成
+（enqueue），请求路径上只做格式化和入队；DEBUG日志可按组件采样，过长的消息会被截断。
 """
 
+import json
+import random
 import sys
+import traceback
+from contextvars import ContextVar
 from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
 from loguru import logger
 from app.core.config import settings
 
+# 当前请求和异步任务的ID，由请求中间件和任务执行协程设置
+request_id_var: ContextVar[Optional[str]] = ContextVar("log_request_id", default=None)
+job_id_var: ContextVar[Optional[str]] = ContextVar("log_job_id", default=None)
+
+def _parse_sample_rates(value: str) -> Tuple[Dict[str, float], List[str]]:
+    """解析形如 "manim:0.1,llm:0.5" 的组件采样率，返回采样率和无效的配置项"""
+    rates: Dict[str, float] = {}
+    invalid: List[str] = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        component, _, rate = item.partition(":")
+        try:
+            rates[component.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            invalid.append(item)
+    return rates, invalid
+
+def _make_patcher(max_chars: int, sample_rates: Dict[str, float]):
+    """在调用方线程中补充上下文ID、截断过长消息，并决定DEBUG日志是否被采样丢弃"""
+
+    def patcher(record: Dict[str, Any]):
+        extra = record["extra"]
+        extra.setdefault("component", "app")
+        extra.setdefault("request_id", request_id_var.get() or "-")
+        extra.setdefault("job_id", job_id_var.get() or "-")
+
+        rate = sample_rates.get(extra["component"])
+        # 同一条记录对所有输出只采样一次，各文件中保留的记录一致
+        extra["sampled_out"] = (
+            rate is not None and record["level"].no <= 10 and random.random() >= rate
+        )
+
+        message = record["message"]
+        if max_chars and len(message) > max_chars:
+            record["message"] = f"{message[:max_chars]}...（已截断，共{len(message)}字符）"
+
+    return patcher
+
+def _keep(component: Optional[str] = None):
+    """文件输出的过滤器：丢弃被采样的记录，指定组件时只保留该组件"""
+    if component is None:
+        return lambda record: not record["extra"].get("sampled_out")
+    return lambda record: (
+        not record["extra"].get("sampled_out") and record["extra"].get("component") == component
+    )
+
+def _json_format(record: Dict[str, Any]) -> str:
+    """每条记录序列化为一行JSON"""
+    extra = record["extra"]
+    payload = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "component": extra.get("component"),
+        "request_id": extra.get("request_id"),
+        "job_id": extra.get("job_id"),
+        "location": f"{record['name']}:{record['function']}:{record['line']}",
+        "message": record["message"]
+    }
+    if record["exception"] is not None:
+        exc_type, exc_value, exc_traceback = record["exception"]
+        payload["exception"] = "".join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+    # 先存入extra再引用，避免JSON中的花括号被当作格式字段
+    extra["serialized"] = json.dumps(payload, ensure_ascii=False, default=str)
+    return "{extra[serialized]}\n"
+
 def setup_logger():
     """设置应用日志配置"""
     
     # 移除默认的日志处理器
     logger.remove()
+    sample_rates, invalid_rates = _parse_sample_rates(settings.log_debug_sample_rates)
+    logger.configure(patcher=_make_patcher(settings.log_max_message_chars, sample_rates))
+    
+    diagnose = settings.debug if settings.log_diagnose is None else settings.log_diagnose
     
     # 控制台日志格式
     console_format = (
@@ -25,91 +104,102 @@ def setup_logger():
     file_format = (
         "{time:YYYY-MM-DD HH:mm:ss} | "
         "{level: <8} | "
+        "{extra[request_id]} {extra[job_id]} | "
         "{name}:{function}:{line} | "
         "{message}"
     )
     
+    use_json = settings.log_format.lower() == "json"
+    
     # 添加控制台日志处理器
     logger.add(
         sys.stdout,
-        format=console_format,
+        format=_json_format if use_json else console_format,
         level="INFO",
-        colorize=True,
+        colorize=not use_json,
         backtrace=True,
-        diagnose=True
+        diagnose=diagnose,
+        enqueue=settings.log_enqueue
     )
     
     # 确保日志目录存在
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
     
+    # 各文件输出的公共参数；轮转和压缩在写入线程中进行
+    file_options = {
+        "format": _json_format if use_json else file_format,
+        "compression": "zip",
+        "enqueue": settings.log_enqueue
+    }
+    suffix = "jsonl" if use_json else "log"
+    
     # 添加文件日志处理器 - 应用日志
     logger.add(
-        "logs/app.log",
-        format=file_format,
+        f"logs/app.{suffix}",
         level="DEBUG",
         rotation="100 MB",
         retention="7 days",
-        compression="zip",
         backtrace=True,
-        diagnose=True
+        diagnose=diagnose,
+        filter=_keep(),
+        **file_options
     )
     
     # 添加错误日志文件
     logger.add(
-        "logs/error.log",
-        format=file_format,
+        f"logs/error.{suffix}",
         level="ERROR",
         rotation="50 MB",
         retention="30 days",
-        compression="zip",
         backtrace=True,
-        diagnose=True
+        diagnose=diagnose,
+        **file_options
     )
     
     # 添加API访问日志
     logger.add(
-        "logs/api.log",
-        format=file_format,
+        f"logs/api.{suffix}",
         level="INFO",
         rotation="100 MB",
         retention="7 days",
-        compression="zip",
-        filter=lambda record: record["extra"].get("component") == "api"
+        filter=_keep("api"),
+        **file_options
     )
     
     # 添加LLM服务日志
     logger.add(
-        "logs/llm.log",
-        format=file_format,
+        f"logs/llm.{suffix}",
         level="DEBUG",
         rotation="50 MB",
         retention="7 days",
-        compression="zip",
-        filter=lambda record: record["extra"].get("component") == "llm"
+        filter=_keep("llm"),
+        **file_options
     )
     
     # 添加Manim服务日志
     logger.add(
-        "logs/manim.log",
-        format=file_format,
+        f"logs/manim.{suffix}",
         level="DEBUG",
         rotation="50 MB",
         retention="7 days",
-        compression="zip",
-        filter=lambda record: record["extra"].get("component") == "manim"
+        filter=_keep("manim"),
+        **file_options
     )
     
     # 添加Voice服务日志
     logger.add(
-        "logs/voice.log",
-        format=file_format,
+        f"logs/voice.{suffix}",
         level="DEBUG",
         rotation="50 MB",
         retention="7 days",
-        compression="zip",
-        filter=lambda record: record["extra"].get("component") == "voice"
+        filter=_keep("voice"),
+        **file_options
     )
+    
+    # 日志输出就绪后再报告无效的配置
+    for item in invalid_rates:
+        logger.bind(component="app").warning(f"日志采样率配置无效，已忽略: {item}")
 
 # 初始化日志系统
 setup_logger()
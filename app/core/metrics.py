@@ -0,0 +1,270 @@
+"""
+进程内指标注册表
+
+实现计数器、仪表和直方图三种指标，按Prometheus文本格式（0.0.4）输出，
+由 /metrics 端点直接提供，不依赖外部服务或客户端库。
+"""
+
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 默认耗时分桶（秒），覆盖从毫秒级的验证到数分钟的渲染
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric(ABC):
+    """指标基类：按标签值组合保存各自的样本"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Prometheus文本格式的样本行"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """只增不减的计数器"""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(Metric):
+    """可增可减的仪表，也可以在输出时通过回调读取当前值（仅限无标签的仪表）"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(float(self._function()))}"]
+            except Exception:
+                # 回调依赖的对象尚未初始化时不输出样本
+                return []
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram(Metric):
+    """累计分桶的直方图，可在Prometheus中用histogram_quantile计算p50/p99"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数（不累计，最后一个为+Inf）, 总和, 次数]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """统计代码块的耗时"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def snapshot(self, **labels: str) -> Dict[str, Any]:
+        """合并与给定标签匹配的全部序列，返回各桶计数、总和、次数和估算的分位数（用于JSON统计接口）"""
+        unknown = set(labels) - set(self.labelnames)
+        if unknown:
+            raise ValueError(f"指标 {self.name} 没有标签 {tuple(unknown)}")
+        positions = [(self.labelnames.index(name), str(value)) for name, value in labels.items()]
+        counts = [0] * (len(self.buckets) + 1)
+        total, count = 0.0, 0
+        with self._lock:
+            for key, (entry_counts, entry_total, entry_count) in self._values.items():
+                if all(key[index] == value for index, value in positions):
+                    counts = [a + b for a, b in zip(counts, entry_counts)]
+                    total += entry_total
+                    count += entry_count
+        return {
+            "buckets": {_format_value(bound): counts[i] for i, bound in enumerate(self.buckets)} | {"+Inf": counts[-1]},
+            "sum": round(total, 3),
+            "count": count,
+            "p50": self._quantile(counts, count, 0.5),
+            "p90": self._quantile(counts, count, 0.9),
+            "p99": self._quantile(counts, count, 0.99)
+        }
+
+    def _quantile(self, counts: List[int], count: int, q: float) -> Optional[float]:
+        """分位数所在桶的上界（超出最大桶时返回最大桶）"""
+        if not count:
+            return None
+        target = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets[min(index, len(self.buckets) - 1)]
+        return self.buckets[-1]
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class MetricsRegistry:
+    """指标注册表，按注册顺序输出全部指标"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标重复注册: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+# 全局指标注册表
+metrics = MetricsRegistry()
+
+# 生成流程各阶段耗时：llm、validation、render（含file_lookup和publish）、file_lookup、publish
+STAGE_SECONDS = metrics.histogram(
+    "manim_gpt_stage_duration_seconds", "生成流程各阶段耗时（秒）", ["stage"]
+)
+GENERATIONS_TOTAL = metrics.counter(
+    "manim_gpt_generations_total", "生成请求结果（status: success/llm_error/invalid_code/render_error）",
+    ["model", "quality", "status"]
+)
+RENDERS_TOTAL = metrics.counter(
+    "manim_gpt_renders_total", "渲染结果（含缓存命中）", ["quality", "status"]
+)
+RENDERS_IN_FLIGHT = metrics.gauge("manim_gpt_renders_in_flight", "正在执行的渲染数")
+RENDER_QUEUE_DEPTH = metrics.gauge("manim_gpt_render_queue_depth", "等待渲染名额的请求数")
+JOB_QUEUE_DEPTH = metrics.gauge("manim_gpt_job_queue_depth", "排队中的异步生成任务数")
+
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "manim_gpt_llm_request_duration_seconds", "单次LLM调用耗时（秒）", ["model", "status"]
+)
+LLM_TTFT_SECONDS = metrics.histogram(
+    "manim_gpt_llm_time_to_first_token_seconds", "流式LLM调用的首token耗时（秒）", ["model"]
+)
+LLM_CALL_TOKENS = metrics.histogram(
+    "manim_gpt_llm_call_tokens", "单次LLM调用的令牌总数", ["model"],
+    buckets=(250, 500, 1000, 2000, 4000, 8000, 16000)
+)
+LLM_TOKENS_TOTAL = metrics.counter(
+    "manim_gpt_llm_tokens_total", "LLM令牌用量（type: prompt/cached/completion）", ["model", "type"]
+)
+LLM_COST_TOTAL = metrics.counter(
+    "manim_gpt_llm_cost_usd_total", "按单价估算的LLM费用（美元）", ["model"]
+)
+
+ASR_SECONDS = metrics.histogram(
+    "manim_gpt_asr_duration_seconds", "语音识别耗时（秒，含重试）", ["status"]
+)
@@ -8,6 +8,7 @@ from enum import Enum
 
 class ModelType(str, Enum):
     """支持的LLM模型类型"""
+    AUTO = "auto"
     DEEPSEEK_CHAT = "deepseek-chat"
     DEEPSEEK_CODER = "deepseek-coder"
     GPT_4 = "gpt-4"
@@ -26,10 +27,18 @@ class QualityType(str, Enum):
 class GenerationRequest(BaseModel):
     """生成动画请求"""
     prompt: str = Field(..., description="用户输入的描述")
-    model: ModelType = Field(ModelType.DEEPSEEK_CHAT, description="使用的LLM模型")
+    model: ModelType = Field(ModelType.DEEPSEEK_CHAT, description="使用的LLM模型（auto为按服务商健康状况和延迟自动选择）")
     quality: QualityType = Field(QualityType.MEDIUM, description="视频质量")
     temperature: float = Field(0.7, ge=0.0, le=2.0, description="生成温度")
     max_tokens: int = Field(4000, ge=100, le=8000, description="最大token数")
+    use_cache: Optional[bool] = Field(None, description="是否使用LLM响应缓存（为空时只有温度为0的请求使用，温度>0默认不使用，可按服务端配置调整）")
+    progressive: bool = Field(False, description="渐进模式：先返回最后一帧草稿图，最终视频在后台渲染")
+    session_id: Optional[str] = Field(None, description="编辑会话ID：同一会话的渲染复用未改动动画的分段视频")
+    conversation_id: Optional[str] = Field(None, description="多轮对话ID：服务端保存历史和当前代码，之后的请求只需发送修改要求")
+    auto_repair: bool = Field(False, description="代码验证或渲染失败时，把错误交给LLM自动修复并重新渲染")
+    race: bool = Field(False, description="竞速模式：同时向多个模型（或同一模型多次采样）请求代码，渲染第一个通过验证的结果")
+    race_models: Optional[List[ModelType]] = Field(None, description="竞速模式使用的模型，为空时按服务端配置或使用model")
+    race_samples: int = Field(1, ge=1, le=4, description="竞速模式下每个模型的采样次数")
 
 class GenerationResponse(BaseModel):
     """生成动画响应"""
@@ -39,17 +48,78 @@ class GenerationResponse(BaseModel):
     video_path: Optional[str] = Field(None, description="生成的视频路径")
     execution_time: Optional[float] = Field(None, description="执行时间（秒）")
     error: Optional[str] = Field(None, description="错误信息")
+    resource_usage: Optional[Dict[str, Any]] = Field(None, description="渲染资源占用（CPU秒数、内存峰值、耗时）")
+    draft_path: Optional[str] = Field(None, description="渐进模式下的草稿图路径")
+    render_id: Optional[str] = Field(None, description="渐进模式下后台最终渲染的ID")
+    render_status: Optional[str] = Field(None, description="最终视频状态：rendering/done/failed")
+    repair_attempts: Optional[List[Dict[str, Any]]] = Field(None, description="自动修复的每次尝试（各阶段耗时、令牌用量、结果）")
+    model_used: Optional[str] = Field(None, description="生成最终代码的模型（竞速模式下为胜出的模型）")
+    conversation_id: Optional[str] = Field(None, description="多轮对话ID")
+    edit_mode: Optional[str] = Field(None, description="多轮对话中本轮代码的生成方式：new/patch/full")
+    race_candidates: Optional[List[Dict[str, Any]]] = Field(None, description="竞速模式下各候选的返回耗时和结果")
+    prompt_version: Optional[str] = Field(None, description="生成代码所用的系统提示词版本")
+    semantic_match: Optional[Dict[str, Any]] = Field(None, description="语义缓存命中的历史描述、相似度和方式（reuse/few_shot）")
+    llm_usage: Optional[Dict[str, Any]] = Field(None, description="本次请求全部LLM调用的令牌用量（含前缀缓存命中）、估算费用（美元）和耗时")
+
+class RenderStatusResponse(BaseModel):
+    """渐进渲染状态"""
+    render_id: str = Field(..., description="渲染ID")
+    status: str = Field(..., description="最终视频状态：rendering/done/failed")
+    video_path: Optional[str] = Field(None, description="最终视频路径")
+    draft_path: Optional[str] = Field(None, description="草稿图路径")
+    error: Optional[str] = Field(None, description="错误信息")
+
+class ConversationResponse(BaseModel):
+    """多轮对话状态"""
+    conversation_id: str = Field(..., description="对话ID")
+    code: Optional[str] = Field(None, description="当前代码")
+    turns: List[Dict[str, Any]] = Field(default_factory=list, description="历次修改要求")
+    created_at: float = Field(..., description="创建时间戳")
+    updated_at: float = Field(..., description="最近更新时间戳")
+
+class JobStatus(str, Enum):
+    """异步生成任务状态"""
+    QUEUED = "queued"
+    LLM = "llm"
+    RENDERING = "rendering"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class JobRequest(GenerationRequest):
+    """异步生成任务请求"""
+    priority: int = Field(5, ge=0, le=9, description="优先级，数值越小越先执行")
+
+class JobResponse(BaseModel):
+    """异步生成任务状态响应"""
+    job_id: str = Field(..., description="任务ID")
+    status: JobStatus = Field(..., description="任务状态")
+    priority: int = Field(..., description="优先级")
+    message: Optional[str] = Field(None, description="状态消息")
+    code: Optional[str] = Field(None, description="生成的Manim代码")
+    video_path: Optional[str] = Field(None, description="生成的视频路径")
+    error: Optional[str] = Field(None, description="错误信息")
+    created_at: float = Field(..., description="创建时间戳")
+    started_at: Optional[float] = Field(None, description="开始执行时间戳")
+    finished_at: Optional[float] = Field(None, description="结束时间戳")
+    timings: Dict[str, float] = Field(default_factory=dict, description="各阶段耗时（秒）")
 
 class PreviewRequest(BaseModel):
     """预览请求"""
     code: str = Field(..., description="Manim代码")
     quality: QualityType = Field(QualityType.MEDIUM, description="视频质量")
+    progressive: bool = Field(False, description="渐进模式：先返回最后一帧草稿图，最终视频在后台渲染")
+    session_id: Optional[str] = Field(None, description="编辑会话ID：同一会话的渲染复用未改动动画的分段视频")
 
 class PreviewResponse(BaseModel):
     """预览响应"""
     success: bool = Field(..., description="是否成功")
     video_path: Optional[str] = Field(None, description="预览视频路径")
     error: Optional[str] = Field(None, description="错误信息")
+    resource_usage: Optional[Dict[str, Any]] = Field(None, description="渲染资源占用（CPU秒数、内存峰值、耗时）")
+    draft_path: Optional[str] = Field(None, description="渐进模式下的草稿图路径")
+    render_id: Optional[str] = Field(None, description="渐进模式下后台最终渲染的ID")
+    render_status: Optional[str] = Field(None, description="最终视频状态：rendering/done/failed")
 
 class SaveRequest(BaseModel):
     """保存请求"""
@@ -0,0 +1,114 @@
+"""
+渲染准入控制
+
+限制同时进行的渲染数量，超出的请求进入有界等待队列；
+队列已满或等待超时的请求立即被拒绝，并给出建议的重试时间。
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator
+
+from app.core.logger import manim_logger
+
+class AdmissionRejected(Exception):
+    """渲染请求被拒绝（队列已满或等待超时）"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """带有界等待队列的并发控制"""
+
+    # 用于估算重试时间和统计的样本窗口
+    SAMPLE_WINDOW = 1000
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait: float):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._active = 0
+        self._waiting = 0
+
+        self._wait_times = deque(maxlen=self.SAMPLE_WINDOW)
+        self._service_times = deque(maxlen=self.SAMPLE_WINDOW)
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def _retry_after(self) -> int:
+        """按平均渲染耗时和排队深度估算重试等待秒数"""
+        avg_service = sum(self._service_times) / len(self._service_times) if self._service_times else 10.0
+        return max(1, math.ceil(avg_service * (self._waiting + 1) / self.max_concurrent))
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """获取渲染名额，失败时抛出 AdmissionRejected"""
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            retry_after = self._retry_after()
+            manim_logger.warning(f"渲染队列已满，拒绝请求 - 排队: {self._waiting}, 建议重试: {retry_after}秒")
+            raise AdmissionRejected(f"渲染队列已满（{self._waiting}个请求排队中）", retry_after)
+
+        wait_start = time.monotonic()
+        if not self._semaphore.locked():
+            # 有空闲名额时同步获取，保证并发到达的请求能看到准确的占用情况
+            await self._semaphore.acquire()
+        else:
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                retry_after = self._retry_after()
+                manim_logger.warning(f"等待渲染名额超时（{self.max_wait}秒），拒绝请求")
+                raise AdmissionRejected(f"等待渲染超时（{self.max_wait}秒）", retry_after)
+            finally:
+                self._waiting -= 1
+
+        wait_time = time.monotonic() - wait_start
+        self._wait_times.append(wait_time)
+        self.admitted += 1
+        self._active += 1
+        if wait_time > 1:
+            manim_logger.info(f"获得渲染名额 - 等待: {wait_time:.2f}秒")
+
+        service_start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_times.append(time.monotonic() - service_start)
+            self._active -= 1
+            self._semaphore.release()
+
+    @property
+    def active(self) -> int:
+        """正在渲染的请求数"""
+        return self._active
+
+    @property
+    def queue_depth(self) -> int:
+        """等待渲染名额的请求数"""
+        return self._waiting
+
+    def get_stats(self) -> Dict[str, Any]:
+        """队列深度与等待时间统计"""
+        waits = sorted(self._wait_times)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "queue_depth": self._waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_avg_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "wait_p95_seconds": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+            "wait_max_seconds": round(waits[-1], 3) if waits else 0.0
+        }
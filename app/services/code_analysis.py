@@ -0,0 +1,194 @@
+"""
+Manim代码静态分析
+
+对生成的代码只做一次AST解析，得到场景类、基类、导入的名称和发现的问题，
+结果按代码哈希缓存，供代码验证、场景发现和渲染缓存键共用。
+"""
+
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set
+
+from app.core.logger import manim_logger
+
+def normalize_code(code: str) -> str:
+    """规范化源码：统一换行并去除行尾与首尾空白"""
+    lines = code.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+def _base_names(node: ast.ClassDef) -> List[str]:
+    """类定义中的基类名（Foo 或 module.Foo 取 Foo）"""
+    names = []
+    for base in node.bases:
+        if isinstance(base, ast.Name):
+            names.append(base.id)
+        elif isinstance(base, ast.Attribute):
+            names.append(base.attr)
+    return names
+
+def _defines_method(node: ast.ClassDef, name: str) -> bool:
+    return any(
+        isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and item.name == name
+        for item in node.body
+    )
+
+class CodeAnalysis:
+    """一段代码的分析结果（只读）"""
+
+    def __init__(self, code: str):
+        self.code_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()
+        self.tree: Optional[ast.Module] = None
+        self.syntax_error: Optional[str] = None
+
+        # 场景类信息，按源码顺序：{"name", "bases", "has_construct", "line", "renderable"}
+        self.scenes: List[Dict[str, Any]] = []
+        # 通过 import / from ... import 引入的名称，以及 import * 的模块
+        self.imported_names: Set[str] = set()
+        self.star_imports: List[str] = []
+        # 发现的问题：{"rule", "message", "line"}
+        self.problems: List[Dict[str, Any]] = []
+        # 静态检查规则的结果，由规则引擎首次检查时填充
+        self.rule_problems: Optional[List[Dict[str, Any]]] = None
+
+        try:
+            self.tree = ast.parse(code)
+            # 编译AST以发现ast.parse不报告的错误（如函数外的return）
+            compile(self.tree, '<string>', 'exec')
+        except SyntaxError as e:
+            self.tree = None
+            self.syntax_error = str(e)
+            self.problems.append({"rule": "syntax", "message": f"语法错误: {e}", "line": e.lineno})
+
+        if self.tree is not None:
+            self._collect_imports()
+            self._collect_scenes()
+
+        # 渲染缓存使用AST指纹，只改动注释或空白的代码可以命中同一缓存
+        if self.tree is not None:
+            fingerprint_source = ast.dump(self.tree, include_attributes=False)
+        else:
+            fingerprint_source = normalize_code(code)
+        self.fingerprint = hashlib.sha256(fingerprint_source.encode('utf-8')).hexdigest()
+
+    def _collect_imports(self):
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    self.imported_names.add((alias.asname or alias.name).split('.')[0])
+            elif isinstance(node, ast.ImportFrom):
+                for alias in node.names:
+                    if alias.name == '*':
+                        self.star_imports.append(node.module or '')
+                    else:
+                        self.imported_names.add(alias.asname or alias.name)
+
+    def _collect_scenes(self):
+        classes = [node for node in self.tree.body if isinstance(node, ast.ClassDef)]
+        by_name = {node.name: node for node in classes}
+
+        # 反复扫描，直到同一文件内的间接继承也全部识别出来
+        scene_classes: Set[str] = set()
+        changed = True
+        while changed:
+            changed = False
+            for node in classes:
+                if node.name in scene_classes:
+                    continue
+                if any(name.endswith("Scene") or name in scene_classes for name in _base_names(node)):
+                    scene_classes.add(node.name)
+                    changed = True
+
+        def has_construct(name: str, seen: Set[str]) -> bool:
+            node = by_name.get(name)
+            if node is None or name in seen:
+                return False
+            if _defines_method(node, "construct"):
+                return True
+            seen.add(name)
+            return any(has_construct(base, seen) for base in _base_names(node))
+
+        used_as_base = {
+            name for node in classes if node.name in scene_classes
+            for name in _base_names(node) if name in scene_classes
+        }
+
+        for node in classes:
+            if node.name not in scene_classes:
+                continue
+            info = {
+                "name": node.name,
+                "bases": _base_names(node),
+                "has_construct": has_construct(node.name, set()),
+                "line": node.lineno,
+                # 被同一文件中其他场景继承的中间基类不单独渲染
+                "renderable": node.name not in used_as_base
+            }
+            self.scenes.append(info)
+            if info["renderable"] and not info["has_construct"]:
+                self.problems.append({
+                    "rule": "missing_construct",
+                    "message": f"场景类 {node.name} 必须包含construct方法",
+                    "line": node.lineno
+                })
+
+        if not self.scenes:
+            self.problems.append({
+                "rule": "no_scene",
+                "message": "代码必须包含继承自Scene的类",
+                "line": None
+            })
+
+    @property
+    def scene_names(self) -> List[str]:
+        """需要渲染的场景类名"""
+        return [scene["name"] for scene in self.scenes if scene["renderable"]]
+
+    @property
+    def valid(self) -> bool:
+        return not self.problems
+
+class CodeAnalyzer:
+    """按代码哈希缓存分析结果的LRU"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CodeAnalysis]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def analyze(self, code: str) -> CodeAnalysis:
+        """分析代码，相同代码直接返回缓存结果"""
+        key = hashlib.sha256(code.encode('utf-8')).hexdigest()
+        with self._lock:
+            analysis = self._entries.get(key)
+            if analysis is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return analysis
+            self.misses += 1
+
+        analysis = CodeAnalysis(code)
+        manim_logger.debug(
+            f"代码分析完成 - 场景: {analysis.scene_names}, 问题: {len(analysis.problems)}"
+        )
+
+        with self._lock:
+            self._entries[key] = analysis
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return analysis
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+# 全局代码分析实例
+code_analyzer = CodeAnalyzer()
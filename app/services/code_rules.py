@@ -0,0 +1,234 @@
+"""
+渲染前的静态检查规则
+
+在AST上运行一组可配置的规则，渲染前几毫秒内拒绝注定失败的代码
+（禁用的API、manim中不存在的名称、没有出口的死循环），避免占用渲染名额。
+"""
+
+import ast
+import asyncio
+import builtins
+import json
+import subprocess
+import sys
+import threading
+from typing import Dict, Any, Callable, List, Optional, Set
+
+from app.core.config import settings
+from app.core.logger import manim_logger
+from app.services.code_analysis import CodeAnalysis
+
+# 规则函数：接收分析结果和规则引擎，返回发现的问题 {"rule", "message", "line"}
+Rule = Callable[[CodeAnalysis, "RuleEngine"], List[Dict[str, Any]]]
+
+def _problem(rule: str, message: str, line: Optional[int]) -> Dict[str, Any]:
+    if line:
+        message = f"第{line}行: {message}"
+    return {"rule": rule, "message": message, "line": line}
+
+def _call_name(node: ast.Call) -> Optional[str]:
+    """被调用对象的名称（Foo() 或 obj.foo() 取 Foo / foo）"""
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    return None
+
+def rule_forbidden_api(analysis: CodeAnalysis, engine: "RuleEngine") -> List[Dict[str, Any]]:
+    """使用了禁用的类或方法（如依赖LaTeX的Tex、MathTex）"""
+    problems = []
+    for node in ast.walk(analysis.tree):
+        name = None
+        if isinstance(node, ast.Call):
+            name = _call_name(node)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            # 未调用的引用（如作为参数传递的类）同样会在渲染时失败
+            name = node.id
+        if name in engine.forbidden_names:
+            problems.append(_problem(
+                "forbidden_api",
+                f"禁止使用 {name}（当前渲染环境不支持）",
+                getattr(node, "lineno", None)
+            ))
+    # 同一位置的调用和名称引用只报告一次
+    unique = {(p["line"], p["message"]): p for p in problems}
+    return list(unique.values())
+
+def _bound_names(tree: ast.AST) -> Set[str]:
+    """代码中任意位置绑定过的名称（不区分作用域，宁可漏报也不误报）"""
+    names: Set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, ast.alias):
+            names.add((node.asname or node.name).split('.')[0])
+        elif hasattr(ast, "MatchAs") and isinstance(node, ast.MatchAs) and node.name:
+            names.add(node.name)
+    return names
+
+def rule_unknown_name(analysis: CodeAnalysis, engine: "RuleEngine") -> List[Dict[str, Any]]:
+    """引用了既未定义、也不在manim导出中的名称"""
+    # 从manim以外的模块做了星号导入时无法确定名称来源，跳过检查
+    if any(module.split('.')[0] != "manim" for module in analysis.star_imports):
+        return []
+
+    # 禁用的名称由forbidden_api规则报告，这里不再重复
+    known = _bound_names(analysis.tree) | set(dir(builtins)) | {"__name__", "__file__"}
+    known |= engine.forbidden_names
+    hint = ""
+    if analysis.star_imports:
+        hint = "（manim中不存在该对象）"
+        exports = engine.manim_exports()
+        if exports is None:
+            return []
+        known |= exports
+
+    problems = []
+    reported: Set[str] = set()
+    for node in ast.walk(analysis.tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            if node.id not in known and node.id not in reported:
+                reported.add(node.id)
+                problems.append(_problem(
+                    "unknown_name",
+                    f"未定义的名称 {node.id}{hint}",
+                    node.lineno
+                ))
+    return problems
+
+def _is_constant_true(node: ast.expr) -> bool:
+    return isinstance(node, ast.Constant) and bool(node.value)
+
+def _loop_exits(body: List[ast.stmt]) -> bool:
+    """循环体内是否有break/return/raise能够退出当前循环"""
+    stack = list(body)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.Break, ast.Return, ast.Raise)):
+            return True
+        # 内层循环的break只退出内层循环，内部定义的函数与当前循环无关
+        if isinstance(node, (ast.While, ast.For, ast.AsyncFor)):
+            stack.extend(
+                child for child in ast.walk(node)
+                if isinstance(child, (ast.Return, ast.Raise))
+            )
+            continue
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            continue
+        stack.extend(ast.iter_child_nodes(node))
+    return False
+
+def rule_unbounded_loop(analysis: CodeAnalysis, engine: "RuleEngine") -> List[Dict[str, Any]]:
+    """条件恒为真且没有退出语句的while循环，渲染会一直运行到超时"""
+    problems = []
+    for node in ast.walk(analysis.tree):
+        if isinstance(node, ast.While) and _is_constant_true(node.test) and not _loop_exits(node.body):
+            problems.append(_problem(
+                "unbounded_loop",
+                "while循环条件恒为真且没有break，渲染将无法结束",
+                node.lineno
+            ))
+    return problems
+
+# 内置规则，按名称启用或禁用
+BUILTIN_RULES: Dict[str, Rule] = {
+    "forbidden_api": rule_forbidden_api,
+    "unknown_name": rule_unknown_name,
+    "unbounded_loop": rule_unbounded_loop,
+}
+
+class RuleEngine:
+    """按配置运行静态检查规则，并统计各规则的命中次数"""
+
+    def __init__(
+        self,
+        forbidden_names: List[str],
+        disabled_rules: Optional[List[str]] = None,
+        rules: Optional[Dict[str, Rule]] = None
+    ):
+        self.forbidden_names: Set[str] = set(forbidden_names)
+        self.disabled_rules: Set[str] = set(disabled_rules or [])
+        self.rules: Dict[str, Rule] = dict(rules or BUILTIN_RULES)
+
+        # manim包导出的名称，由load_manim_exports在启动时从独立进程中读取
+        self._manim_exports: Optional[Set[str]] = None
+
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.rejected = 0
+        self.hits: Dict[str, int] = {}
+
+    def manim_exports(self) -> Optional[Set[str]]:
+        """manim包导出的名称，尚未加载或manim不可用时返回None（此时不检查未知名称）"""
+        return self._manim_exports
+
+    async def load_manim_exports(self, timeout: float = 120) -> None:
+        """在子进程中导入manim并读取导出的名称，避免在API进程中导入manim（耗时数秒且占用大量内存）"""
+        cmd = [sys.executable, "-c", "import json, manim; print(json.dumps(sorted(dir(manim))))"]
+        try:
+            result = await asyncio.to_thread(subprocess.run, cmd, capture_output=True, timeout=timeout)
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.decode("utf-8", errors="replace")[-300:])
+            self._manim_exports = set(json.loads(result.stdout))
+            manim_logger.info(f"已加载manim导出名称 - 数量: {len(self._manim_exports)}")
+        except Exception as e:
+            manim_logger.warning(f"读取manim导出名称失败，跳过未知名称检查: {str(e)}")
+
+    def check(self, analysis: CodeAnalysis) -> List[Dict[str, Any]]:
+        """返回分析结果中的全部问题（结构问题和规则发现的问题），并记录命中次数"""
+        problems = list(analysis.problems)
+        if analysis.tree is not None:
+            problems.extend(self._run_rules(analysis))
+
+        with self._lock:
+            self.checks += 1
+            if problems:
+                self.rejected += 1
+            for rule in {problem["rule"] for problem in problems}:
+                self.hits[rule] = self.hits.get(rule, 0) + 1
+        return problems
+
+    def _run_rules(self, analysis: CodeAnalysis) -> List[Dict[str, Any]]:
+        # 同一代码的分析结果是缓存共享的，规则结果也只计算一次
+        if analysis.rule_problems is not None:
+            return analysis.rule_problems
+
+        problems: List[Dict[str, Any]] = []
+        for name, rule in self.rules.items():
+            if name in self.disabled_rules:
+                continue
+            try:
+                problems.extend(rule(analysis, self))
+            except Exception as e:
+                # 规则自身出错不应阻止渲染
+                manim_logger.error(f"静态检查规则执行异常 - 规则: {name}, 错误: {str(e)}", exc_info=True)
+        if self._manim_exports is not None or not analysis.star_imports:
+            # manim导出名称尚未加载时结果不完整，不缓存
+            analysis.rule_problems = problems
+        return problems
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checks": self.checks,
+                "rejected": self.rejected,
+                "disabled_rules": sorted(self.disabled_rules),
+                "hits": dict(self.hits)
+            }
+
+def _split_setting(value: str) -> List[str]:
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+# 全局规则引擎实例
+rule_engine = RuleEngine(
+    forbidden_names=_split_setting(settings.code_forbidden_names),
+    disabled_rules=_split_setting(settings.code_disabled_rules)
+)
@@ -0,0 +1,299 @@
+"""
+多轮对话会话
+
+服务端按会话ID保存历次修改要求和当前代码，客户端只需发送本轮的修改要求。
+历史按令牌预算截断压缩后作为上下文；模型返回SEARCH/REPLACE修改块而不是完整文件，
+减少输出令牌和生成延迟，修改块无法应用时再退回到完整文件模式。
+"""
+
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logger import llm_logger
+from app.models.schemas import ModelType
+from app.services.code_analysis import code_analyzer
+from app.services.llm_service import llm_service, LLMService
+
+_PATCH_RE = re.compile(
+    r"^<{5,}\s*SEARCH[^\n]*\n(.*?)^={5,}[^\n]*\n(.*?)^>{5,}\s*REPLACE[^\n]*$",
+    re.DOTALL | re.MULTILINE
+)
+
+# 超出预算的较早轮次只保留要求的开头
+_COMPACT_TURN_CHARS = 40
+
+class PatchError(Exception):
+    """修改块无法应用到当前代码"""
+
+def _find_loose(lines: List[str], search_lines: List[str]) -> List[int]:
+    """忽略行尾空白查找连续行，返回全部匹配的起始行号"""
+    target = [line.rstrip() for line in search_lines]
+    stripped = [line.rstrip() for line in lines]
+    size = len(target)
+    return [
+        index for index in range(len(lines) - size + 1)
+        if stripped[index:index + size] == target
+    ]
+
+def apply_patches(code: str, content: str) -> Tuple[str, int]:
+    """把回复中的SEARCH/REPLACE块依次应用到代码上，返回新代码和修改块数量"""
+    blocks = _PATCH_RE.findall(content)
+    if not blocks:
+        raise PatchError("回复中没有SEARCH/REPLACE修改块")
+
+    for search, replace in blocks:
+        if not search.strip():
+            raise PatchError("SEARCH部分为空，无法确定修改位置")
+
+        count = code.count(search)
+        if count == 1:
+            code = code.replace(search, replace, 1)
+            continue
+        if count > 1:
+            raise PatchError(f"SEARCH部分在代码中出现了{count}次: {search.strip()[:60]}")
+
+        # 模型常会改动行尾空白，按行宽松匹配
+        lines = code.split("\n")
+        search_lines = search.rstrip("\n").split("\n")
+        matches = _find_loose(lines, search_lines)
+        if len(matches) != 1:
+            raise PatchError(f"SEARCH部分与当前代码不一致: {search.strip()[:60]}")
+        start = matches[0]
+        replace_lines = replace.rstrip("\n").split("\n") if replace.strip() else []
+        code = "\n".join(lines[:start] + replace_lines + lines[start + len(search_lines):])
+
+    return code, len(blocks)
+
+class ConversationStore:
+    """基于SQLite的会话存储"""
+
+    def __init__(self, db_path: Path, ttl_seconds: int):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=5)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "id TEXT PRIMARY KEY, code TEXT, turns TEXT NOT NULL DEFAULT '[]', "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at)")
+        self._conn.commit()
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM conversations WHERE id = ? AND updated_at >= ?",
+                (conversation_id, time.time() - self.ttl_seconds)
+            ).fetchone()
+        if row is None:
+            return None
+        conversation = dict(row)
+        conversation["conversation_id"] = conversation.pop("id")
+        conversation["turns"] = json.loads(conversation["turns"] or "[]")
+        return conversation
+
+    def save(self, conversation_id: str, code: str, turns: List[Dict[str, Any]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO conversations (id, code, turns, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET code = excluded.code, turns = excluded.turns, "
+                "updated_at = excluded.updated_at",
+                (conversation_id, code, json.dumps(turns, ensure_ascii=False), now, now)
+            )
+            # 顺带清理过期会话
+            self._conn.execute("DELETE FROM conversations WHERE updated_at < ?", (now - self.ttl_seconds,))
+            self._conn.commit()
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ConversationService:
+    """多轮对话式的代码生成与修改"""
+
+    def __init__(self, store: ConversationStore, context_tokens: int, max_turns: int):
+        self.store = store
+        self.context_tokens = context_tokens
+        self.max_turns = max_turns
+        # 同一会话的请求串行执行，避免并发修改互相覆盖；没有请求使用时即移除，过期会话不会残留
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+
+        self.patch_edits = 0
+        self.full_edits = 0
+        self.patch_failures = 0
+
+    def build_history(self, turns: List[Dict[str, Any]]) -> str:
+        """把历次修改要求压缩到令牌预算内：最近的轮次完整保留，较早的只保留开头，再早的省略"""
+        if not turns:
+            return ""
+
+        budget = self.context_tokens
+        lines: List[str] = []
+        omitted = 0
+        for number, turn in reversed(list(enumerate(turns, 1))):
+            line = f"第{number}轮: {turn['prompt']}"
+            cost = LLMService.estimate_tokens(line)
+            if cost > budget:
+                line = f"第{number}轮: {turn['prompt'][:_COMPACT_TURN_CHARS]}…"
+                cost = LLMService.estimate_tokens(line)
+            if cost > budget:
+                omitted = number
+                break
+            budget -= cost
+            lines.append(line)
+
+        lines.reverse()
+        if omitted:
+            lines.insert(0, f"（更早的{omitted}轮修改已省略）")
+        return "之前的修改要求（当前代码已包含这些修改）：\n" + "\n".join(lines) + "\n\n"
+
+    @asynccontextmanager
+    async def lock(self, conversation_id: str) -> AsyncIterator[None]:
+        """会话锁：调用方从 generate 到渲染完成、commit_turn 期间持有，同一会话的下一轮基于本轮结果修改"""
+        lock = self._locks.setdefault(conversation_id, asyncio.Lock())
+        self._lock_users[conversation_id] = self._lock_users.get(conversation_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[conversation_id] -= 1
+            if not self._lock_users[conversation_id]:
+                del self._lock_users[conversation_id]
+                self._locks.pop(conversation_id, None)
+
+    async def generate(
+        self,
+        conversation_id: str,
+        prompt: str,
+        model: ModelType = ModelType.DEEPSEEK_CHAT,
+        temperature: float = 0.7,
+        max_tokens: int = 4000,
+        use_cache: Optional[bool] = None,
+        quality: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """处理会话中的一轮请求
+
+        首轮生成完整代码，之后的轮次以修改块编辑当前代码。
+        返回 generate_manim_code 格式的结果，额外包含 conversation_id、turn 和 edit_mode（new/patch/full）。
+        生成的代码不在这里保存，调用方在代码渲染成功后调用 commit_turn；
+        两者需在同一个 lock(conversation_id) 中调用。
+        """
+        conversation = self.store.get(conversation_id)
+        turns = conversation["turns"] if conversation else []
+        current_code = conversation["code"] if conversation else None
+
+        if not current_code:
+            result = await llm_service.generate_manim_code(
+                prompt=prompt,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                use_cache=use_cache,
+                quality=quality
+            )
+            edit_mode = "new"
+        else:
+            result, edit_mode = await self._edit(current_code, turns, prompt, model, temperature, max_tokens)
+
+        turn = len(turns) + 1 if result["success"] else len(turns)
+        return {**result, "conversation_id": conversation_id, "turn": turn, "edit_mode": edit_mode}
+
+    async def _edit(
+        self,
+        code: str,
+        turns: List[Dict[str, Any]],
+        prompt: str,
+        model: ModelType,
+        temperature: float,
+        max_tokens: int
+    ) -> Tuple[Dict[str, Any], str]:
+        history = self.build_history(turns)
+        result = await llm_service.edit_manim_code(
+            instruction=prompt,
+            code=code,
+            history=history,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        if not result["success"]:
+            return result, "patch"
+
+        try:
+            new_code, blocks = apply_patches(code, result["content"])
+            self.patch_edits += 1
+            llm_logger.info(f"已应用修改块 - 数量: {blocks}, 代码长度: {len(code)} -> {len(new_code)}")
+            return {**result, "code": new_code}, "patch"
+        except PatchError as e:
+            # 模型没有按格式回复而是直接给出了完整场景代码，直接采用
+            if result.get("code") and code_analyzer.analyze(result["code"]).scenes and "SEARCH" not in result["content"]:
+                self.full_edits += 1
+                return result, "full"
+            self.patch_failures += 1
+            llm_logger.warning(f"修改块无法应用，改为请求完整代码: {str(e)}")
+
+        result = await llm_service.edit_manim_code(
+            instruction=prompt,
+            code=code,
+            history=history,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            full_file=True
+        )
+        if result["success"]:
+            self.full_edits += 1
+        return result, "full"
+
+    def commit_turn(self, conversation_id: str, prompt: str, edit_mode: Optional[str], code: str) -> None:
+        """本轮代码（含自动修复后的代码）渲染成功后写入会话，失败的修改不会成为之后修改的基础"""
+        conversation = self.store.get(conversation_id)
+        turns = conversation["turns"] if conversation else []
+        turns.append({"prompt": prompt, "edit_mode": edit_mode, "created_at": time.time()})
+        turns = turns[-self.max_turns:]
+        self.store.save(conversation_id, code, turns)
+        llm_logger.info(f"会话已更新 - ID: {conversation_id}, 轮次: {len(turns)}, 模式: {edit_mode}")
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(conversation_id)
+
+    def delete(self, conversation_id: str) -> bool:
+        return self.store.delete(conversation_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "patch_edits": self.patch_edits,
+            "full_edits": self.full_edits,
+            "patch_failures": self.patch_failures
+        }
+
+# 全局会话服务实例
+conversation_service = ConversationService(
+    store=ConversationStore(
+        settings.cache_dir / "conversations.sqlite3",
+        ttl_seconds=settings.conversation_ttl_hours * 3600
+    ),
+    context_tokens=settings.conversation_context_tokens,
+    max_turns=settings.conversation_max_turns
+)
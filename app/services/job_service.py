@@ -0,0 +1,398 @@
+"""
+异步动画生成任务队列
+
+任务提交后立即返回ID，由后台固定数量的执行协程按优先级依次处理。
+任务状态保存在SQLite中，服务重启后未完成的任务会重新排队。
+"""
+
+import asyncio
+import itertools
+import json
+import math
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from app.core.config import settings
+from app.core.logger import app_logger, job_id_var
+from app.core.metrics import STAGE_SECONDS, GENERATIONS_TOTAL, JOB_QUEUE_DEPTH
+from app.models.schemas import JobRequest, JobStatus, ModelType
+from app.services.llm_service import llm_service
+from app.services.prompt_registry import prompt_registry
+from app.services.manim_service import manim_service
+from app.services.admission import AdmissionRejected
+from app.services.repair_service import repair_service
+from app.services.conversation_service import conversation_service
+
+class JobQueueFull(Exception):
+    """任务队列已满"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class JobStore:
+    """基于SQLite的任务存储"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=5)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "request TEXT NOT NULL, message TEXT, code TEXT, video_path TEXT, error TEXT, "
+            "timings TEXT NOT NULL DEFAULT '{}', created_at REAL NOT NULL, "
+            "started_at REAL, finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+        self._conn.commit()
+
+    def create(self, job_id: str, request: JobRequest) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, request, message, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, JobStatus.QUEUED.value, request.priority, request.model_dump_json(), "任务已排队", now)
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def update(self, job_id: str, **fields) -> None:
+        if "timings" in fields:
+            fields["timings"] = json.dumps(fields["timings"])
+        if "status" in fields and isinstance(fields["status"], JobStatus):
+            fields["status"] = fields["status"].value
+
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["job_id"] = job.pop("id")
+        job["timings"] = json.loads(job["timings"] or "{}")
+        return job
+
+    def list_unfinished(self) -> list:
+        """重启时需要恢复的任务（排队中或执行到一半被中断）"""
+        statuses = (JobStatus.QUEUED.value, JobStatus.LLM.value, JobStatus.RENDERING.value)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, priority, request, created_at FROM jobs WHERE status IN (?, ?, ?) ORDER BY created_at",
+                statuses
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class JobManager:
+    """按优先级调度生成任务，并限制同时执行的任务数"""
+
+    # 用于估算重试时间的任务耗时样本窗口
+    SAMPLE_WINDOW = 100
+    # 尚无样本时假定的单个任务耗时（秒）
+    DEFAULT_JOB_SECONDS = 60.0
+
+    def __init__(self, store: JobStore, concurrency: int, max_queue_size: int):
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.max_queue_size = max_queue_size
+
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self._workers: list = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._job_times = deque(maxlen=self.SAMPLE_WINDOW)
+        JOB_QUEUE_DEPTH.set_function(lambda: self._queue.qsize() if self._queue else 0)
+
+    async def start(self):
+        """启动执行协程并恢复未完成的任务"""
+        self._queue = asyncio.PriorityQueue()
+
+        recovered = 0
+        for row in self.store.list_unfinished():
+            self.store.update(row["id"], status=JobStatus.QUEUED, message="服务重启后重新排队")
+            self._queue.put_nowait((row["priority"], next(self._sequence), row["id"]))
+            recovered += 1
+
+        self._workers = [
+            asyncio.create_task(self._worker_loop(index), name=f"job-worker-{index}")
+            for index in range(self.concurrency)
+        ]
+        app_logger.info(f"任务队列已启动 - 并发数: {self.concurrency}, 恢复任务: {recovered}")
+
+    async def stop(self):
+        """停止执行协程（正在执行的任务保持原状态，下次启动时重新排队）"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        app_logger.info("任务队列已停止")
+
+    def submit(self, request: JobRequest) -> Dict[str, Any]:
+        """提交任务并立即返回"""
+        if self._queue is None:
+            raise RuntimeError("任务队列未启动")
+        if self._queue.qsize() >= self.max_queue_size:
+            raise JobQueueFull(f"任务队列已满（{self.max_queue_size}）", self._retry_after())
+
+        job_id = uuid.uuid4().hex
+        job = self.store.create(job_id, request)
+        self._queue.put_nowait((request.priority, next(self._sequence), job_id))
+        app_logger.info(f"任务已提交 - ID: {job_id}, 优先级: {request.priority}, 队列长度: {self._queue.qsize()}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取消任务：排队中的直接标记，执行中的取消协程（同时终止渲染进程）"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        if job["status"] in (JobStatus.DONE.value, JobStatus.FAILED.value, JobStatus.CANCELLED.value):
+            return job
+
+        task = self._running.get(job_id)
+        if task:
+            task.cancel()
+        self.store.update(
+            job_id,
+            status=JobStatus.CANCELLED,
+            message="任务已取消",
+            finished_at=time.time()
+        )
+        app_logger.info(f"任务已取消 - ID: {job_id}")
+        return self.store.get(job_id)
+
+    def _average_job_seconds(self) -> float:
+        return sum(self._job_times) / len(self._job_times) if self._job_times else self.DEFAULT_JOB_SECONDS
+
+    def _retry_after(self) -> int:
+        """按平均任务耗时和排队深度估算队列腾出位置所需的秒数"""
+        queued = self._queue.qsize() if self._queue else 0
+        # 每完成一个任务，执行协程就从队列取走一个任务；concurrency个任务并行执行
+        needed = max(1, queued - self.max_queue_size + 1)
+        return max(1, math.ceil(self._average_job_seconds() * needed / self.concurrency))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": len(self._running),
+            "avg_job_seconds": round(self._average_job_seconds(), 2) if self._job_times else None
+        }
+
+    async def _worker_loop(self, index: int):
+        while True:
+            _, _, job_id = await self._queue.get()
+            try:
+                job = self.store.get(job_id)
+                if job is None or job["status"] != JobStatus.QUEUED.value:
+                    continue
+
+                task = asyncio.create_task(self._run_job(job))
+                self._running[job_id] = task
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    # 区分用户取消任务与执行协程本身被停止
+                    if asyncio.current_task().cancelling():
+                        raise
+                finally:
+                    self._running.pop(job_id, None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                app_logger.error(f"任务执行协程异常 - ID: {job_id}, 错误: {str(e)}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job: Dict[str, Any]):
+        request = JobRequest.model_validate_json(job["request"])
+        if request.conversation_id:
+            # 同一会话的任务从修改、渲染到保存串行执行，不会基于同一版本修改而互相覆盖
+            async with conversation_service.lock(request.conversation_id):
+                await self._execute_job(job, request)
+        else:
+            await self._execute_job(job, request)
+
+    async def _execute_job(self, job: Dict[str, Any], request: JobRequest):
+        job_id = job["job_id"]
+        # 任务在独立的协程中执行，设置后本任务内的日志都带有任务ID
+        job_id_var.set(job_id)
+        started_at = time.time()
+        timings = {"queued": started_at - job["created_at"]}
+
+        def finish(status: JobStatus, message: str, **fields):
+            finished_at = time.time()
+            timings["total"] = finished_at - started_at
+            self._job_times.append(timings["total"])
+            self.store.update(
+                job_id,
+                status=status,
+                message=message,
+                timings=timings,
+                finished_at=finished_at,
+                **fields
+            )
+            app_logger.info(f"任务结束 - ID: {job_id}, 状态: {status.value}, 耗时: {timings['total']:.2f}秒")
+
+        try:
+            # 1. 生成代码
+            self.store.update(job_id, status=JobStatus.LLM, message="正在生成代码", started_at=started_at)
+            stage_start = time.time()
+            race_models = (
+                llm_service.race_candidates(request.model, request.race_models, request.race_samples)
+                if request.race and not request.conversation_id else []
+            )
+            if request.conversation_id:
+                llm_result = await conversation_service.generate(
+                    conversation_id=request.conversation_id,
+                    prompt=request.prompt,
+                    model=request.model,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens,
+                    use_cache=request.use_cache,
+                    quality=request.quality.value
+                )
+            elif len(race_models) > 1:
+                llm_result = await llm_service.race_manim_code(
+                    prompt=request.prompt,
+                    models=race_models,
+                    validate=manim_service.validate_code,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens,
+                    use_cache=request.use_cache,
+                    quality=request.quality.value
+                )
+            else:
+                llm_result = await llm_service.generate_manim_code(
+                    prompt=request.prompt,
+                    model=request.model,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens,
+                    use_cache=request.use_cache,
+                    quality=request.quality.value
+                )
+            timings["llm"] = time.time() - stage_start
+            STAGE_SECONDS.observe(timings["llm"], stage="llm")
+            model_used = ModelType(llm_result.get("model", request.model.value))
+            quality = request.quality.value
+            if race_models:
+                app_logger.info(f"竞速生成结果 - ID: {job_id}, 胜出模型: {model_used.value}")
+
+            if not llm_result["success"]:
+                GENERATIONS_TOTAL.inc(model=model_used.value, quality=quality, status="llm_error")
+                finish(JobStatus.FAILED, "代码生成失败", error=llm_result["error"])
+                return
+
+            code = llm_result["code"]
+
+            # 2. 验证代码
+            stage_start = time.time()
+            validation_result = llm_result.get("validation") or manim_service.validate_code(code)
+            timings["validation"] = time.time() - stage_start
+
+            if not validation_result["valid"] and not request.auto_repair:
+                prompt_registry.record_render(llm_result.get("prompt_version"), False)
+                GENERATIONS_TOTAL.inc(model=model_used.value, quality=quality, status="invalid_code")
+                finish(JobStatus.FAILED, "生成的代码无效", code=code, error=validation_result["error"])
+                return
+
+            async def render(code: str) -> Dict[str, Any]:
+                while True:
+                    try:
+                        return await manim_service.execute_manim_code(
+                            code=code,
+                            quality=request.quality,
+                            session_id=request.session_id
+                        )
+                    except AdmissionRejected as e:
+                        # 异步任务不需要立即返回，渲染繁忙时稍后重试
+                        self.store.update(job_id, message=f"渲染繁忙，{e.retry_after}秒后重试")
+                        await asyncio.sleep(e.retry_after)
+
+            # 3. 渲染视频
+            manim_result = None
+            if validation_result["valid"]:
+                self.store.update(job_id, status=JobStatus.RENDERING, message="正在渲染视频", code=code, timings=timings)
+                stage_start = time.time()
+                manim_result = await render(code)
+                timings["render"] = time.time() - stage_start
+                failure = None if manim_result["success"] else manim_result["error"]
+            else:
+                failure = validation_result["error"]
+
+            # 4. 失败时自动修复
+            if failure and request.auto_repair:
+                self.store.update(job_id, status=JobStatus.RENDERING, message="正在自动修复代码", code=code, timings=timings)
+                stage_start = time.time()
+                repair_result = await repair_service.repair(
+                    prompt=request.prompt,
+                    code=code,
+                    error=failure,
+                    render=render,
+                    model=model_used,
+                    max_tokens=request.max_tokens
+                )
+                timings["repair"] = time.time() - stage_start
+                for attempt in repair_result["attempts"]:
+                    timings[f"repair_attempt_{attempt['attempt']}"] = attempt["total_seconds"]
+                code = repair_result["code"]
+                if repair_result["render_result"] is not None:
+                    manim_result = repair_result["render_result"]
+                if manim_result is None:
+                    prompt_registry.record_render(llm_result.get("prompt_version"), False)
+                    GENERATIONS_TOTAL.inc(model=model_used.value, quality=quality, status="invalid_code")
+                    finish(JobStatus.FAILED, "生成的代码无效", code=code, error=repair_result["error"])
+                    return
+
+            prompt_registry.record_render(llm_result.get("prompt_version"), manim_result["success"])
+            GENERATIONS_TOTAL.inc(
+                model=model_used.value,
+                quality=quality,
+                status="success" if manim_result["success"] else "render_error"
+            )
+            if manim_result["success"]:
+                if request.conversation_id:
+                    conversation_service.commit_turn(
+                        request.conversation_id, request.prompt, llm_result.get("edit_mode"), code
+                    )
+                if llm_result.get("edit_mode") in (None, "new"):
+                    await llm_service.remember_success(
+                        request.prompt, code, model_used.value, llm_result.get("prompt_version"), quality
+                    )
+                finish(JobStatus.DONE, manim_result["message"], code=code, video_path=manim_result["video_path"])
+            else:
+                finish(JobStatus.FAILED, manim_result["message"], code=code, error=manim_result["error"])
+
+        except asyncio.CancelledError:
+            app_logger.warning(f"任务执行被中断 - ID: {job_id}")
+            raise
+        except Exception as e:
+            app_logger.error(f"任务执行异常 - ID: {job_id}, 错误: {str(e)}", exc_info=True)
+            finish(JobStatus.FAILED, "生成过程中发生错误", error=str(e))
+
+# 全局任务管理实例
+job_manager = JobManager(
+    store=JobStore(settings.cache_dir / "jobs.sqlite3"),
+    concurrency=settings.job_max_concurrency,
+    max_queue_size=settings.job_queue_max_size
+)
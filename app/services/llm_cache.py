@@ -0,0 +1,233 @@
+"""
+LLM响应缓存
+
+缓存键由模型、系统提示词版本、温度和提示词组成，
+同时按原始提示词（精确匹配）和规范化提示词（忽略空白与标点）建立索引。
+缓存分为内存LRU层和SQLite持久层，两层都带有TTL。SQLite层的读写在线程中执行，不阻塞事件循环。
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.core.logger import llm_logger
+
+class CacheBackend(ABC):
+    """缓存后端接口，新的存储层实现 get/set 即可接入"""
+
+    name = "base"
+    # 访问会阻塞（磁盘或网络I/O）的存储层在线程中调用
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """返回未过期的值，不存在时返回None"""
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any], ttl: int) -> None:
+        """写入值，ttl秒后过期"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {}
+
+class MemoryCacheBackend(CacheBackend):
+    """进程内LRU缓存"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # key -> (expires_at, value)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "max_entries": self.max_entries}
+
+class SQLiteCacheBackend(CacheBackend):
+    """基于SQLite的持久缓存，可在多个worker进程之间共享"""
+
+    name = "sqlite"
+    blocking = True
+
+    # 每写入若干次清理一次过期条目
+    PURGE_INTERVAL = 100
+
+    def __init__(self, db_path: Path, max_entries: int):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache(expires_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND expires_at >= ?",
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: int) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_INTERVAL == 0:
+                self._purge_locked(now)
+            self._conn.commit()
+
+    def _purge_locked(self, now: float):
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE key NOT IN "
+            "(SELECT key FROM llm_cache ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"entries": count, "max_entries": self.max_entries, "path": str(self.db_path)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class LLMResponseCache:
+    """多层LLM响应缓存"""
+
+    _WHITESPACE_RE = re.compile(r"\s+")
+
+    def __init__(self, tiers: List[CacheBackend], ttl: int):
+        self.tiers = tiers
+        self.ttl = ttl
+
+        self.exact_hits = 0
+        self.normalized_hits = 0
+        self.misses = 0
+        self.tier_hits: Dict[str, int] = {tier.name: 0 for tier in tiers}
+
+    @classmethod
+    def normalize_prompt(cls, prompt: str) -> str:
+        """统一全半角与大小写，去掉标点并折叠空白"""
+        text = unicodedata.normalize("NFKC", prompt).lower()
+        text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+        return cls._WHITESPACE_RE.sub(" ", text).strip()
+
+    def make_keys(
+        self,
+        model: str,
+        prompt_version: str,
+        temperature: float,
+        prompt: str
+    ) -> Dict[str, str]:
+        """生成精确匹配键和规范化匹配键"""
+        def digest(kind: str, text: str) -> str:
+            payload = json.dumps([kind, model, prompt_version, round(temperature, 3), text], ensure_ascii=False)
+            return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+        return {
+            "exact": digest("exact", prompt),
+            "normalized": digest("normalized", self.normalize_prompt(prompt))
+        }
+
+    @staticmethod
+    async def _run(tier: CacheBackend, func, *args):
+        """调用存储层方法，阻塞的存储层放到线程中执行"""
+        if tier.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    async def get(self, keys: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """依次按精确键、规范化键在各层中查找，命中后回填上层"""
+        for match in ("exact", "normalized"):
+            key = keys[match]
+            for index, tier in enumerate(self.tiers):
+                try:
+                    value = await self._run(tier, tier.get, key)
+                except Exception as e:
+                    llm_logger.warning(f"LLM缓存读取失败 - 层: {tier.name}, 错误: {str(e)}")
+                    continue
+                if value is None:
+                    continue
+
+                for upper in self.tiers[:index]:
+                    await self._run(upper, upper.set, key, value, self.ttl)
+
+                self.tier_hits[tier.name] += 1
+                if match == "exact":
+                    self.exact_hits += 1
+                else:
+                    self.normalized_hits += 1
+                llm_logger.debug(f"LLM缓存命中 - 匹配方式: {match}, 层: {tier.name}")
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, keys: Dict[str, str], value: Dict[str, Any]) -> None:
+        """同时写入精确键和规范化键"""
+        def write(tier: CacheBackend):
+            for key in keys.values():
+                tier.set(key, value, self.ttl)
+
+        for tier in self.tiers:
+            try:
+                await self._run(tier, write, tier)
+            except Exception as e:
+                llm_logger.warning(f"LLM缓存写入失败 - 层: {tier.name}, 错误: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        lookups = self.exact_hits + self.normalized_hits + self.misses
+        hits = self.exact_hits + self.normalized_hits
+        return {
+            "exact_hits": self.exact_hits,
+            "normalized_hits": self.normalized_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "tier_hits": dict(self.tier_hits),
+            "tiers": {tier.name: tier.get_stats() for tier in self.tiers}
+        }
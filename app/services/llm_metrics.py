@@ -0,0 +1,185 @@
+"""
+LLM调用的令牌、延迟与费用统计
+
+每次调用记录输入/输出/前缀缓存命中的令牌数、首token耗时、总耗时和按模型单价估算的费用。
+全局按模型累计，延迟和令牌数写入指标注册表中的直方图（/metrics 与统计接口共用）；
+同时通过上下文变量把同一个请求内的全部调用（生成、竞速、对冲、修复）汇总到该请求的用量中。
+"""
+
+import json
+import threading
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logger import llm_logger
+from app.core.metrics import (
+    LLM_REQUEST_SECONDS, LLM_TTFT_SECONDS, LLM_CALL_TOKENS, LLM_TOKENS_TOTAL, LLM_COST_TOTAL
+)
+
+# 每百万令牌的估算单价（美元）：(输入, 命中前缀缓存的输入, 输出)，可通过LLM_PRICING覆盖
+DEFAULT_PRICING: Dict[str, Tuple[float, float, float]] = {
+    "deepseek-chat": (0.27, 0.07, 1.10),
+    "deepseek-coder": (0.27, 0.07, 1.10),
+    "gpt-4": (30.0, 30.0, 60.0),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+    "qwen-turbo": (0.05, 0.02, 0.20),
+    "qwen-plus": (0.40, 0.16, 1.20),
+    "qwen-max": (1.60, 0.64, 6.40),
+}
+
+def _load_pricing(value: str) -> Dict[str, Tuple[float, float, float]]:
+    """在默认单价上合并配置的单价，格式为JSON：{"model": [输入, 缓存输入, 输出]}"""
+    pricing = dict(DEFAULT_PRICING)
+    if value:
+        try:
+            for model, prices in json.loads(value).items():
+                prompt_price, cached_price, completion_price = (float(price) for price in prices)
+                pricing[model] = (prompt_price, cached_price, completion_price)
+        except (ValueError, TypeError, AttributeError) as e:
+            llm_logger.warning(f"LLM单价配置无效，使用默认单价: {str(e)}")
+    return pricing
+
+class ModelStats:
+    """单个模型的累计用量，分布数据取自指标注册表中的直方图"""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost, 6),
+            "latency_seconds": LLM_REQUEST_SECONDS.snapshot(model=self.model),
+            "ttft_seconds": LLM_TTFT_SECONDS.snapshot(model=self.model),
+            "tokens_per_call": LLM_CALL_TOKENS.snapshot(model=self.model)
+        }
+
+# 当前请求的LLM用量汇总，由路由在请求开始时设置
+_request_usage: ContextVar[Optional[Dict[str, Any]]] = ContextVar("llm_request_usage", default=None)
+
+def _empty_usage() -> Dict[str, Any]:
+    return {
+        "calls": 0,
+        "prompt_tokens": 0,
+        "cached_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "cost_usd": 0.0,
+        "llm_seconds": 0.0
+    }
+
+class LLMMetrics:
+    """全部LLM调用的用量统计"""
+
+    def __init__(self, pricing: Dict[str, Tuple[float, float, float]]):
+        self.pricing = pricing
+        self._models: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def estimate_cost(self, model: str, usage: Dict[str, int]) -> float:
+        """按单价估算一次调用的费用（美元），未知模型返回0"""
+        prices = self.pricing.get(model)
+        if not prices:
+            return 0.0
+        prompt_price, cached_price, completion_price = prices
+        cached = min(usage.get("cached_tokens", 0), usage.get("prompt_tokens", 0))
+        return (
+            (usage.get("prompt_tokens", 0) - cached) * prompt_price
+            + cached * cached_price
+            + usage.get("completion_tokens", 0) * completion_price
+        ) / 1_000_000
+
+    def record(
+        self,
+        model: str,
+        usage: Optional[Dict[str, int]],
+        latency: float,
+        success: bool,
+        ttft: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """记录一次调用，返回本次调用的用量和费用"""
+        usage = usage or {}
+        call = {
+            "model": model,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+            "cost_usd": round(self.estimate_cost(model, usage), 6),
+            "latency": round(latency, 3),
+            "ttft": round(ttft, 3) if ttft is not None else None
+        }
+
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is None:
+                stats = self._models[model] = ModelStats(model)
+            stats.calls += 1
+            if not success:
+                stats.failures += 1
+            stats.prompt_tokens += call["prompt_tokens"]
+            stats.cached_tokens += call["cached_tokens"]
+            stats.completion_tokens += call["completion_tokens"]
+            stats.cost += call["cost_usd"]
+
+            request_usage = _request_usage.get()
+            if request_usage is not None:
+                request_usage["calls"] += 1
+                for name in ("prompt_tokens", "cached_tokens", "completion_tokens", "total_tokens"):
+                    request_usage[name] += call[name]
+                request_usage["cost_usd"] = round(request_usage["cost_usd"] + call["cost_usd"], 6)
+                request_usage["llm_seconds"] = round(request_usage["llm_seconds"] + latency, 3)
+
+        LLM_REQUEST_SECONDS.observe(latency, model=model, status="success" if success else "failure")
+        if ttft is not None:
+            LLM_TTFT_SECONDS.observe(ttft, model=model)
+        if call["total_tokens"]:
+            LLM_CALL_TOKENS.observe(call["total_tokens"], model=model)
+        # 输入令牌中不含命中缓存的部分，三类相加即总用量
+        cached = min(call["cached_tokens"], call["prompt_tokens"])
+        for token_type, count in (
+            ("prompt", call["prompt_tokens"] - cached),
+            ("cached", cached),
+            ("completion", call["completion_tokens"])
+        ):
+            if count:
+                LLM_TOKENS_TOTAL.inc(count, model=model, type=token_type)
+        if call["cost_usd"]:
+            LLM_COST_TOTAL.inc(call["cost_usd"], model=model)
+
+        llm_logger.debug(
+            f"LLM调用统计 - 模型: {model}, 令牌: {call['total_tokens']}"
+            f"（缓存 {call['cached_tokens']}）, 耗时: {latency:.2f}秒, 费用: ${call['cost_usd']:.6f}"
+        )
+        return call
+
+    def track_request(self) -> Dict[str, Any]:
+        """开始汇总当前请求（及其创建的子任务）中的LLM调用，返回会被持续更新的用量字典"""
+        usage = _empty_usage()
+        _request_usage.set(usage)
+        return usage
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {model: stats.get_stats() for model, stats in self._models.items()}
+        return {
+            "total_cost_usd": round(sum(stats["cost_usd"] for stats in models.values()), 6),
+            "total_tokens": sum(
+                stats["prompt_tokens"] + stats["completion_tokens"] for stats in models.values()
+            ),
+            "models": models
+        }
+
+# 全局LLM用量统计实例
+llm_metrics = LLMMetrics(pricing=_load_pricing(settings.llm_pricing))
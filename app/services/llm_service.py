@@ -5,13 +5,42 @@ Large Language Model service integration
 import asyncio
 import json
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Callable, List, Tuple
+
 import aiohttp
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI
 
 from app.core.config import settings
+from app.core.http_client import http_client
 from app.models.schemas import ModelType
 from app.core.logger import llm_logger
+from app.services.llm_cache import LLMResponseCache, MemoryCacheBackend, SQLiteCacheBackend
+from app.services.prompt_registry import (
+    prompt_registry,
+    EDIT_SYSTEM_PROMPT,
+    EDIT_PROMPT_TEMPLATE,
+    REPAIR_PROMPT_TEMPLATE,
+    USER_PROMPT_TEMPLATE,
+    FEW_SHOT_PROMPT_TEMPLATE,
+)
+from app.services.semantic_cache import semantic_cache
+from app.services.provider_health import provider_monitor, CircuitBreaker
+from app.services.llm_metrics import llm_metrics
+
+# 各服务商的模型，第一个为auto路由和对冲请求使用的默认模型
+PROVIDER_MODELS: Dict[str, List[ModelType]] = {
+    "deepseek": [ModelType.DEEPSEEK_CHAT, ModelType.DEEPSEEK_CODER],
+    "qwen": [ModelType.QWEN_PLUS, ModelType.QWEN_TURBO, ModelType.QWEN_MAX],
+    "openai": [ModelType.GPT_4, ModelType.GPT_3_5_TURBO],
+}
+
+class ProviderHTTPError(RuntimeError):
+    """服务商返回非200状态码（流式调用中抛出，保留状态码用于判断是否计入熔断）"""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
 
 class LLMService:
     """LLM服务管理类"""
@@ -19,9 +48,10 @@ class LLMService:
     def __init__(self):
         llm_logger.info("初始化 LLM 服务...")
         
-        self.openai_client = None
+        self.openai_client: Optional[AsyncOpenAI] = None
+        self._openai_transport = None
         if settings.openai_api_key:
-            self.openai_client = OpenAI(api_key=settings.openai_api_key)
+            self.openai_client = self._get_openai_client()
             llm_logger.info("OpenAI客户端初始化成功")
         else:
             llm_logger.info("未配置OpenAI API密钥")
@@ -35,6 +65,25 @@ class LLMService:
             llm_logger.info("Qwen API密钥已配置")
         else:
             llm_logger.info("未配置Qwen API密钥")
+        
+        # 提示词到代码的响应缓存（内存LRU + SQLite）
+        self.response_cache: Optional[LLMResponseCache] = None
+        if settings.llm_cache_enabled:
+            self.response_cache = LLMResponseCache(
+                tiers=[
+                    MemoryCacheBackend(settings.llm_cache_memory_entries),
+                    SQLiteCacheBackend(settings.cache_dir / "llm_cache.sqlite3", settings.llm_cache_disk_entries)
+                ],
+                ttl=settings.llm_cache_ttl_seconds
+            )
+            llm_logger.info("LLM响应缓存已启用")
+        
+        # 每个服务商独立的并发上限，避免某一家的突发请求拖垮其他调用
+        self._provider_semaphores = {
+            "deepseek": asyncio.Semaphore(settings.deepseek_max_concurrency),
+            "qwen": asyncio.Semaphore(settings.qwen_max_concurrency),
+            "openai": asyncio.Semaphore(settings.openai_max_concurrency)
+        }
             
         llm_logger.success("LLM服务初始化完成")
     
@@ -43,80 +92,67 @@ class LLMService:
         prompt: str, 
         model: ModelType = ModelType.DEEPSEEK_CHAT,
         temperature: float = 0.7,
-        max_tokens: int = 4000
+        max_tokens: int = 4000,
+        use_cache: Optional[bool] = None,
+        quality: Optional[str] = None
     ) -> Dict[str, Any]:
-        """生成Manim代码"""
+        """生成Manim代码（quality用于区分语义缓存分区）"""
         
+        model = self.resolve_model(model)
         llm_logger.info(f"开始生成Manim代码 - 模型: {model.value}, 温度: {temperature}, 最大令牌: {max_tokens}")
         llm_logger.debug(f"用户提示词: {prompt[:100]}..." if len(prompt) > 100 else f"用户提示词: {prompt}")
         
-        system_prompt = """你是一个专业的Manim动画代码生成器。请根据用户的描述生成完整的、可执行的Manim代码。
-
-要求：
-1. 生成的代码必须是完整的、可运行的Manim Scene类
-2. 包含必要的import语句
-3. 代码风格清晰，有适当的注释
-4. 确保动画逻辑正确，视觉效果良好
-5. 只返回Python代码，不要包含任何解释文字
-
-⚠️ 重要限制 - 避免LaTeX依赖：
-- 不要使用 Tex() 或 MathTex() 类
-- 不要使用 get_axis_labels() 方法
-- 不要使用 get_x_axis_label() 或 get_y_axis_label() 方法
-- 使用 Text() 类代替 Tex() 来显示文本
-- 如果需要坐标轴，创建不带标签的 Axes()
-- 如果需要数学符号，使用 Text() 或简单的几何图形
-
-推荐的替代方案：
-- 使用 Text("x") 而不是 Tex("x")
-- 使用 Axes() 而不是 axes.get_axis_labels()
-- 使用简单的几何图形和颜色来表达数学概念
-
-以下是一个示例格式：
-
-```python
-from manim import *
-
-class MyScene(Scene):
-    def construct(self):
-        # 使用Text而不是Tex
-        title = Text("动画标题", font_size=36)
-        
-        # 创建不带标签的坐标轴
-        axes = Axes(
-            x_range=[-3, 3, 1],
-            y_range=[-3, 3, 1],
-            axis_config={"color": BLUE}
-        )
-        
-        # 你的动画代码
-        self.play(Write(title))
-        self.play(Create(axes))
-```
-
-请根据用户的描述生成相应的Manim代码。"""
-
-        user_prompt = f"请为以下描述生成Manim动画代码：\n\n{prompt}"
+        variant = prompt_registry.select(prompt)
+        system_prompt = variant.system_prompt
         
         try:
             start_time = time.time()
             
-            if model in [ModelType.DEEPSEEK_CHAT, ModelType.DEEPSEEK_CODER]:
-                llm_logger.info(f"使用DeepSeek API生成代码 - 模型: {model.value}")
-                result = await self._call_deepseek(system_prompt, user_prompt, model, temperature, max_tokens)
-            elif model in [ModelType.QWEN_TURBO, ModelType.QWEN_PLUS, ModelType.QWEN_MAX]:
-                llm_logger.info(f"使用Qwen API生成代码 - 模型: {model.value}")
-                result = await self._call_qwen(system_prompt, user_prompt, model, temperature, max_tokens)
-            else:
-                llm_logger.info(f"使用OpenAI API生成代码 - 模型: {model.value}")
-                result = await self._call_openai(system_prompt, user_prompt, model, temperature, max_tokens)
+            cache_keys = None
+            semantic_match = None
+            if self._should_use_cache(temperature, use_cache):
+                cache_keys = self.response_cache.make_keys(model.value, variant.version, temperature, prompt)
+                cached = await self.response_cache.get(cache_keys)
+                if cached:
+                    llm_logger.success(f"LLM缓存命中 - 耗时: {time.time() - start_time:.3f}秒")
+                    return {
+                        "success": True,
+                        "code": cached["code"],
+                        "error": None,
+                        "cached": True,
+                        "model": model.value,
+                        "prompt_version": variant.version
+                    }
+                
+                semantic_match = await self._semantic_lookup(
+                    prompt, self._semantic_scope(model.value, variant.version, quality)
+                )
+                if semantic_match and semantic_match["mode"] == "reuse":
+                    return {
+                        "success": True,
+                        "code": semantic_match["code"],
+                        "error": None,
+                        "cached": True,
+                        "model": model.value,
+                        "semantic_match": self._match_info(semantic_match),
+                        "prompt_version": variant.version
+                    }
+            
+            user_prompt = self._build_user_prompt(prompt, semantic_match)
+            result = await self._call_provider(system_prompt, user_prompt, model, temperature, max_tokens)
+            result["prompt_version"] = variant.version
+            if semantic_match:
+                result["semantic_match"] = self._match_info(semantic_match)
             
             duration = time.time() - start_time
             
             if result["success"]:
+                prompt_registry.record_usage(variant.version, result.get("usage"))
                 code_length = len(result["code"]) if result["code"] else 0
                 llm_logger.success(f"代码生成成功 - 耗时: {duration:.2f}秒, 代码长度: {code_length}字符")
                 llm_logger.debug(f"生成的代码预览: {result['code'][:200]}..." if code_length > 200 else f"生成的代码: {result['code']}")
+                if cache_keys:
+                    await self.response_cache.set(cache_keys, {"code": result["code"], "created_at": time.time()})
             else:
                 llm_logger.error(f"代码生成失败 - 耗时: {duration:.2f}秒, 错误: {result['error']}")
             
@@ -130,6 +166,519 @@ class MyScene(Scene):
                 "code": None
             }
     
+    def race_candidates(
+        self,
+        model: ModelType,
+        race_models: Optional[List[ModelType]] = None,
+        samples: int = 1
+    ) -> List[ModelType]:
+        """竞速模式的候选列表：请求指定的模型优先，其次是服务端配置，只保留已配置密钥的模型"""
+        models = list(race_models or [])
+        if not models and settings.race_models:
+            for name in settings.race_models.split(','):
+                try:
+                    models.append(ModelType(name.strip()))
+                except ValueError:
+                    if name.strip():
+                        llm_logger.warning(f"竞速配置中的模型不存在，已忽略: {name.strip()}")
+        if not models:
+            models = [model]
+        
+        available = set(self.get_available_models())
+        usable = [m for m in dict.fromkeys(models) if m.value in available] or [model]
+        candidates = [m for m in usable for _ in range(samples)]
+        return candidates[:max(1, settings.race_max_candidates)]
+    
+    async def race_manim_code(
+        self,
+        prompt: str,
+        models: List[ModelType],
+        validate: Callable[[str], Dict[str, Any]],
+        temperature: float = 0.7,
+        max_tokens: int = 4000,
+        use_cache: Optional[bool] = None,
+        quality: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """竞速生成Manim代码
+        
+        同时向全部候选请求代码，每个响应一到达就立即验证，第一个通过验证的结果胜出，
+        其余请求随即取消。用额外的令牌开销换取更低的尾部延迟。
+        返回值额外包含胜出的model、其validation结果以及各候选的candidates记录。
+        """
+        llm_logger.info(f"开始竞速生成Manim代码 - 候选: {[m.value for m in models]}")
+        start_time = time.time()
+        
+        tasks: Dict[asyncio.Task, ModelType] = {}
+        seen = set()
+        for model in models:
+            # 同一模型的重复采样不能命中同一条缓存，否则失去竞速意义
+            task_use_cache = use_cache if model not in seen else False
+            seen.add(model)
+            task = asyncio.create_task(self.generate_manim_code(
+                prompt=prompt,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                use_cache=task_use_cache,
+                quality=quality
+            ))
+            tasks[task] = model
+        
+        candidates: List[Dict[str, Any]] = []
+        winner: Optional[Dict[str, Any]] = None
+        fallback: Optional[Dict[str, Any]] = None
+        pending = set(tasks)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    # auto或对冲时实际使用的模型可能与候选不同
+                    model_used = result.get("model", tasks[task].value)
+                    candidate = {"model": model_used, "seconds": round(time.time() - start_time, 3)}
+                    candidates.append(candidate)
+                    
+                    if not result["success"]:
+                        candidate.update(status="failed", error=result["error"])
+                        fallback = fallback or {**result, "model": model_used}
+                        continue
+                    
+                    validation = validate(result["code"])
+                    if winner is None and validation["valid"]:
+                        candidate["status"] = "won"
+                        winner = {**result, "model": model_used, "validation": validation}
+                    elif validation["valid"]:
+                        candidate["status"] = "valid"
+                    else:
+                        candidate.update(status="invalid", error=validation["error"])
+                        # 全部失败时返回第一份能解析的代码，便于后续修复
+                        if fallback is None or not fallback.get("code"):
+                            fallback = {**result, "model": model_used, "validation": validation}
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        for task in pending:
+            candidates.append({"model": tasks[task].value, "status": "cancelled"})
+        
+        duration = time.time() - start_time
+        if winner:
+            llm_logger.success(f"竞速生成完成 - 胜出模型: {winner['model']}, 耗时: {duration:.2f}秒, 取消: {len(pending)}")
+            return {**winner, "candidates": candidates}
+        
+        llm_logger.error(f"竞速生成失败 - 全部{len(models)}个候选均未通过验证, 耗时: {duration:.2f}秒")
+        return {**fallback, "candidates": candidates}
+    
+    async def edit_manim_code(
+        self,
+        instruction: str,
+        code: str,
+        history: str = "",
+        model: ModelType = ModelType.DEEPSEEK_CHAT,
+        temperature: float = 0.7,
+        max_tokens: int = 4000,
+        full_file: bool = False
+    ) -> Dict[str, Any]:
+        """按修改要求编辑已有代码（多轮对话，结果不缓存）
+        
+        默认要求模型返回SEARCH/REPLACE修改块（原始回复在content中），只输出改动部分以减少输出令牌；
+        full_file为True时要求返回修改后的完整代码。
+        """
+        llm_logger.info(f"开始编辑Manim代码 - 模型: {model.value}, 模式: {'完整文件' if full_file else '修改块'}")
+        
+        user_prompt = EDIT_PROMPT_TEMPLATE.format(history=history, code=code, instruction=instruction)
+        if full_file:
+            system_prompt = prompt_registry.default.system_prompt
+            user_prompt += "\n\n请返回修改后的完整代码。"
+        else:
+            system_prompt = EDIT_SYSTEM_PROMPT
+        
+        try:
+            start_time = time.time()
+            result = await self._call_provider(system_prompt, user_prompt, model, temperature, max_tokens)
+            duration = time.time() - start_time
+            if result["success"]:
+                llm_logger.success(f"代码编辑完成 - 耗时: {duration:.2f}秒, 回复长度: {len(result['content'])}字符")
+            else:
+                llm_logger.error(f"代码编辑失败 - 耗时: {duration:.2f}秒, 错误: {result['error']}")
+            return result
+        except Exception as e:
+            llm_logger.error(f"代码编辑调用异常: {str(e)}", exc_info=True)
+            return {
+                "success": False,
+                "error": f"LLM调用失败: {str(e)}",
+                "code": None
+            }
+    
+    async def repair_manim_code(
+        self,
+        prompt: str,
+        code: str,
+        error: str,
+        model: ModelType = ModelType.DEEPSEEK_CHAT,
+        temperature: float = 0.2,
+        max_tokens: int = 4000
+    ) -> Dict[str, Any]:
+        """根据渲染或验证错误修复代码（结果不缓存）
+        
+        返回值中的usage为本次调用的令牌用量，服务商未返回时按字符数估算。
+        """
+        llm_logger.info(f"开始修复Manim代码 - 模型: {model.value}, 错误长度: {len(error)}字符")
+        
+        system_prompt = prompt_registry.default.system_prompt
+        user_prompt = REPAIR_PROMPT_TEMPLATE.format(prompt=prompt, code=code, error=error)
+        
+        try:
+            start_time = time.time()
+            result = await self._call_provider(system_prompt, user_prompt, model, temperature, max_tokens)
+            
+            usage = result.get("usage")
+            if not usage or not usage.get("total_tokens"):
+                usage = self._estimate_usage(system_prompt + user_prompt, result.get("code") or "")
+            result["usage"] = usage
+            
+            duration = time.time() - start_time
+            if result["success"]:
+                llm_logger.success(f"代码修复完成 - 耗时: {duration:.2f}秒, 令牌: {usage['total_tokens']}")
+            else:
+                llm_logger.error(f"代码修复失败 - 耗时: {duration:.2f}秒, 错误: {result['error']}")
+            return result
+            
+        except Exception as e:
+            llm_logger.error(f"代码修复调用异常: {str(e)}", exc_info=True)
+            return {
+                "success": False,
+                "error": f"LLM调用失败: {str(e)}",
+                "code": None,
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            }
+    
+    @staticmethod
+    def _normalize_usage(usage: Any) -> Optional[Dict[str, int]]:
+        """统一各服务商的令牌用量字段（Qwen使用input_tokens/output_tokens）
+        
+        cached_tokens为命中服务商前缀缓存的输入令牌数：DeepSeek返回prompt_cache_hit_tokens，
+        OpenAI和Qwen在prompt_tokens_details（或input_tokens_details）中返回cached_tokens。
+        """
+        if not usage:
+            return None
+        
+        def get(obj: Any, name: str) -> Any:
+            return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+        
+        def field(*names: str) -> int:
+            for name in names:
+                value = get(usage, name)
+                if value:
+                    return int(value)
+            return 0
+        
+        cached_tokens = field("prompt_cache_hit_tokens")
+        if not cached_tokens:
+            for name in ("prompt_tokens_details", "input_tokens_details"):
+                details = get(usage, name)
+                if details and get(details, "cached_tokens"):
+                    cached_tokens = int(get(details, "cached_tokens"))
+                    break
+        
+        prompt_tokens = field("prompt_tokens", "input_tokens")
+        completion_tokens = field("completion_tokens", "output_tokens")
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": field("total_tokens") or prompt_tokens + completion_tokens,
+            "cached_tokens": cached_tokens
+        }
+    
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """粗略估算令牌数（中英文混合文本约每2个字符一个令牌）"""
+        return (len(text) + 1) // 2
+    
+    @classmethod
+    def _estimate_usage(cls, prompt_text: str, completion_text: str) -> Dict[str, int]:
+        """服务商未返回用量（如流式响应）时按字符数估算"""
+        prompt_tokens = cls.estimate_tokens(prompt_text)
+        completion_tokens = cls.estimate_tokens(completion_text)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "cached_tokens": 0,
+            "estimated": True
+        }
+    
+    def _build_user_prompt(self, prompt: str, example: Optional[Dict[str, Any]] = None) -> str:
+        """构建用户消息（系统提示词在前且保持不变，服务商才能复用前缀缓存）
+        
+        example为语义缓存找到的相似历史描述，其代码作为参考示例放在用户消息中。
+        """
+        if example:
+            return FEW_SHOT_PROMPT_TEMPLATE.format(
+                example_prompt=example["prompt"],
+                example_code=example["code"],
+                prompt=prompt
+            )
+        return USER_PROMPT_TEMPLATE.format(prompt=prompt)
+    
+    @staticmethod
+    def _semantic_scope(model: str, prompt_version: Optional[str], quality: Optional[str]) -> str:
+        """语义缓存分区：不同模型、质量或提示词版本生成的代码互不复用"""
+        return f"{model}|{quality or '-'}|{prompt_version or '-'}"
+    
+    async def _semantic_lookup(self, prompt: str, scope: str) -> Optional[Dict[str, Any]]:
+        """在语义缓存中查找相似的历史描述（向量化在线程中执行，不阻塞事件循环）"""
+        if semantic_cache is None:
+            return None
+        try:
+            return await asyncio.to_thread(semantic_cache.lookup, prompt, scope)
+        except Exception as e:
+            llm_logger.error(f"语义缓存查询失败: {str(e)}", exc_info=True)
+            return None
+    
+    async def remember_success(
+        self,
+        prompt: str,
+        code: str,
+        model: str,
+        prompt_version: Optional[str],
+        quality: Optional[str]
+    ) -> None:
+        """把渲染成功的描述和代码加入语义缓存，供之后的相似描述复用"""
+        if semantic_cache is None:
+            return
+        try:
+            scope = self._semantic_scope(model, prompt_version, quality)
+            await asyncio.to_thread(semantic_cache.add, prompt, code, scope)
+        except Exception as e:
+            llm_logger.error(f"语义缓存写入失败: {str(e)}", exc_info=True)
+    
+    @staticmethod
+    def _match_info(match: Dict[str, Any]) -> Dict[str, Any]:
+        """返回给客户端的语义缓存命中信息（不含代码）"""
+        return {"prompt": match["prompt"], "similarity": match["similarity"], "mode": match["mode"]}
+    
+    def _provider_for(self, model: ModelType) -> str:
+        """模型所属的服务商"""
+        for provider, models in PROVIDER_MODELS.items():
+            if model in models:
+                return provider
+        return "openai"
+    
+    def _configured_providers(self) -> List[str]:
+        """已配置密钥的服务商"""
+        keys = {
+            "deepseek": settings.deepseek_api_key,
+            "qwen": settings.qwen_api_key,
+            "openai": settings.openai_api_key,
+        }
+        return [provider for provider in PROVIDER_MODELS if keys[provider]]
+    
+    def _route(self, exclude: Tuple[str, ...] = ()) -> Optional[ModelType]:
+        """选择最健康、最快的服务商的默认模型，没有可用服务商时返回None"""
+        providers = [provider for provider in self._configured_providers() if provider not in exclude]
+        for provider in provider_monitor.rank(providers):
+            if provider_monitor.get(provider).breaker.state != CircuitBreaker.OPEN:
+                return PROVIDER_MODELS[provider][0]
+        return None
+    
+    def resolve_model(self, model: ModelType) -> ModelType:
+        """把auto解析为具体模型；所有服务商都在熔断时退回到首个已配置的服务商"""
+        if model != ModelType.AUTO:
+            return model
+        routed = self._route()
+        if routed is None:
+            providers = self._configured_providers()
+            routed = PROVIDER_MODELS[providers[0]][0] if providers else ModelType.DEEPSEEK_CHAT
+        llm_logger.info(f"auto路由选择模型: {routed.value}")
+        return routed
+    
+    async def _call_provider(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model: ModelType,
+        temperature: float,
+        max_tokens: int
+    ) -> Dict[str, Any]:
+        """调用模型API，返回值中的model为实际使用的模型
+        
+        开启对冲时，主请求超过该服务商的p90延迟仍未返回（或很快以可重试的错误失败），
+        就向另一个健康的服务商发出同样的请求，取先成功的结果。
+        """
+        model = self.resolve_model(model)
+        if not settings.llm_hedge_enabled:
+            return await self._call_once(system_prompt, user_prompt, model, temperature, max_tokens)
+        
+        provider = self._provider_for(model)
+        primary = asyncio.create_task(self._call_once(system_prompt, user_prompt, model, temperature, max_tokens))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=provider_monitor.hedge_delay(provider))
+            if done and (primary.result()["success"] or not primary.result().get("transient")):
+                return primary.result()
+            
+            hedge_model = self._route(exclude=(provider,))
+            if hedge_model is None:
+                return await primary
+            
+            provider_monitor.hedges_launched += 1
+            llm_logger.info(f"{provider} 响应缓慢或失败，发出对冲请求 - 模型: {hedge_model.value}")
+            hedge = asyncio.create_task(self._call_once(system_prompt, user_prompt, hedge_model, temperature, max_tokens))
+            tasks.append(hedge)
+            
+            result = primary.result() if done else None
+            pending = {hedge} if done else {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task_result = task.result()
+                    if task_result["success"]:
+                        if task is hedge:
+                            provider_monitor.hedges_won += 1
+                        return task_result
+                    result = result or task_result
+            return result
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _call_once(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model: ModelType,
+        temperature: float,
+        max_tokens: int
+    ) -> Dict[str, Any]:
+        """在服务商熔断器和并发上限内调用一次API，并记录结果和延迟
+        
+        失败结果中transient为True表示可重试的错误（超时、5xx、429、连接错误），计入熔断。
+        """
+        provider = self._provider_for(model)
+        health = provider_monitor.get(provider)
+        if not health.breaker.allow():
+            health.rejected += 1
+            return {
+                "success": False,
+                "error": f"{provider} 暂时不可用（熔断中，{health.breaker.retry_after():.0f}秒后重试）",
+                "code": None,
+                "model": model.value,
+                "transient": True
+            }
+        
+        semaphore = self._provider_semaphores[provider]
+        if semaphore.locked():
+            llm_logger.info(f"{provider} 并发已满，等待空闲槽位")
+        
+        try:
+            async with semaphore:
+                start_time = time.monotonic()
+                try:
+                    # 整体截止时间，包括OpenAI SDK内部的重试
+                    result = await asyncio.wait_for(
+                        self._dispatch(provider, system_prompt, user_prompt, model, temperature, max_tokens),
+                        timeout=settings.llm_request_timeout
+                    )
+                except asyncio.TimeoutError:
+                    llm_logger.error(f"{provider} 请求超过{settings.llm_request_timeout}秒未完成")
+                    result = {
+                        "success": False,
+                        "error": f"{provider} 请求超时（{settings.llm_request_timeout}秒）",
+                        "code": None,
+                        "transient": True
+                    }
+                latency = time.monotonic() - start_time
+        except asyncio.CancelledError:
+            # 被对冲或竞速取消的请求不计入健康状态
+            health.breaker.release()
+            raise
+        
+        if result["success"]:
+            health.record_success(latency)
+        elif result.get("transient"):
+            health.record_failure()
+        else:
+            health.breaker.release()
+        
+        if result["success"] and not (result.get("usage") or {}).get("total_tokens"):
+            result["usage"] = self._estimate_usage(system_prompt + user_prompt, result.get("content") or "")
+        llm_metrics.record(model.value, result.get("usage"), latency, result["success"])
+        result["model"] = model.value
+        return result
+    
+    async def _dispatch(
+        self,
+        provider: str,
+        system_prompt: str,
+        user_prompt: str,
+        model: ModelType,
+        temperature: float,
+        max_tokens: int
+    ) -> Dict[str, Any]:
+        if provider == "deepseek":
+            llm_logger.info(f"使用DeepSeek API生成代码 - 模型: {model.value}")
+            return await self._call_deepseek(system_prompt, user_prompt, model, temperature, max_tokens)
+        elif provider == "qwen":
+            llm_logger.info(f"使用Qwen API生成代码 - 模型: {model.value}")
+            return await self._call_qwen(system_prompt, user_prompt, model, temperature, max_tokens)
+        else:
+            llm_logger.info(f"使用OpenAI API生成代码 - 模型: {model.value}")
+            return await self._call_openai(system_prompt, user_prompt, model, temperature, max_tokens)
+    
+    @staticmethod
+    def _stream_timeout() -> aiohttp.ClientTimeout:
+        """流式请求不限制总时长（长输出会持续返回数据），只限制连接时间和相邻数据块的间隔"""
+        return aiohttp.ClientTimeout(
+            total=None,
+            connect=settings.http_connect_timeout,
+            sock_read=settings.llm_read_timeout
+        )
+    
+    @staticmethod
+    def _is_transient_status(status: int) -> bool:
+        """限流和服务端错误可以重试，也说明服务商当前不健康"""
+        return status == 429 or status >= 500
+    
+    @classmethod
+    def _is_transient_error(cls, error: Exception) -> bool:
+        """与非流式调用的判断一致：只有超时、连接错误、5xx和429计入熔断"""
+        if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError, openai.APIConnectionError)):
+            return True
+        if isinstance(error, ProviderHTTPError):
+            return cls._is_transient_status(error.status)
+        if isinstance(error, openai.APIStatusError):
+            return cls._is_transient_status(error.status_code)
+        return False
+    
+    def _get_openai_client(self) -> AsyncOpenAI:
+        """获取复用共享连接池的异步OpenAI客户端"""
+        transport = http_client.get_httpx_client("openai")
+        if self.openai_client is None or self._openai_transport is not transport:
+            self.openai_client = AsyncOpenAI(api_key=settings.openai_api_key, http_client=transport)
+            self._openai_transport = transport
+        return self.openai_client
+    
+    def _should_use_cache(self, temperature: float, use_cache: Optional[bool]) -> bool:
+        """判断本次请求是否使用响应缓存：单次请求的设置优先，其次按温度决定"""
+        if not self.response_cache:
+            return False
+        if use_cache is not None:
+            return use_cache
+        return temperature == 0 or settings.llm_cache_sampled_default
+    
+    def get_semantic_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """语义缓存统计，未启用时返回None"""
+        return semantic_cache.get_stats() if semantic_cache is not None else None
+    
+    def get_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """LLM响应缓存统计"""
+        return self.response_cache.get_stats() if self.response_cache else None
+    
     async def _call_deepseek(
         self, 
         system_prompt: str, 
@@ -168,37 +717,49 @@ class MyScene(Scene):
         llm_logger.debug(f"发送DeepSeek API请求 - URL: {url}")
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data) as response:
-                    llm_logger.debug(f"DeepSeek API响应状态: {response.status}")
+            session = http_client.get_session("deepseek")
+            async with session.post(url, headers=headers, json=data) as response:
+                llm_logger.debug(f"DeepSeek API响应状态: {response.status}")
+                
+                if response.status == 200:
+                    result = await response.json()
+                    code = result["choices"][0]["message"]["content"]
                     
-                    if response.status == 200:
-                        result = await response.json()
-                        code = result["choices"][0]["message"]["content"]
-                        
-                        llm_logger.info("DeepSeek API调用成功")
-                        llm_logger.debug(f"API响应令牌使用情况: {result.get('usage', {})}")
-                        
-                        return {
-                            "success": True,
-                            "code": self._extract_code(code),
-                            "error": None
-                        }
-                    else:
-                        error_text = await response.text()
-                        llm_logger.error(f"DeepSeek API调用失败 - 状态码: {response.status}, 响应: {error_text}")
-                        return {
-                            "success": False,
-                            "error": f"DeepSeek API error: {response.status} - {error_text}",
-                            "code": None
-                        }
-                        
+                    llm_logger.info("DeepSeek API调用成功")
+                    llm_logger.debug(f"API响应令牌使用情况: {result.get('usage', {})}")
+                    
+                    return {
+                        "success": True,
+                        "code": self._extract_code(code),
+                        "content": code,
+                        "error": None,
+                        "usage": self._normalize_usage(result.get("usage"))
+                    }
+                else:
+                    error_text = await response.text()
+                    llm_logger.error(f"DeepSeek API调用失败 - 状态码: {response.status}, 响应: {error_text}")
+                    return {
+                        "success": False,
+                        "error": f"DeepSeek API error: {response.status} - {error_text}",
+                        "code": None,
+                        "transient": self._is_transient_status(response.status)
+                    }
+                    
+        except asyncio.TimeoutError:
+            llm_logger.error("DeepSeek API请求超时")
+            return {
+                "success": False,
+                "error": "DeepSeek API请求超时",
+                "code": None,
+                "transient": True
+            }
         except Exception as e:
             llm_logger.error(f"DeepSeek API请求异常: {str(e)}", exc_info=True)
             return {
                 "success": False,
                 "error": f"DeepSeek API请求失败: {str(e)}",
-                "code": None
+                "code": None,
+                "transient": isinstance(e, aiohttp.ClientError)
             }
     
     async def _call_openai(
@@ -222,8 +783,8 @@ class MyScene(Scene):
         llm_logger.debug(f"发送OpenAI API请求 - 模型: {model.value}")
         
         try:
-            response = await asyncio.to_thread(
-                self.openai_client.chat.completions.create,
+            client = self._get_openai_client()
+            response = await client.chat.completions.create(
                 model=model.value,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -241,14 +802,20 @@ class MyScene(Scene):
             return {
                 "success": True,
                 "code": self._extract_code(code),
-                "error": None
+                "content": code,
+                "error": None,
+                "usage": self._normalize_usage(response.usage)
             }
         except Exception as e:
             llm_logger.error(f"OpenAI API调用异常: {str(e)}", exc_info=True)
+            transient = isinstance(e, openai.APIConnectionError) or (
+                isinstance(e, openai.APIStatusError) and self._is_transient_status(e.status_code)
+            )
             return {
                 "success": False,
                 "error": f"OpenAI API error: {str(e)}",
-                "code": None
+                "code": None,
+                "transient": transient
             }
     
     async def _call_qwen(
@@ -293,63 +860,323 @@ class MyScene(Scene):
         llm_logger.debug(f"请求模型: {model.value}")
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, json=data, timeout=60) as response:
-                    llm_logger.debug(f"Qwen API响应状态: {response.status}")
+            session = http_client.get_session("qwen")
+            async with session.post(url, headers=headers, json=data) as response:
+                llm_logger.debug(f"Qwen API响应状态: {response.status}")
+                
+                if response.status == 200:
+                    result = await response.json()
+                    llm_logger.debug(f"Qwen API响应结构: {list(result.keys()) if isinstance(result, dict) else str(type(result))}")
                     
-                    if response.status == 200:
-                        result = await response.json()
-                        llm_logger.debug(f"Qwen API响应结构: {list(result.keys()) if isinstance(result, dict) else str(type(result))}")
+                    # Qwen API的标准响应格式: output.text
+                    if result.get("output") and result["output"].get("text"):
+                        code = result["output"]["text"]
                         
-                        # Qwen API的标准响应格式: output.text
-                        if result.get("output") and result["output"].get("text"):
-                            code = result["output"]["text"]
-                            
-                            llm_logger.info("Qwen API调用成功")
-                            llm_logger.debug(f"API响应令牌使用情况: {result.get('usage', {})}")
-                            
-                            return {
-                                "success": True,
-                                "code": self._extract_code(code),
-                                "error": None
-                            }
-                        else:
-                            # 如果响应格式不匹配，记录详细信息
-                            llm_logger.error(f"Qwen API响应格式异常:")
-                            llm_logger.error(f"  - 响应键: {list(result.keys()) if isinstance(result, dict) else 'Not a dict'}")
-                            if result.get("output"):
-                                llm_logger.error(f"  - output键: {list(result['output'].keys()) if isinstance(result['output'], dict) else 'Not a dict'}")
-                            
-                            error_msg = result.get("message", f"响应格式错误，缺少output.text字段")
-                            return {
-                                "success": False,
-                                "error": f"Qwen API响应格式错误: {error_msg}",
-                                "code": None
-                            }
+                        llm_logger.info("Qwen API调用成功")
+                        llm_logger.debug(f"API响应令牌使用情况: {result.get('usage', {})}")
+                        
+                        return {
+                            "success": True,
+                            "code": self._extract_code(code),
+                            "content": code,
+                            "error": None,
+                            "usage": self._normalize_usage(result.get("usage"))
+                        }
                     else:
-                        error_text = await response.text()
-                        llm_logger.error(f"Qwen API调用失败 - 状态码: {response.status}")
-                        llm_logger.error(f"响应内容: {error_text}")
+                        # 如果响应格式不匹配，记录详细信息
+                        llm_logger.error(f"Qwen API响应格式异常:")
+                        llm_logger.error(f"  - 响应键: {list(result.keys()) if isinstance(result, dict) else 'Not a dict'}")
+                        if result.get("output"):
+                            llm_logger.error(f"  - output键: {list(result['output'].keys()) if isinstance(result['output'], dict) else 'Not a dict'}")
+                        
+                        error_msg = result.get("message", f"响应格式错误，缺少output.text字段")
                         return {
                             "success": False,
-                            "error": f"Qwen API HTTP错误: {response.status} - {error_text[:200]}",
+                            "error": f"Qwen API响应格式错误: {error_msg}",
                             "code": None
                         }
-                        
+                else:
+                    error_text = await response.text()
+                    llm_logger.error(f"Qwen API调用失败 - 状态码: {response.status}")
+                    llm_logger.error(f"响应内容: {error_text}")
+                    return {
+                        "success": False,
+                        "error": f"Qwen API HTTP错误: {response.status} - {error_text[:200]}",
+                        "code": None,
+                        "transient": self._is_transient_status(response.status)
+                    }
+                    
         except asyncio.TimeoutError:
             llm_logger.error("Qwen API请求超时")
             return {
                 "success": False,
                 "error": "Qwen API请求超时",
-                "code": None
+                "code": None,
+                "transient": True
             }
         except Exception as e:
             llm_logger.error(f"Qwen API请求异常: {str(e)}", exc_info=True)
             return {
                 "success": False,
                 "error": f"Qwen API请求失败: {str(e)}",
-                "code": None
+                "code": None,
+                "transient": isinstance(e, aiohttp.ClientError)
+            }
+    
+    async def stream_manim_code(
+        self,
+        prompt: str,
+        model: ModelType = ModelType.DEEPSEEK_CHAT,
+        temperature: float = 0.7,
+        max_tokens: int = 4000,
+        use_cache: Optional[bool] = None,
+        quality: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """流式生成Manim代码
+        
+        依次产出 {"type": "token", "content": ...} 事件，
+        最后产出一个 {"type": "result", "success": ..., "code": ..., "error": ...} 事件。
+        """
+        
+        model = self.resolve_model(model)
+        llm_logger.info(f"开始流式生成Manim代码 - 模型: {model.value}, 温度: {temperature}")
+        start_time = time.time()
+        variant = prompt_registry.select(prompt)
+        
+        cache_keys = None
+        semantic_match = None
+        if self._should_use_cache(temperature, use_cache):
+            cache_keys = self.response_cache.make_keys(model.value, variant.version, temperature, prompt)
+            cached = await self.response_cache.get(cache_keys)
+            if cached:
+                llm_logger.success(f"LLM缓存命中 - 耗时: {time.time() - start_time:.3f}秒")
+                yield {"type": "token", "content": cached["code"]}
+                yield {
+                    "type": "result", "success": True, "code": cached["code"], "error": None,
+                    "cached": True, "model": model.value, "prompt_version": variant.version
+                }
+                return
+            
+            semantic_match = await self._semantic_lookup(
+                prompt, self._semantic_scope(model.value, variant.version, quality)
+            )
+            if semantic_match and semantic_match["mode"] == "reuse":
+                yield {"type": "token", "content": semantic_match["code"]}
+                yield {
+                    "type": "result", "success": True, "code": semantic_match["code"], "error": None,
+                    "cached": True, "model": model.value, "semantic_match": self._match_info(semantic_match),
+                    "prompt_version": variant.version
+                }
+                return
+        
+        system_prompt = variant.system_prompt
+        user_prompt = self._build_user_prompt(prompt, semantic_match)
+        provider = self._provider_for(model)
+        health = provider_monitor.get(provider)
+        if not health.breaker.allow():
+            health.rejected += 1
+            yield {
+                "type": "result", "success": False, "code": None,
+                "error": f"{provider} 暂时不可用（熔断中，{health.breaker.retry_after():.0f}秒后重试）"
+            }
+            return
+        
+        if provider == "deepseek":
+            deltas = self._stream_deepseek(system_prompt, user_prompt, model, temperature, max_tokens)
+        elif provider == "qwen":
+            deltas = self._stream_qwen(system_prompt, user_prompt, model, temperature, max_tokens)
+        else:
+            deltas = self._stream_openai(system_prompt, user_prompt, model, temperature, max_tokens)
+        
+        content = ""
+        first_token_time = None
+        try:
+            async with self._provider_semaphores[provider]:
+                async for delta in deltas:
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                        llm_logger.info(f"收到首个token - 耗时: {first_token_time - start_time:.2f}秒")
+                    content += delta
+                    yield {"type": "token", "content": delta}
+        except Exception as e:
+            llm_logger.error(f"{provider} 流式调用失败: {str(e)}", exc_info=True)
+            if self._is_transient_error(e):
+                health.record_failure()
+            else:
+                # 请求本身有误（4xx、鉴权、解析错误）不说明服务商不健康
+                health.breaker.release()
+            llm_metrics.record(model.value, None, time.time() - start_time, False)
+            yield {"type": "result", "success": False, "code": None, "error": f"{provider} 流式调用失败: {str(e)}"}
+            return
+        except BaseException:
+            # 客户端断开等导致的取消不计入健康状态
+            health.breaker.release()
+            raise
+        finally:
+            await deltas.aclose()
+        
+        # 流式响应的总耗时取决于输出长度，不计入延迟窗口
+        health.record_success()
+        llm_metrics.record(
+            model.value,
+            self._estimate_usage(system_prompt + user_prompt, content),
+            time.time() - start_time,
+            bool(content.strip()),
+            ttft=first_token_time - start_time if first_token_time else None
+        )
+        if not content.strip():
+            yield {"type": "result", "success": False, "code": None, "error": f"{provider} 返回内容为空"}
+            return
+        
+        code = self._extract_code(content)
+        llm_logger.success(f"流式生成完成 - 耗时: {time.time() - start_time:.2f}秒, 代码长度: {len(code)}字符")
+        if cache_keys:
+            await self.response_cache.set(cache_keys, {"code": code, "created_at": time.time()})
+        result = {
+            "type": "result", "success": True, "code": code, "error": None,
+            "model": model.value, "prompt_version": variant.version
+        }
+        if semantic_match:
+            result["semantic_match"] = self._match_info(semantic_match)
+        yield result
+    
+    async def _iter_sse_data(self, response) -> AsyncIterator[str]:
+        """逐条读取SSE响应中的data字段"""
+        async for line in response.content:
+            line_str = line.decode('utf-8').strip()
+            if not line_str.startswith('data:'):
+                continue
+            data_part = line_str[5:].strip()
+            if data_part == '[DONE]':
+                break
+            if data_part:
+                yield data_part
+    
+    async def _stream_deepseek(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model: ModelType,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str]:
+        """流式调用DeepSeek API，产出内容增量"""
+        if not settings.deepseek_api_key:
+            raise RuntimeError("DeepSeek API key not configured")
+        
+        headers = {
+            "Authorization": f"Bearer {settings.deepseek_api_key}",
+            "Content-Type": "application/json"
+        }
+        data = {
+            "model": model.value,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        
+        session = http_client.get_session("deepseek")
+        async with session.post(
+            "https://api.deepseek.com/v1/chat/completions",
+            headers=headers,
+            json=data,
+            timeout=self._stream_timeout()
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise ProviderHTTPError(f"DeepSeek API error: {response.status} - {error_text[:200]}", response.status)
+            
+            async for data_part in self._iter_sse_data(response):
+                try:
+                    chunk = json.loads(data_part)
+                except json.JSONDecodeError:
+                    continue
+                choices = chunk.get("choices") or []
+                if choices:
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+    
+    async def _stream_qwen(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model: ModelType,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str]:
+        """流式调用Qwen API（增量输出），产出内容增量"""
+        if not settings.qwen_api_key:
+            raise RuntimeError("Qwen API key not configured")
+        
+        headers = {
+            "Authorization": f"Bearer {settings.qwen_api_key}",
+            "Content-Type": "application/json",
+            "X-DashScope-SSE": "enable"
+        }
+        data = {
+            "model": model.value,
+            "input": {
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ]
+            },
+            "parameters": {
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "incremental_output": True
             }
+        }
+        
+        url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+        session = http_client.get_session("qwen")
+        async with session.post(url, headers=headers, json=data, timeout=self._stream_timeout()) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise ProviderHTTPError(f"Qwen API HTTP错误: {response.status} - {error_text[:200]}", response.status)
+            
+            async for data_part in self._iter_sse_data(response):
+                try:
+                    chunk = json.loads(data_part)
+                except json.JSONDecodeError:
+                    continue
+                if chunk.get("code"):
+                    raise RuntimeError(f"Qwen API错误: {chunk.get('message', chunk['code'])}")
+                delta = (chunk.get("output") or {}).get("text")
+                if delta:
+                    yield delta
+    
+    async def _stream_openai(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        model: ModelType,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str]:
+        """流式调用OpenAI API，产出内容增量"""
+        if not self.openai_client:
+            raise RuntimeError("OpenAI API key not configured")
+        
+        client = self._get_openai_client()
+        stream = await client.chat.completions.create(
+            model=model.value,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     
     def _extract_code(self, content: str) -> str:
         """从LLM响应中提取代码"""
@@ -395,6 +1222,9 @@ class MyScene(Scene):
             models.extend([ModelType.QWEN_TURBO.value, ModelType.QWEN_PLUS.value, ModelType.QWEN_MAX.value])
             llm_logger.debug("添加Qwen模型到可用列表")
         
+        if models:
+            models.insert(0, ModelType.AUTO.value)
+        
         llm_logger.info(f"可用模型数量: {len(models)} - {models}")
         return models
 
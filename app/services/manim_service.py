@@ -4,19 +4,42 @@ Manim animation generation service
 
 import os
 import sys
+import json
+import signal
 import subprocess
 import tempfile
 import time
 import shutil
 import concurrent.futures
 import threading
+import re
+import uuid
+import hashlib
+import contextlib
+import importlib.metadata
+import importlib.util
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Callable, List, Tuple
 import asyncio
 
 from app.core.config import settings
 from app.models.schemas import QualityType
 from app.core.logger import manim_logger
+from app.core.metrics import STAGE_SECONDS, RENDERS_TOTAL, RENDERS_IN_FLIGHT, RENDER_QUEUE_DEPTH
+from app.services.render_pool import RenderWorkerPool
+from app.services.render_cache import RenderCache
+from app.services.admission import AdmissionController, AdmissionRejected
+from app.services.code_analysis import code_analyzer
+from app.services.code_rules import rule_engine
+
+# 渲染进度回调，参数形如 {"stage": "rendering", "animation": 3, "percent": 45}
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+# 渐进渲染的后台任务状态保留时间（秒）
+RENDER_STATUS_TTL = 3600
+
+# 匹配manim进度条输出，例如 "Animation 2: Create(Circle):  45%|████"
+_PROGRESS_RE = re.compile(r"Animation\s+(\d+)\s*:.*?(\d{1,3})%")
 
 class ManimService:
     """Manim服务管理类"""
@@ -41,6 +64,49 @@ class ManimService:
             manim_logger.success("Manim环境检查通过，真实模式可用")
         else:
             manim_logger.warning("Manim未安装，将使用演示模式")
+        
+        # 渲染准入控制：按CPU核数限制并发，超出部分有界排队
+        render_concurrency = settings.render_max_concurrency or max(1, (os.cpu_count() or 2) - 1)
+        self.admission = AdmissionController(
+            max_concurrent=render_concurrency,
+            max_queue=settings.render_max_queue,
+            max_wait=settings.render_max_wait
+        )
+        manim_logger.info(f"渲染并发上限: {render_concurrency}, 最大排队: {settings.render_max_queue}")
+        RENDERS_IN_FLIGHT.set_function(lambda: self.admission.active)
+        RENDER_QUEUE_DEPTH.set_function(lambda: self.admission.queue_depth)
+        
+        # 常驻渲染进程池，避免每次渲染都重新启动解释器并导入manim
+        self.render_pool: Optional[RenderWorkerPool] = None
+        if self.manim_available and settings.render_pool_enabled:
+            pool_size = settings.render_pool_size or render_concurrency
+            self.render_pool = RenderWorkerPool(
+                size=pool_size,
+                max_jobs_per_worker=settings.render_worker_max_jobs,
+                max_rss_mb=settings.render_worker_max_rss_mb,
+                job_timeout=settings.render_job_timeout,
+                cpu_seconds=settings.render_cpu_time_limit,
+                memory_mb=settings.render_memory_limit_mb
+            )
+            manim_logger.info(f"渲染进程池已配置 - 进程数: {pool_size}")
+        
+        # 按代码内容寻址的渲染缓存，重复请求直接复用已有视频
+        self.render_cache: Optional[RenderCache] = None
+        if settings.render_cache_enabled:
+            self.render_cache = RenderCache(
+                cache_dir=self.output_dir / "cache",
+                max_bytes=settings.render_cache_max_mb * 1024 * 1024,
+                max_age_seconds=settings.render_cache_max_age_hours * 3600
+            )
+        
+        # 渐进渲染中仍在后台进行或刚完成的最终渲染，render_id -> 状态
+        self._background_renders: Dict[str, Dict[str, Any]] = {}
+        
+        # 编辑会话的工作目录在多次渲染间保留，同一会话的渲染串行执行
+        self.sessions_dir = self.temp_dir / "sessions"
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+        self._exports_task: Optional[asyncio.Task] = None
             
         manim_logger.success("Manim服务初始化完成")
     
@@ -48,21 +114,62 @@ class ManimService:
         """检查Manim是否可用"""
         manim_logger.debug("检查Manim可用性...")
         
-        try:
-            import manim
-            manim_logger.info(f"Manim已安装，版本信息: {manim.__version__ if hasattr(manim, '__version__') else '未知'}")
-            return True
-        except ImportError:
+        # 只查找不导入：manim在渲染进程中导入，API进程无需承担导入耗时和内存
+        if importlib.util.find_spec("manim") is None:
             manim_logger.warning("Manim未安装")
             return False
+        try:
+            version = importlib.metadata.version("manim")
+        except importlib.metadata.PackageNotFoundError:
+            version = "未知"
+        manim_logger.info(f"Manim已安装，版本信息: {version}")
+        return True
+    
+    def start(self):
+        """启动后台资源（应用启动时调用）"""
+        self._cleanup_stale_workspaces()
+        if self.render_pool:
+            self.render_pool.start()
+        if self.manim_available:
+            # 后台读取manim导出的名称，供静态检查规则使用
+            self._exports_task = asyncio.get_running_loop().create_task(rule_engine.load_manim_exports())
+    
+    def shutdown(self):
+        """释放后台资源（应用关闭时调用）"""
+        for entry in self._background_renders.values():
+            if entry["task"] and not entry["task"].done():
+                entry["task"].cancel()
+        if self.render_pool:
+            self.render_pool.shutdown()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """渲染服务运行统计"""
+        return {
+            "mode": "pool" if self.render_pool else ("subprocess" if self.manim_available else "demo"),
+            "admission": self.admission.get_stats(),
+            "pool": self.render_pool.get_stats() if self.render_pool else None,
+            "cache": self.render_cache.get_stats() if self.render_cache else None,
+            "code_analysis": code_analyzer.get_stats(),
+            "code_rules": rule_engine.get_stats(),
+            "background_renders": sum(
+                1 for entry in self._background_renders.values() if entry["status"] == "rendering"
+            )
+        }
     
     async def execute_manim_code(
         self,
         code: str,
         quality: QualityType = QualityType.MEDIUM,
-        scene_name: Optional[str] = None
+        scene_name: Optional[str] = None,
+        progress_callback: Optional[ProgressCallback] = None,
+        session_id: Optional[str] = None
     ) -> Dict[str, Any]:
-        """执行Manim代码并生成视频"""
+        """执行Manim代码并生成视频
+        
+        未指定场景时渲染代码中的全部场景：多个场景并行渲染后无重编码拼接为一个视频，
+        每个场景单独缓存。指定session_id时在会话工作目录中渲染，manim会复用未改动动画
+        的分段视频，只重新编码修改过的动画再拼接。
+        """
         
         manim_logger.info(f"开始执行Manim代码 - 质量: {quality.value}, 场景: {scene_name or '自动检测'}")
         manim_logger.debug(f"代码长度: {len(code)}字符")
@@ -75,31 +182,32 @@ class ManimService:
         try:
             start_time = time.time()
             
-            # 创建临时文件
-            temp_file = self._create_temp_file(code)
-            manim_logger.info(f"创建临时文件: {temp_file}")
-            
-            # 如果没有指定场景名称，尝试从代码中提取
+            # 如果没有指定场景名称，从代码中找出全部场景
+            scene_names = [scene_name] if scene_name else self._discover_scenes(code)
             if not scene_name:
-                scene_name = self._extract_scene_name(code)
-                manim_logger.info(f"自动检测场景名称: {scene_name}")
-            
-            # 执行Manim命令
-            manim_logger.info(f"开始执行Manim渲染 - 场景: {scene_name}, 质量: {quality.value}")
-            result = await self._run_manim_command(temp_file, scene_name, quality)
+                manim_logger.info(f"自动检测场景: {', '.join(scene_names)}")
             
-            # 清理临时文件
-            self._cleanup_temp_file(temp_file)
+            if len(scene_names) == 1:
+                result = await self._render_scene(code, scene_names[0], quality, progress_callback, session_id)
+            else:
+                result = await self._render_scenes(code, scene_names, quality, progress_callback, session_id)
             
             duration = time.time() - start_time
+            if result.get("cached"):
+                RENDERS_TOTAL.inc(quality=quality.value, status="cached")
+            else:
+                # 缓存命中不计入渲染耗时，避免拉低分位数
+                STAGE_SECONDS.observe(duration, stage="render")
+                RENDERS_TOTAL.inc(quality=quality.value, status="success" if result["success"] else "failure")
             
             if result["success"]:
                 manim_logger.success(f"Manim代码执行成功 - 耗时: {duration:.2f}秒, 输出: {result['video_path']}")
                 return {
                     "success": True,
                     "video_path": result["video_path"],
-                    "message": "动画生成成功",
-                    "error": None
+                    "message": "动画生成成功（缓存）" if result.get("cached") else "动画生成成功",
+                    "error": None,
+                    "resource_usage": result.get("resource_usage")
                 }
             else:
                 manim_logger.error(f"Manim代码执行失败 - 耗时: {duration:.2f}秒, 错误: {result['error']}")
@@ -107,11 +215,16 @@ class ManimService:
                     "success": False,
                     "video_path": None,
                     "message": "动画生成失败",
-                    "error": result["error"]
+                    "error": result["error"],
+                    "resource_usage": result.get("resource_usage")
                 }
                 
+        except AdmissionRejected:
+            # 交由调用方返回429
+            raise
         except Exception as e:
             manim_logger.error(f"Manim代码执行异常: {str(e)}", exc_info=True)
+            RENDERS_TOTAL.inc(quality=quality.value, status="failure")
             return {
                 "success": False,
                 "video_path": None,
@@ -119,47 +232,493 @@ class ManimService:
                 "error": f"执行错误: {str(e)}"
             }
     
-    def _create_temp_file(self, code: str) -> Path:
-        """创建临时Python文件"""
-        # 生成唯一的临时文件名
-        timestamp = int(time.time() * 1000)
-        temp_filename = f"manim_temp_{timestamp}.py"
-        temp_file = self.temp_dir / temp_filename
+    def _render_key(self, code: str, scene_names: List[str], quality: QualityType) -> str:
+        """渲染结果的缓存键，多场景拼接结果以场景列表区分"""
+        fingerprint = code_analyzer.analyze(code).fingerprint
+        return self.render_cache.make_key(fingerprint, ",".join(scene_names), quality)
+    
+    async def _render_scene(
+        self,
+        code: str,
+        scene_name: str,
+        quality: QualityType,
+        progress_callback: Optional[ProgressCallback] = None,
+        session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """渲染单个场景（先查缓存）"""
+        
+        # 查询渲染缓存
+        cache_key = None
+        if self.render_cache:
+            cache_key = self._render_key(code, [scene_name], quality)
+            cached_path = self.render_cache.get(cache_key)
+            if cached_path:
+                manim_logger.success(f"渲染缓存命中 - 场景: {scene_name}, 输出: {cached_path}")
+                return {
+                    "success": True,
+                    "video_path": self._to_web_path(cached_path),
+                    "error": None,
+                    "cached": True
+                }
+        
+        # 创建任务专属的工作目录，编辑会话则复用该会话中本场景的目录
+        if session_id:
+            workspace, session_lock = self._session_workspace(session_id, scene_name)
+        else:
+            workspace, session_lock = self._create_workspace(code), None
+        manim_logger.info(f"使用工作目录: {workspace}")
+        
+        # 执行Manim命令
+        manim_logger.info(f"开始执行Manim渲染 - 场景: {scene_name}, 质量: {quality.value}")
+        try:
+            # 先等待会话锁再申请渲染名额，避免排队时占用名额
+            async with session_lock or contextlib.nullcontext():
+                if session_lock:
+                    self._write_source(workspace, code)
+                
+                async with self.admission.admit():
+                    result = await self._run_manim_command(workspace, scene_name, quality, progress_callback)
+                
+                if result["success"]:
+                    # 在清理工作目录之前把视频移出（会话目录名固定，输出名另取唯一值）
+                    job_id = f"{workspace.name}_{uuid.uuid4().hex[:8]}" if session_lock else workspace.name
+                    published = self._publish_output(Path(result["video_path"]), cache_key, scene_name, job_id)
+                    result["video_path"] = self._to_web_path(published)
+        finally:
+            # 整体清理工作目录（渲染被取消时同样执行），会话目录保留到闲置超时
+            if not session_lock:
+                self._cleanup_workspace(workspace)
+        
+        return result
+    
+    async def _render_scenes(
+        self,
+        code: str,
+        scene_names: List[str],
+        quality: QualityType,
+        progress_callback: Optional[ProgressCallback] = None,
+        session_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """并行渲染多个场景并按源码顺序拼接"""
+        
+        cache_key = None
+        if self.render_cache:
+            cache_key = self._render_key(code, scene_names, quality)
+            cached_path = self.render_cache.get(cache_key)
+            if cached_path:
+                manim_logger.success(f"多场景渲染缓存命中 - 输出: {cached_path}")
+                return {
+                    "success": True,
+                    "video_path": self._to_web_path(cached_path),
+                    "error": None,
+                    "cached": True
+                }
+        
+        def scene_progress(name: str) -> Optional[ProgressCallback]:
+            if not progress_callback:
+                return None
+            return lambda payload: progress_callback({**payload, "scene": name})
+        
+        # 每个场景各自申请渲染名额，由准入控制和进程池决定实际并行度
+        manim_logger.info(f"并行渲染 {len(scene_names)} 个场景: {', '.join(scene_names)}")
+        tasks = [
+            asyncio.create_task(self._render_scene(code, name, quality, scene_progress(name), session_id))
+            for name in scene_names
+        ]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(tasks)
+        failed = None
+        
+        try:
+            try:
+                pending = set(tasks)
+                while pending and failed is None:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    # 先记录同一批完成的全部结果，确保异常退出时也能清理已生成的视频
+                    for task in done:
+                        if task.exception() is None:
+                            index = tasks.index(task)
+                            results[index] = task.result()
+                            if not results[index]["success"] and failed is None:
+                                failed = (scene_names[index], results[index])
+                    error = next((task.exception() for task in done if task.exception()), None)
+                    if error:
+                        raise error
+            finally:
+                # 有场景失败、抛出异常或请求被取消时，取消其余场景，释放渲染名额和进程
+                unfinished = [task for task in tasks if not task.done()]
+                for task in unfinished:
+                    task.cancel()
+                if unfinished:
+                    manim_logger.info(f"取消其余 {len(unfinished)} 个场景的渲染")
+                    outcomes = await asyncio.gather(*unfinished, return_exceptions=True)
+                    for task, outcome in zip(unfinished, outcomes):
+                        if isinstance(outcome, dict):
+                            results[tasks.index(task)] = outcome
+            
+            usages = [result["resource_usage"] for result in results if result and result.get("resource_usage")]
+            resource_usage = {
+                "cpu_seconds": round(sum(usage["cpu_seconds"] for usage in usages), 3),
+                "max_rss_mb": max(usage["max_rss_mb"] for usage in usages),
+                "wall_seconds": round(max(usage["wall_seconds"] for usage in usages), 3)
+            } if usages else None
+            
+            if failed:
+                name, result = failed
+                return {
+                    "success": False,
+                    "video_path": None,
+                    "error": f"场景 {name} 渲染失败: {result['error']}",
+                    "resource_usage": resource_usage
+                }
+            
+            if progress_callback:
+                progress_callback({"stage": "concatenating", "scenes": len(scene_names)})
+            
+            workspace = self._create_workspace(code)
+            try:
+                output_path = workspace / f"combined{Path(results[0]['video_path']).suffix}"
+                await self._concat_videos([Path(result["video_path"]) for result in results], output_path)
+                published = self._publish_output(output_path, cache_key, scene_names[0], workspace.name)
+            finally:
+                self._cleanup_workspace(workspace)
+        finally:
+            if not self.render_cache:
+                # 未启用缓存时单个场景的视频只是中间结果；启用缓存时保留为可复用的缓存条目
+                for result in results:
+                    if result and result["success"]:
+                        Path(result["video_path"]).unlink(missing_ok=True)
+        
+        return {
+            "success": True,
+            "video_path": self._to_web_path(published),
+            "error": None,
+            "resource_usage": resource_usage
+        }
+    
+    async def _concat_videos(self, video_paths: List[Path], output_path: Path):
+        """无重编码拼接视频：优先使用ffmpeg的concat分离器，否则用PyAV转封装"""
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg:
+            list_file = output_path.with_suffix(".txt")
+            # concat列表中的路径需要转义单引号
+            list_file.write_text(
+                "".join(
+                    "file '{}'\n".format(str(path.absolute()).replace("'", "'\\''"))
+                    for path in video_paths
+                ),
+                encoding='utf-8'
+            )
+            process = await asyncio.create_subprocess_exec(
+                ffmpeg, "-y", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", str(list_file),
+                "-c", "copy", str(output_path),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpeg拼接失败: {stderr.decode('utf-8', errors='replace')}")
+        else:
+            await asyncio.to_thread(self._concat_with_pyav, video_paths, output_path)
+        
+        manim_logger.info(f"场景视频拼接完成 - 片段: {len(video_paths)}, 输出: {output_path}")
+    
+    @staticmethod
+    def _concat_with_pyav(video_paths: List[Path], output_path: Path):
+        """使用PyAV（manim的依赖）按包复制拼接，时间戳依次平移"""
+        import av
+        
+        with av.open(str(video_paths[0])) as first:
+            template = first.streams.video[0]
+            with av.open(str(output_path), "w") as output:
+                # PyAV 14起模板参数改为独立的方法
+                if hasattr(output, "add_stream_from_template"):
+                    out_stream = output.add_stream_from_template(template)
+                else:
+                    out_stream = output.add_stream(template=template)
+                offset = 0
+                for path in video_paths:
+                    with av.open(str(path)) as source:
+                        stream = source.streams.video[0]
+                        last_end = offset
+                        for packet in source.demux(stream):
+                            if packet.dts is None:
+                                continue
+                            packet.dts += offset
+                            packet.pts += offset
+                            last_end = max(last_end, packet.pts + (packet.duration or 0))
+                            packet.stream = out_stream
+                            output.mux(packet)
+                        offset = last_end
+    
+    async def render_draft(
+        self,
+        code: str,
+        quality: QualityType,
+        scene_name: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """以最低质量只渲染最后一帧，作为快速草稿
+        
+        草稿与指定质量的最终视频共用同一个缓存键，以draft变体存放。
+        多场景时取最后一个场景的最后一帧。
+        """
+        scene_names = [scene_name] if scene_name else self._discover_scenes(code)
+        scene_name = scene_names[-1]
+        
+        start_time = time.time()
+        cache_key = None
+        if self.render_cache:
+            cache_key = self._render_key(code, scene_names, quality)
+            cached_path = self.render_cache.get(cache_key, variant="draft")
+            if cached_path:
+                manim_logger.info(f"草稿缓存命中: {cached_path}")
+                return {"success": True, "image_path": self._to_web_path(cached_path), "error": None}
+        
+        workspace = self._create_workspace(code)
+        try:
+            async with self.admission.admit():
+                result = await self._run_manim_command(workspace, scene_name, QualityType.LOW, draft=True)
+            
+            if not result["success"]:
+                manim_logger.error(f"草稿渲染失败: {result['error']}")
+                return {"success": False, "image_path": None, "error": result["error"]}
+            
+            published = self._publish_output(
+                Path(result["video_path"]), cache_key, scene_name, workspace.name, variant="draft"
+            )
+        finally:
+            self._cleanup_workspace(workspace)
+        
+        manim_logger.success(f"草稿渲染完成 - 耗时: {time.time() - start_time:.2f}秒, 输出: {published}")
+        return {"success": True, "image_path": self._to_web_path(published), "error": None}
+    
+    async def start_progressive_render(
+        self,
+        code: str,
+        quality: QualityType = QualityType.MEDIUM,
+        scene_name: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """渐进渲染：先同步返回草稿图，再在后台渲染指定质量的视频
+        
+        返回的render_id可用于查询最终视频的状态。启用渲染缓存时render_id即缓存键，
+        相同代码的并发请求会共用同一个后台渲染。
+        """
+        if not self.manim_available:
+            # 演示模式没有草稿可言，直接返回完整结果
+            result = await self.execute_manim_code(code, quality, scene_name)
+            return {**result, "draft_path": None, "render_id": None, "render_status": "done"}
+        
+        scene_names = [scene_name] if scene_name else self._discover_scenes(code)
+        render_id = self._render_key(code, scene_names, quality) if self.render_cache else uuid.uuid4().hex
+        
+        # 最终视频已经存在时无需草稿
+        status = self.get_render_status(render_id)
+        if status and status["status"] == "done":
+            manim_logger.info(f"渐进渲染：最终视频已存在 - ID: {render_id[:12]}")
+            return {
+                "success": True,
+                "video_path": status["video_path"],
+                "message": "动画生成成功（缓存）",
+                "error": None,
+                "draft_path": status["draft_path"],
+                "render_id": render_id,
+                "render_status": "done"
+            }
+        
+        draft = await self.render_draft(code, quality, scene_name)
+        if not draft["success"]:
+            return {
+                "success": False,
+                "video_path": None,
+                "message": "草稿渲染失败",
+                "error": draft["error"],
+                "draft_path": None,
+                "render_id": None,
+                "render_status": "failed"
+            }
+        
+        self._start_background_render(render_id, code, quality, scene_name, draft["image_path"])
+        return {
+            "success": True,
+            "video_path": None,
+            "message": "草稿已生成，最终视频正在后台渲染",
+            "error": None,
+            "draft_path": draft["image_path"],
+            "render_id": render_id,
+            "render_status": "rendering"
+        }
+    
+    def get_render_status(self, render_id: str) -> Optional[Dict[str, Any]]:
+        """查询渐进渲染的最终视频状态"""
+        entry = self._background_renders.get(render_id)
+        if entry:
+            return {key: value for key, value in entry.items() if key != "task"}
+        
+        # 其他服务进程完成的渲染可以从共享的缓存目录中找到
+        if self.render_cache:
+            video_path = self.render_cache.get(render_id)
+            if video_path:
+                draft_path = self.render_cache.get(render_id, variant="draft")
+                return {
+                    "render_id": render_id,
+                    "status": "done",
+                    "video_path": self._to_web_path(video_path),
+                    "draft_path": self._to_web_path(draft_path) if draft_path else None,
+                    "error": None,
+                    "updated_at": time.time()
+                }
+        return None
+    
+    def _start_background_render(
+        self,
+        render_id: str,
+        code: str,
+        quality: QualityType,
+        scene_name: Optional[str],
+        draft_path: str
+    ):
+        """启动后台最终渲染，相同render_id正在渲染时直接复用"""
+        now = time.time()
+        for stale_id in [
+            key for key, entry in self._background_renders.items()
+            if entry["status"] != "rendering" and now - entry["updated_at"] > RENDER_STATUS_TTL
+        ]:
+            del self._background_renders[stale_id]
         
-        manim_logger.debug(f"创建临时文件: {temp_file}")
+        existing = self._background_renders.get(render_id)
+        if existing and existing["status"] == "rendering":
+            return
         
-        # 写入代码
-        with open(temp_file, 'w', encoding='utf-8') as f:
+        entry = {
+            "render_id": render_id,
+            "status": "rendering",
+            "video_path": None,
+            "draft_path": draft_path,
+            "error": None,
+            "updated_at": now,
+            "task": None
+        }
+        self._background_renders[render_id] = entry
+        entry["task"] = asyncio.create_task(self._background_render(entry, code, quality, scene_name))
+        manim_logger.info(f"已启动后台最终渲染 - ID: {render_id[:12]}, 质量: {quality.value}")
+    
+    async def _background_render(
+        self,
+        entry: Dict[str, Any],
+        code: str,
+        quality: QualityType,
+        scene_name: Optional[str]
+    ):
+        deadline = time.monotonic() + settings.render_background_max_wait
+        try:
+            while True:
+                try:
+                    result = await self.execute_manim_code(code, quality, scene_name)
+                    break
+                except AdmissionRejected as e:
+                    # 后台渲染不需要立即返回，繁忙时稍后重试，直到超过最长等待时间
+                    if time.monotonic() + e.retry_after > deadline:
+                        manim_logger.warning(f"后台最终渲染长时间未获得渲染名额，放弃 - ID: {entry['render_id'][:12]}")
+                        result = {
+                            "success": False,
+                            "video_path": None,
+                            "error": f"渲染服务繁忙，{settings.render_background_max_wait:.0f}秒内未能开始渲染"
+                        }
+                        break
+                    await asyncio.sleep(e.retry_after)
+            
+            entry["status"] = "done" if result["success"] else "failed"
+            entry["video_path"] = result["video_path"]
+            entry["error"] = result["error"]
+        except asyncio.CancelledError:
+            entry["status"] = "failed"
+            entry["error"] = "后台渲染已取消"
+            raise
+        finally:
+            entry["updated_at"] = time.time()
+            manim_logger.info(f"后台最终渲染结束 - ID: {entry['render_id'][:12]}, 状态: {entry['status']}")
+    
+    def _create_workspace(self, code: str) -> Path:
+        """创建任务专属的工作目录并写入场景代码
+        
+        目录名使用UUID并以exist_ok=False原子创建，多个进程共享同一磁盘时也不会冲突。
+        """
+        workspace = self.temp_dir / f"job_{uuid.uuid4().hex}"
+        workspace.mkdir(exist_ok=False)
+        self._write_source(workspace, code)
+        return workspace
+    
+    def _write_source(self, workspace: Path, code: str):
+        """写入场景代码"""
+        source_file = workspace / "scene.py"
+        with open(source_file, 'w', encoding='utf-8') as f:
             f.write(code)
+        manim_logger.debug(f"代码已写入工作目录，大小: {source_file.stat().st_size}字节")
+    
+    def _session_workspace(self, session_id: str, scene_name: str) -> Tuple[Path, asyncio.Lock]:
+        """获取编辑会话中某个场景的工作目录及其锁
+        
+        目录在多次渲染之间保留 media/videos/partial_movie_files，manim按动画内容哈希
+        命中其中的分段视频。分段视频按场景存放，因此每个场景使用独立的目录和锁，
+        多场景渲染时各场景可以并行。锁只在本进程内生效，多进程部署时同一会话应路由到同一进程。
+        """
+        self._prune_sessions()
         
-        manim_logger.debug(f"代码已写入临时文件，大小: {temp_file.stat().st_size}字节")
-        return temp_file
+        # 会话ID来自客户端，与场景名一起哈希后作为目录名
+        digest = hashlib.sha256(f"{session_id}\0{scene_name}".encode('utf-8')).hexdigest()[:32]
+        workspace = self.sessions_dir / f"session_{digest}"
+        workspace.mkdir(exist_ok=True)
+        os.utime(workspace)
+        
+        lock = self._session_locks.setdefault(workspace.name, asyncio.Lock())
+        return workspace, lock
+    
+    def _prune_sessions(self):
+        """删除闲置超时的会话目录"""
+        max_age = settings.render_session_ttl_minutes * 60
+        now = time.time()
+        for workspace in self.sessions_dir.glob("session_*"):
+            lock = self._session_locks.get(workspace.name)
+            if lock and lock.locked():
+                continue
+            try:
+                if now - workspace.stat().st_mtime > max_age:
+                    shutil.rmtree(workspace, ignore_errors=True)
+                    self._session_locks.pop(workspace.name, None)
+                    manim_logger.info(f"清理闲置的会话目录: {workspace.name}")
+            except FileNotFoundError:
+                continue
     
     def _extract_scene_name(self, code: str) -> str:
-        """从代码中提取场景类名"""
-        manim_logger.debug("开始提取场景类名")
-        
-        lines = code.split('\n')
-        for line in lines:
-            line = line.strip()
-            if line.startswith('class ') and '(Scene)' in line:
-                # 提取类名
-                class_def = line.split('class ')[1].split('(')[0].strip()
-                manim_logger.debug(f"找到场景类: {class_def}")
-                return class_def
+        """从代码中提取第一个场景类名"""
+        return self._discover_scenes(code)[0]
+    
+    def _discover_scenes(self, code: str) -> List[str]:
+        """找出需要渲染的全部场景类（按源码顺序）
+        
+        直接或间接继承自 *Scene 基类（Scene、MovingCameraScene、ThreeDScene等）的类都算作场景，
+        被同一文件中其他场景继承的中间基类不单独渲染。
+        """
+        scenes = code_analyzer.analyze(code).scene_names
+        
+        if scenes:
+            manim_logger.debug(f"找到场景类: {', '.join(scenes)}")
+            return scenes
         
         # 如果没有找到，返回默认名称
         default_name = "MyScene"
         manim_logger.warning(f"未找到场景类定义，使用默认名称: {default_name}")
-        return default_name
+        return [default_name]
     
     async def _run_manim_command(
         self,
-        temp_file: Path,
+        workspace: Path,
         scene_name: str,
-        quality: QualityType
+        quality: QualityType,
+        progress_callback: Optional[ProgressCallback] = None,
+        draft: bool = False
     ) -> Dict[str, Any]:
-        """运行Manim命令"""
+        """运行Manim命令（draft为True时只保存最后一帧PNG）"""
         
         # 质量映射
         quality_map = {
@@ -169,18 +728,39 @@ class ManimService:
             QualityType.PRODUCTION: "-qp"
         }
         
-        # 构建命令
-        output_filename = f"{scene_name}_{int(time.time())}"
+        # 所有中间文件和输出都放在任务工作目录中，输出路径可以直接确定
+        temp_file = workspace / "scene.py"
+        media_dir = (workspace / "media").absolute()
+        video_dir = media_dir / "videos"
+        images_dir = media_dir / "images"
+        output_filename = scene_name
+        
+        if self.render_pool:
+            return await self._run_in_pool(
+                temp_file, scene_name, quality, media_dir, video_dir, images_dir,
+                output_filename, progress_callback, draft
+            )
+        
+        # manim命令行没有单独指定视频目录的参数，通过任务专属的配置文件固定输出位置
+        config_file = self._write_render_config(workspace, media_dir, video_dir, images_dir)
+        
+        # 通过沙箱脚本启动manim，在子进程内设置CPU时间和内存上限并记录资源占用
+        usage_file = workspace / "usage.json"
         cmd = [
-            sys.executable, "-m", "manim",
-            quality_map[quality],
+            sys.executable, str(Path(__file__).with_name("render_sandbox.py")),
+            "--usage-file", str(usage_file.absolute()),
+            "--cpu-seconds", str(settings.render_cpu_time_limit),
+            "--memory-mb", str(settings.render_memory_limit_mb),
+            "--",
+            *([quality_map[quality], "-s"] if draft else [quality_map[quality]]),
+            "--config_file", str(config_file.absolute()),
             "--output_file", output_filename,
             str(temp_file.absolute()),
             scene_name
         ]
         
         manim_logger.info(f"执行Manim命令: {' '.join(cmd)}")
-        manim_logger.debug(f"工作目录: {self.output_dir}")
+        manim_logger.debug(f"工作目录: {workspace}")
         
         try:
             # 在Windows下使用ProactorEventLoop来避免NotImplementedError
@@ -191,9 +771,9 @@ class ManimService:
                         cmd,
                         stdout=subprocess.PIPE,
                         stderr=subprocess.PIPE,
-                        cwd=str(self.output_dir),
+                        cwd=str(workspace),
                         text=True,
-                        timeout=300  # 5分钟超时
+                        timeout=settings.render_job_timeout
                     )
                     return result
                 
@@ -207,15 +787,48 @@ class ManimService:
                 
             else:
                 # 在非Windows系统上使用原来的异步方法
+                # 子进程放入独立的进程组，超时或取消时连同ffmpeg一起结束
                 process = await asyncio.create_subprocess_exec(
                     *cmd,
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE,
-                    cwd=str(self.output_dir)
+                    cwd=str(workspace),
+                    start_new_session=True
                 )
                 
-                stdout, stderr = await process.communicate()
-                returncode = process.returncode
+                async def communicate():
+                    # 边读取stderr边解析进度条输出
+                    stdout, stderr = await asyncio.gather(
+                        process.stdout.read(),
+                        self._read_stderr_with_progress(process.stderr, progress_callback)
+                    )
+                    return stdout, stderr, await process.wait()
+                
+                try:
+                    stdout, stderr, returncode = await asyncio.wait_for(
+                        communicate(), timeout=settings.render_job_timeout
+                    )
+                except asyncio.TimeoutError:
+                    manim_logger.error(f"渲染超时（{settings.render_job_timeout}秒），终止Manim进程组 - PID: {process.pid}")
+                    await self._kill_process_group(process)
+                    self._read_resource_usage(usage_file)
+                    return {
+                        "success": False,
+                        "video_path": None,
+                        "error": f"渲染超时（{settings.render_job_timeout}秒）"
+                    }
+                except asyncio.CancelledError:
+                    manim_logger.warning(f"渲染被取消，终止Manim进程组 - PID: {process.pid}")
+                    await self._kill_process_group(process)
+                    self._read_resource_usage(usage_file)
+                    raise
+            
+            resource_usage = self._read_resource_usage(usage_file)
+            if resource_usage:
+                manim_logger.info(
+                    f"渲染资源占用 - CPU: {resource_usage['cpu_seconds']}秒, "
+                    f"内存峰值: {resource_usage['max_rss_mb']}MB"
+                )
             
             # 记录命令输出
             if stdout:
@@ -226,40 +839,53 @@ class ManimService:
             manim_logger.info(f"Manim命令执行完成，退出码: {returncode}")
             
             if returncode == 0:
-                # 查找生成的视频文件
-                video_path = self._find_generated_video(scene_name)
+                # 定位生成的视频文件（草稿为图片）
+                if draft:
+                    image_path = images_dir / f"{output_filename}.png"
+                    video_path = image_path if image_path.exists() else None
+                else:
+                    with STAGE_SECONDS.time(stage="file_lookup"):
+                        video_path = self._locate_video(video_dir, output_filename)
                 
                 if video_path:
                     manim_logger.success(f"找到生成的视频文件: {video_path}")
-                    # 将Windows路径转换为Web兼容的路径格式（使用正斜杠）
-                    web_compatible_path = str(video_path).replace('\\', '/')
                     return {
                         "success": True,
-                        "video_path": web_compatible_path,
-                        "error": None
+                        "video_path": self._to_web_path(video_path),
+                        "error": None,
+                        "resource_usage": resource_usage
                     }
                 else:
                     manim_logger.error("Manim命令执行成功但未找到输出视频文件")
                     return {
                         "success": False,
                         "video_path": None,
-                        "error": "无法找到生成的视频文件"
+                        "error": "无法找到生成的视频文件",
+                        "resource_usage": resource_usage
                     }
+            elif hasattr(signal, "SIGXCPU") and returncode == -signal.SIGXCPU:
+                manim_logger.error(f"Manim进程超出CPU时间限制（{settings.render_cpu_time_limit}秒）")
+                return {
+                    "success": False,
+                    "video_path": None,
+                    "error": f"渲染超出CPU时间限制（{settings.render_cpu_time_limit}秒）",
+                    "resource_usage": resource_usage
+                }
             else:
                 error_message = stderr.decode('utf-8') if stderr else "Unknown error"
                 manim_logger.error(f"Manim命令执行失败: {error_message}")
                 return {
                     "success": False,
                     "video_path": None,
-                    "error": f"Manim命令执行失败: {error_message}"
+                    "error": f"Manim命令执行失败: {error_message}",
+                    "resource_usage": resource_usage
                 }
                 
         except Exception as e:
             manim_logger.error(f"执行Manim命令时出现异常: {str(e)}", exc_info=True)
             # 记录更多调试信息
             manim_logger.error(f"命令详情: {cmd}")
-            manim_logger.error(f"工作目录: {self.output_dir}")
-            manim_logger.error(f"临时文件: {temp_file}")
+            manim_logger.error(f"工作目录: {workspace}")
             manim_logger.error(f"异常类型: {type(e).__name__}")
             
             return {
@@ -268,48 +894,213 @@ class ManimService:
                 "error": f"执行命令时出错: {type(e).__name__}: {str(e)}"
             }
     
-    def _find_generated_video(self, scene_name: str) -> Optional[Path]:
-        """查找生成的视频文件"""
-        manim_logger.debug(f"查找生成的视频文件，场景名: {scene_name}")
-        
-        # 在输出目录中查找视频文件
-        possible_extensions = ['.mp4', '.mov', '.avi']
-        
-        # 查找媒体目录
-        media_dirs = list(self.output_dir.glob("media/**"))
-        manim_logger.debug(f"找到 {len(media_dirs)} 个媒体目录")
-        
-        for media_dir in media_dirs:
-            if media_dir.is_dir():
-                manim_logger.debug(f"搜索媒体目录: {media_dir}")
-                for ext in possible_extensions:
-                    # 查找包含场景名称的视频文件
-                    video_files = list(media_dir.glob(f"*{scene_name}*{ext}"))
-                    if video_files:
-                        manim_logger.info(f"在媒体目录中找到视频文件: {video_files[0]}")
-                        return video_files[0]  # 返回第一个匹配的文件
-        
-        # 如果在媒体目录没找到，直接在输出目录查找
-        manim_logger.debug("在输出根目录中搜索视频文件")
-        for ext in possible_extensions:
-            video_files = list(self.output_dir.glob(f"*{scene_name}*{ext}"))
-            if video_files:
-                manim_logger.info(f"在输出目录中找到视频文件: {video_files[0]}")
-                return video_files[0]
-        
-        manim_logger.warning(f"未找到包含场景名 '{scene_name}' 的视频文件")
+    def _write_render_config(self, workspace: Path, media_dir: Path, video_dir: Path, images_dir: Path) -> Path:
+        """生成任务专属的manim配置文件"""
+        config_file = workspace / "manim.cfg"
+        # 配置文件按configparser解析，路径中的%需要转义
+        def escape(path: Path) -> str:
+            return str(path).replace('%', '%%')
+        config_file.write_text(
+            "[CLI]\n"
+            f"media_dir = {escape(media_dir)}\n"
+            f"video_dir = {escape(video_dir)}\n"
+            f"images_dir = {escape(images_dir)}\n",
+            encoding='utf-8'
+        )
+        return config_file
+    
+    async def _kill_process_group(self, process: asyncio.subprocess.Process):
+        """结束子进程所在的整个进程组"""
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+    
+    def _read_resource_usage(self, usage_file: Path) -> Optional[Dict[str, Any]]:
+        """读取并删除沙箱脚本写出的资源占用记录"""
+        try:
+            with open(usage_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+        finally:
+            try:
+                usage_file.unlink()
+            except OSError:
+                pass
+    
+    async def _read_stderr_with_progress(
+        self,
+        stream: asyncio.StreamReader,
+        progress_callback: Optional[ProgressCallback]
+    ) -> bytes:
+        """读取子进程stderr，并把manim进度条转换为进度事件"""
+        chunks = []
+        pending = ""
+        last_progress = None
+        
+        while True:
+            chunk = await stream.read(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            
+            if not progress_callback:
+                continue
+            
+            # 进度条使用\r原地刷新，按\r和\n切分
+            pending += chunk.decode('utf-8', errors='replace')
+            *lines, pending = re.split(r"[\r\n]", pending)
+            for line in lines:
+                match = _PROGRESS_RE.search(line)
+                if not match:
+                    continue
+                progress = (int(match.group(1)) + 1, int(match.group(2)))
+                if progress != last_progress:
+                    last_progress = progress
+                    progress_callback({"stage": "rendering", "animation": progress[0], "percent": progress[1]})
+        
+        return b"".join(chunks)
+    
+    async def _run_in_pool(
+        self,
+        temp_file: Path,
+        scene_name: str,
+        quality: QualityType,
+        media_dir: Path,
+        video_dir: Path,
+        images_dir: Path,
+        output_filename: str,
+        progress_callback: Optional[ProgressCallback] = None,
+        draft: bool = False
+    ) -> Dict[str, Any]:
+        """在常驻渲染进程中执行渲染"""
+        job = {
+            "code": temp_file.read_text(encoding='utf-8'),
+            "source_path": str(temp_file.absolute()),
+            "scene_name": scene_name,
+            "quality": quality.value,
+            "media_dir": str(media_dir),
+            "video_dir": str(video_dir),
+            "images_dir": str(images_dir),
+            "output_file": output_filename,
+            "draft": draft
+        }
+        
+        manim_logger.info(f"提交渲染任务到进程池 - 场景: {scene_name}, 输出: {output_filename}")
+        on_progress = None
+        if progress_callback:
+            # 进程池按动画粒度上报，每条消息表示一段动画已完成
+            def on_progress(payload):
+                progress_callback({
+                    "stage": "rendering",
+                    "animation": payload["animations_done"],
+                    "percent": 100
+                })
+        
+        result = await self.render_pool.render(job, on_progress=on_progress)
+        
+        if not result["success"]:
+            manim_logger.error(f"进程池渲染失败: {result['error']}")
+            return {
+                "success": False,
+                "video_path": None,
+                "error": f"Manim渲染失败: {result['error']}",
+                "resource_usage": result.get("resource_usage")
+            }
+        
+        video_path = Path(result["video_path"])
+        with STAGE_SECONDS.time(stage="file_lookup"):
+            video_exists = video_path.exists()
+        if not video_exists:
+            manim_logger.error(f"进程池渲染完成但输出文件不存在: {video_path}")
+            return {
+                "success": False,
+                "video_path": None,
+                "error": "无法找到生成的视频文件"
+            }
+        
+        manim_logger.success(f"进程池渲染完成: {video_path}")
+        return {
+            "success": True,
+            "video_path": self._to_web_path(video_path),
+            "error": None,
+            "resource_usage": result.get("resource_usage")
+        }
+    
+    def _to_web_path(self, path: Path) -> str:
+        """转换为相对工作目录、使用正斜杠的Web路径"""
+        try:
+            path = path.resolve().relative_to(Path.cwd().resolve())
+        except ValueError:
+            pass
+        return str(path).replace('\\', '/')
+    
+    def _locate_video(self, video_dir: Path, output_filename: str) -> Optional[Path]:
+        """在任务专属的视频目录中定位输出文件"""
+        # 默认输出为mp4，直接检查预期路径
+        expected = video_dir / f"{output_filename}.mp4"
+        if expected.exists():
+            return expected
+        
+        # 透明背景或gif格式时扩展名不同，目录中只有本任务的输出
+        for ext in ('.mov', '.webm', '.gif'):
+            candidate = video_dir / f"{output_filename}{ext}"
+            if candidate.exists():
+                return candidate
+        
+        manim_logger.warning(f"未在视频目录中找到输出文件: {video_dir / output_filename}.*")
         return None
     
-    def _cleanup_temp_file(self, temp_file: Path):
-        """清理临时文件"""
+    def _publish_output(
+        self,
+        video_path: Path,
+        cache_key: Optional[str],
+        scene_name: str,
+        job_id: str,
+        variant: Optional[str] = None
+    ) -> Path:
+        """将工作目录中的视频（或草稿图）移入渲染缓存，未启用缓存时移入输出目录"""
+        with STAGE_SECONDS.time(stage="publish"):
+            if cache_key:
+                return self.render_cache.put(cache_key, video_path, variant=variant)
+            
+            target_dir = self.output_dir / ("drafts" if variant == "draft" else "videos")
+            target_dir.mkdir(parents=True, exist_ok=True)
+            target = target_dir / f"{scene_name}_{job_id}{video_path.suffix}"
+            shutil.move(str(video_path), str(target))
+            return target
+    
+    def _cleanup_workspace(self, workspace: Path):
+        """删除任务工作目录"""
         try:
-            if temp_file.exists():
-                temp_file.unlink()
-                manim_logger.debug(f"成功清理临时文件: {temp_file}")
-            else:
-                manim_logger.debug(f"临时文件不存在，无需清理: {temp_file}")
+            shutil.rmtree(workspace)
+            manim_logger.debug(f"成功清理工作目录: {workspace}")
+        except FileNotFoundError:
+            manim_logger.debug(f"工作目录不存在，无需清理: {workspace}")
         except Exception as e:
-            manim_logger.warning(f"清理临时文件失败: {temp_file}, 错误: {str(e)}")
+            manim_logger.warning(f"清理工作目录失败: {workspace}, 错误: {str(e)}")
+    
+    def _cleanup_stale_workspaces(self):
+        """清理异常退出遗留的工作目录
+        
+        多个服务进程可能共享同一临时目录，只删除明显超过渲染时限的目录。
+        """
+        max_age = settings.render_job_timeout * 2
+        now = time.time()
+        removed = 0
+        for workspace in self.temp_dir.glob("job_*"):
+            try:
+                if now - workspace.stat().st_mtime > max_age:
+                    shutil.rmtree(workspace, ignore_errors=True)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        if removed:
+            manim_logger.info(f"已清理遗留工作目录: {removed}个")
+        self._prune_sessions()
     
     async def save_video(
         self,
@@ -348,7 +1139,7 @@ class ManimService:
             
             # 复制文件
             file_size = source_path.stat().st_size
-            shutil.copy2(source_path, target_path)
+            await asyncio.to_thread(shutil.copy2, source_path, target_path)
             
             manim_logger.success(f"视频保存成功 - 大小: {file_size}字节, 路径: {target_path}")
             
@@ -366,50 +1157,53 @@ class ManimService:
             }
     
     def validate_code(self, code: str) -> Dict[str, Any]:
-        """验证Manim代码"""
+        """验证Manim代码
+        
+        基于共享的AST分析结果检查语法、场景类及其construct方法，
+        再运行静态检查规则（禁用API、未知名称、死循环），在渲染前拒绝注定失败的代码。
+        """
         manim_logger.info("开始验证Manim代码")
         manim_logger.debug(f"代码长度: {len(code)}字符")
+        validation_start = time.monotonic()
         
         try:
-            # 基本语法检查
-            manim_logger.debug("执行语法检查...")
-            compile(code, '<string>', 'exec')
-            manim_logger.debug("语法检查通过")
+            analysis = code_analyzer.analyze(code)
             
-            # 检查是否包含Scene类
-            if 'class ' not in code or '(Scene)' not in code:
-                manim_logger.warning("代码验证失败: 缺少Scene类")
+            if analysis.syntax_error:
+                manim_logger.error(f"代码语法错误: {analysis.syntax_error}")
                 return {
                     "valid": False,
-                    "error": "代码必须包含继承自Scene的类"
+                    "error": f"语法错误: {analysis.syntax_error}",
+                    "problems": analysis.problems
                 }
+            manim_logger.debug("语法检查通过")
             
-            # 检查是否有construct方法
-            if 'def construct(self):' not in code:
-                manim_logger.warning("代码验证失败: 缺少construct方法")
+            problems = rule_engine.check(analysis)
+            if problems:
+                manim_logger.warning(
+                    f"代码验证失败: {problems[0]['message']}（共{len(problems)}个问题）"
+                )
                 return {
                     "valid": False,
-                    "error": "Scene类必须包含construct方法"
+                    "error": "；".join(problem["message"] for problem in problems),
+                    "problems": problems
                 }
             
-            manim_logger.success("代码验证通过")
+            manim_logger.success(f"代码验证通过 - 场景: {', '.join(analysis.scene_names)}")
             return {
                 "valid": True,
-                "error": None
+                "error": None,
+                "problems": []
             }
             
-        except SyntaxError as e:
-            manim_logger.error(f"代码语法错误: {str(e)}")
-            return {
-                "valid": False,
-                "error": f"语法错误: {str(e)}"
-            }
         except Exception as e:
             manim_logger.error(f"代码验证异常: {str(e)}", exc_info=True)
             return {
                 "valid": False,
                 "error": f"验证失败: {str(e)}"
             }
+        finally:
+            STAGE_SECONDS.observe(time.monotonic() - validation_start, stage="validation")
 
     async def _simulate_manim_execution(
         self,
@@ -428,8 +1222,7 @@ class ManimService:
         if not scene_name:
             scene_name = self._extract_scene_name(code)
         
-        timestamp = int(time.time())
-        demo_filename = f"{scene_name}_{timestamp}_demo.txt"
+        demo_filename = f"{scene_name}_{uuid.uuid4().hex}_demo.txt"
         demo_path = self.output_dir / demo_filename
         
         manim_logger.info(f"创建演示文件: {demo_path}")
@@ -0,0 +1,266 @@
+"""
+提示词注册表
+
+系统提示词按版本登记，在启动时构建一次并在所有请求间复用同一字符串。
+消息布局保持"固定的系统提示词在前、可变内容在后"，使DeepSeek/Qwen/OpenAI的
+前缀缓存能够命中；同时按版本统计令牌用量、缓存命中的前缀令牌和渲染成功率，
+用于对提示词变体做A/B比较。
+"""
+
+import hashlib
+import threading
+from typing import Dict, Any, List, Optional
+
+from app.core.config import settings
+from app.core.logger import llm_logger
+
+# v1：最初的完整提示词，保留用于A/B对照（旧缓存按版本号区分）
+SYSTEM_PROMPT_V1 = """你是一个专业的Manim动画代码生成器。请根据用户的描述生成完整的、可执行的Manim代码。
+
+要求：
+1. 生成的代码必须是完整的、可运行的Manim Scene类
+2. 包含必要的import语句
+3. 代码风格清晰，有适当的注释
+4. 确保动画逻辑正确，视觉效果良好
+5. 只返回Python代码，不要包含任何解释文字
+
+⚠️ 重要限制 - 避免LaTeX依赖：
+- 不要使用 Tex() 或 MathTex() 类
+- 不要使用 get_axis_labels() 方法
+- 不要使用 get_x_axis_label() 或 get_y_axis_label() 方法
+- 使用 Text() 类代替 Tex() 来显示文本
+- 如果需要坐标轴，创建不带标签的 Axes()
+- 如果需要数学符号，使用 Text() 或简单的几何图形
+
+推荐的替代方案：
+- 使用 Text("x") 而不是 Tex("x")
+- 使用 Axes() 而不是 axes.get_axis_labels()
+- 使用简单的几何图形和颜色来表达数学概念
+
+以下是一个示例格式：
+
+```python
+from manim import *
+
+class MyScene(Scene):
+    def construct(self):
+        # 使用Text而不是Tex
+        title = Text("动画标题", font_size=36)
+        
+        # 创建不带标签的坐标轴
+        axes = Axes(
+            x_range=[-3, 3, 1],
+            y_range=[-3, 3, 1],
+            axis_config={"color": BLUE}
+        )
+        
+        # 你的动画代码
+        self.play(Write(title))
+        self.play(Create(axes))
+```
+
+请根据用户的描述生成相应的Manim代码。"""
+
+# v2：精简版，保留全部约束，去掉重复的说明和示例中的冗余部分
+SYSTEM_PROMPT_V2 = """你是Manim动画代码生成器。根据用户描述输出一个完整可运行的Python文件：
+- 以 from manim import * 开头，包含一个继承自Scene的类及其construct方法
+- 只输出代码，不要解释文字；可以有简短注释
+
+禁止依赖LaTeX：不要使用 Tex()、MathTex()、get_axis_labels()、get_x_axis_label()、get_y_axis_label()。
+文字一律用 Text()，坐标轴用不带标签的 Axes()，数学符号用 Text() 或几何图形表示。
+
+示例：
+```python
+from manim import *
+
+class MyScene(Scene):
+    def construct(self):
+        title = Text("动画标题", font_size=36)
+        axes = Axes(x_range=[-3, 3, 1], y_range=[-3, 3, 1], axis_config={"color": BLUE})
+        self.play(Write(title))
+        self.play(Create(axes))
+```"""
+
+# 辅助调用的用户消息同样把固定说明放在前面、可变内容放在后面
+REPAIR_PROMPT_TEMPLATE = """下面的Manim代码渲染失败了，请修复代码中的错误：只修改导致错误的部分，保持动画内容不变，并返回修复后的完整代码。
+
+原始需求：
+{prompt}
+
+当前代码：
+```python
+{code}
+```
+
+错误信息：
+```
+{error}
+```"""
+
+EDIT_SYSTEM_PROMPT = """你是一个专业的Manim动画代码编辑器。用户会给出当前的Manim代码和修改要求，
+请只输出需要修改的部分，格式为一个或多个SEARCH/REPLACE块：
+
+<<<<<<< SEARCH
+（当前代码中需要被替换的连续若干行，必须与当前代码逐字一致）
+=======
+（替换后的内容）
+>>>>>>> REPLACE
+
+要求：
+1. SEARCH部分包含足够的上下文，使其在当前代码中只出现一次
+2. 多处修改使用多个块，按代码中的先后顺序排列
+3. 不要输出完整文件，不要输出解释文字
+4. 修改后的代码仍必须是完整、可运行的Manim Scene
+
+⚠️ 重要限制 - 避免LaTeX依赖：
+- 不要使用 Tex() 或 MathTex() 类
+- 不要使用 get_axis_labels()、get_x_axis_label()、get_y_axis_label() 方法
+- 使用 Text() 类显示文本，使用不带标签的 Axes()"""
+
+EDIT_PROMPT_TEMPLATE = """{history}当前代码：
+```python
+{code}
+```
+
+修改要求：
+{instruction}"""
+
+USER_PROMPT_TEMPLATE = """请为以下描述生成Manim动画代码：
+
+{prompt}"""
+
+# 语义缓存找到相似的历史描述时，把当时渲染成功的代码作为参考示例
+FEW_SHOT_PROMPT_TEMPLATE = """以下是一个相似需求的参考实现（已渲染成功），可以借鉴其结构和写法：
+
+参考需求：{example_prompt}
+
+参考代码：
+```python
+{example_code}
+```
+
+请为以下描述生成Manim动画代码：
+
+{prompt}"""
+
+class PromptVariant:
+    """一个版本的系统提示词及其效果统计"""
+
+    def __init__(self, version: str, system_prompt: str, weight: int = 0):
+        self.version = version
+        self.system_prompt = system_prompt
+        self.weight = weight
+
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.renders_succeeded = 0
+        self.renders_failed = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        renders = self.renders_succeeded + self.renders_failed
+        return {
+            "weight": self.weight,
+            "system_prompt_chars": len(self.system_prompt),
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_rate": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+            "avg_tokens_per_request": round(
+                (self.prompt_tokens + self.completion_tokens) / self.requests, 1
+            ) if self.requests else 0.0,
+            "renders_succeeded": self.renders_succeeded,
+            "renders_failed": self.renders_failed,
+            "render_success_rate": round(self.renders_succeeded / renders, 3) if renders else 0.0
+        }
+
+class PromptRegistry:
+    """按版本管理系统提示词，并按权重把请求分配到各变体"""
+
+    def __init__(self, prompts: Dict[str, str], weights: Dict[str, int]):
+        self._variants: Dict[str, PromptVariant] = {
+            version: PromptVariant(version, text.strip(), weights.get(version, 0))
+            for version, text in prompts.items()
+        }
+        self._lock = threading.Lock()
+
+        active = [variant for variant in self._variants.values() if variant.weight > 0]
+        if not active:
+            # 配置无效时使用最新版本
+            latest = list(self._variants.values())[-1]
+            latest.weight = 1
+            active = [latest]
+        self._active: List[PromptVariant] = active
+        self._total_weight = sum(variant.weight for variant in active)
+
+        # 修复、编辑等辅助调用共用权重最高的提示词，与生成请求共享缓存前缀
+        self.default = max(active, key=lambda variant: variant.weight)
+
+    def get(self, version: Optional[str]) -> Optional[PromptVariant]:
+        return self._variants.get(version) if version else None
+
+    def select(self, prompt: str) -> PromptVariant:
+        """按提示词哈希确定性地选择变体：同一描述总是落在同一版本上，不影响响应缓存命中"""
+        if len(self._active) == 1:
+            return self._active[0]
+        bucket = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16) % self._total_weight
+        for variant in self._active:
+            if bucket < variant.weight:
+                return variant
+            bucket -= variant.weight
+        return self._active[-1]
+
+    def record_usage(self, version: str, usage: Optional[Dict[str, int]]) -> None:
+        """记录一次调用的令牌用量（含服务商前缀缓存命中的令牌数）"""
+        variant = self._variants.get(version)
+        if variant is None:
+            return
+        with self._lock:
+            variant.requests += 1
+            if usage:
+                variant.prompt_tokens += usage.get("prompt_tokens", 0)
+                variant.cached_tokens += usage.get("cached_tokens", 0)
+                variant.completion_tokens += usage.get("completion_tokens", 0)
+
+    def record_render(self, version: Optional[str], success: bool) -> None:
+        """记录该版本生成的代码最终是否渲染成功"""
+        variant = self._variants.get(version) if version else None
+        if variant is None:
+            return
+        with self._lock:
+            if success:
+                variant.renders_succeeded += 1
+            else:
+                variant.renders_failed += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "default": self.default.version,
+                "variants": {version: variant.get_stats() for version, variant in self._variants.items()}
+            }
+
+def _parse_weights(value: str) -> Dict[str, int]:
+    """解析形如 "v1:1,v2:3" 的变体权重，省略权重时为1"""
+    weights: Dict[str, int] = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        version, _, weight = item.partition(":")
+        try:
+            weights[version.strip()] = int(weight) if weight else 1
+        except ValueError:
+            llm_logger.warning(f"提示词变体权重无效，已忽略: {item}")
+    return weights
+
+# 全局提示词注册表，启动时构建一次
+prompt_registry = PromptRegistry(
+    prompts={
+        "v1": SYSTEM_PROMPT_V1,
+        "v2": SYSTEM_PROMPT_V2,
+    },
+    weights=_parse_weights(settings.prompt_variants)
+)
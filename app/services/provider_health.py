@@ -0,0 +1,190 @@
+"""
+LLM服务商健康状态
+
+每个服务商一个熔断器和一个最近延迟窗口：连续失败达到阈值后熔断，冷却期内直接拒绝调用，
+冷却结束后放行一次试探请求，成功则恢复。延迟窗口用于计算对冲请求的等待时间（p90），
+以及在auto模式下选择最健康、最快的服务商。
+"""
+
+import time
+from collections import deque
+from typing import Dict, Any, Deque, Iterable, List, Optional
+
+from app.core.config import settings
+from app.core.logger import llm_logger
+
+class CircuitBreaker:
+    """三态熔断器：closed（正常）→ open（熔断）→ half_open（试探）"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self._state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """是否放行一次调用；半开状态下同一时间只放行一个试探请求"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        if self._state != self.CLOSED:
+            llm_logger.info(f"{self.name} 熔断恢复")
+        self._state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def release(self):
+        """调用既未成功也未失败（被取消、请求本身有误）时释放试探名额"""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self._state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self.times_opened += 1
+                llm_logger.warning(
+                    f"{self.name} 熔断 - 连续失败: {self.consecutive_failures}, 冷却: {self.reset_seconds}秒"
+                )
+            self._state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        """熔断状态下距离下一次试探的秒数"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at))
+
+class ProviderHealth:
+    """单个服务商的熔断器、延迟窗口和调用计数"""
+
+    def __init__(self, provider: str, failure_threshold: int, reset_seconds: float, window: int):
+        self.provider = provider
+        self.breaker = CircuitBreaker(provider, failure_threshold, reset_seconds)
+        # 最近成功调用的耗时（秒）
+        self.latencies: Deque[float] = deque(maxlen=window)
+        # 最近调用的结果，True为成功
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def record_success(self, latency: Optional[float] = None):
+        self.successes += 1
+        self.outcomes.append(True)
+        if latency is not None:
+            self.latencies.append(latency)
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.failures += 1
+        self.outcomes.append(False)
+        self.breaker.record_failure()
+
+    def percentile(self, q: float) -> Optional[float]:
+        """延迟窗口的分位数，样本不足时返回None"""
+        if len(self.latencies) < settings.llm_latency_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def success_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 1.0
+
+    def score(self) -> float:
+        """路由得分（越小越好）：中位延迟除以最近成功率；没有延迟样本时为0，优先试探"""
+        if not self.latencies:
+            return 0.0
+        median = sorted(self.latencies)[len(self.latencies) // 2]
+        return median / max(self.success_rate, 0.1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        p50 = self.percentile(0.5)
+        p90 = self.percentile(0.9)
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "times_opened": self.breaker.times_opened,
+            "retry_after": round(self.breaker.retry_after(), 1),
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "success_rate": round(self.success_rate, 3),
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p90": round(p90, 3) if p90 is not None else None,
+            "samples": len(self.latencies)
+        }
+
+class ProviderMonitor:
+    """全部服务商的健康状态，以及对冲请求的统计"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, window: int):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.window = window
+        self._providers: Dict[str, ProviderHealth] = {}
+
+        self.hedges_launched = 0
+        self.hedges_won = 0
+
+    def get(self, provider: str) -> ProviderHealth:
+        health = self._providers.get(provider)
+        if health is None:
+            health = ProviderHealth(provider, self.failure_threshold, self.reset_seconds, self.window)
+            self._providers[provider] = health
+        return health
+
+    def rank(self, providers: Iterable[str]) -> List[str]:
+        """按健康程度和速度排序：未熔断的在前，其中得分低的在前，得分相同时保持传入顺序"""
+        candidates = list(providers)
+        return sorted(
+            candidates,
+            key=lambda provider: (
+                self.get(provider).breaker.state == CircuitBreaker.OPEN,
+                self.get(provider).score(),
+                candidates.index(provider)
+            )
+        )
+
+    def hedge_delay(self, provider: str) -> float:
+        """发出对冲请求前的等待时间：该服务商的p90延迟，样本不足时使用配置的默认值"""
+        p90 = self.get(provider).percentile(0.9)
+        return p90 if p90 is not None else settings.llm_hedge_default_delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "providers": {provider: health.get_stats() for provider, health in self._providers.items()},
+            "hedges_launched": self.hedges_launched,
+            "hedges_won": self.hedges_won
+        }
+
+# 全局服务商健康状态实例
+provider_monitor = ProviderMonitor(
+    failure_threshold=settings.llm_breaker_failure_threshold,
+    reset_seconds=settings.llm_breaker_reset_seconds,
+    window=settings.llm_latency_window
+)
@@ -3,11 +3,14 @@
 """
 
 import json
+import time
 import asyncio  
 import aiohttp
 from typing import Dict, Any, Optional
 import logging
 from app.core.config import settings
+from app.core.http_client import http_client
+from app.core.metrics import ASR_SECONDS
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +45,13 @@ class QwenOmniService:
                 "error": "通义千问-Omni服务不可用"
             }
         
+        start_time = time.monotonic()
+        result = await self._speech_to_text(audio_base64)
+        ASR_SECONDS.observe(time.monotonic() - start_time, status="success" if result["success"] else "failure")
+        return result
+
+    async def _speech_to_text(self, audio_base64: str) -> Dict[str, Any]:
+        """调用识别接口，失败时按配置重试"""
         # 将base64音频数据包装为正确的数据URI格式
         audio_data_uri = f"data:audio/wav;base64,{audio_base64}"
         
@@ -81,71 +91,73 @@ class QwenOmniService:
             try:
                 logger.info(f"开始语音识别 (尝试 {attempt + 1}/{self.retry_times})")
                 
-                async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                    async with session.post(self.api_url, json=request_data, headers=headers) as response:
-                        if response.status == 200:
-                            # 处理流式响应
-                            full_text = ""
-                            async for line in response.content:
-                                if line:
-                                    line_str = line.decode('utf-8').strip()
-                                    if line_str.startswith('data: '):
-                                        data_part = line_str[6:]  # 去除 'data: ' 前缀
-                                        if data_part and data_part != '[DONE]':
-                                            try:
-                                                chunk_data = json.loads(data_part)
-                                                if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                                                    delta = chunk_data['choices'][0].get('delta', {})
-                                                    if 'content' in delta and delta['content'] is not None:
-                                                        full_text += delta['content']
-                                            except json.JSONDecodeError:
-                                                continue
-                            
-                            if full_text.strip():
-                                logger.info(f"语音识别成功: {full_text[:50]}...")
-                                return {
-                                    "success": True,
-                                    "text": full_text.strip(),
-                                    "method": "qwen_omni",
-                                    "model": self.model
-                                }
+                # 复用共享会话，重试时无需重新建立连接
+                session = http_client.get_session("dashscope")
+                request_timeout = aiohttp.ClientTimeout(total=self.timeout)
+                async with session.post(self.api_url, json=request_data, headers=headers, timeout=request_timeout) as response:
+                    if response.status == 200:
+                        # 处理流式响应
+                        full_text = ""
+                        async for line in response.content:
+                            if line:
+                                line_str = line.decode('utf-8').strip()
+                                if line_str.startswith('data: '):
+                                    data_part = line_str[6:]  # 去除 'data: ' 前缀
+                                    if data_part and data_part != '[DONE]':
+                                        try:
+                                            chunk_data = json.loads(data_part)
+                                            if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
+                                                delta = chunk_data['choices'][0].get('delta', {})
+                                                if 'content' in delta and delta['content'] is not None:
+                                                    full_text += delta['content']
+                                        except json.JSONDecodeError:
+                                            continue
+                        
+                        if full_text.strip():
+                            logger.info(f"语音识别成功: {full_text[:50]}...")
+                            return {
+                                "success": True,
+                                "text": full_text.strip(),
+                                "method": "qwen_omni",
+                                "model": self.model
+                            }
+                        else:
+                            logger.warning("语音识别返回空结果")
+                            return {
+                                "success": False,
+                                "text": "",
+                                "error": "识别结果为空"
+                            }
+                    else:
+                        error_text = await response.text()
+                        logger.error(f"API调用失败 (状态码: {response.status}): {error_text}")
+                        
+                        if response.status == 401:
+                            return {
+                                "success": False,
+                                "text": "",
+                                "error": "API密钥无效，请检查DASHSCOPE_API_KEY配置"
+                            }
+                        elif response.status == 429:
+                            if attempt < self.retry_times - 1:
+                                await asyncio.sleep(2 ** attempt)  # 指数退避
+                                continue
                             else:
-                                logger.warning("语音识别返回空结果")
                                 return {
                                     "success": False,
                                     "text": "",
-                                    "error": "识别结果为空"
+                                    "error": "API调用频率限制，请稍后重试"
                                 }
                         else:
-                            error_text = await response.text()
-                            logger.error(f"API调用失败 (状态码: {response.status}): {error_text}")
-                            
-                            if response.status == 401:
+                            if attempt < self.retry_times - 1:
+                                continue
+                            else:
                                 return {
                                     "success": False,
                                     "text": "",
-                                    "error": "API密钥无效，请检查DASHSCOPE_API_KEY配置"
+                                    "error": f"API调用失败: {error_text}"
                                 }
-                            elif response.status == 429:
-                                if attempt < self.retry_times - 1:
-                                    await asyncio.sleep(2 ** attempt)  # 指数退避
-                                    continue
-                                else:
-                                    return {
-                                        "success": False,
-                                        "text": "",
-                                        "error": "API调用频率限制，请稍后重试"
-                                    }
-                            else:
-                                if attempt < self.retry_times - 1:
-                                    continue
-                                else:
-                                    return {
-                                        "success": False,
-                                        "text": "",
-                                        "error": f"API调用失败: {error_text}"
-                                    }
-                            
+                        
             except asyncio.TimeoutError:
                 logger.warning(f"语音识别超时 (尝试 {attempt + 1}/{self.retry_times})")
                 if attempt < self.retry_times - 1:
@@ -0,0 +1,165 @@
+"""
+基于内容寻址的渲染结果缓存
+
+以规范化后的场景源码、场景名、质量和manim版本计算哈希作为键，
+命中时直接复用 output_dir 下已生成的视频文件。
+同一个键下可以附带变体（例如渐进渲染的草稿图），以 <key>.<variant> 形式存放。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from app.core.logger import manim_logger
+from app.models.schemas import QualityType
+
+def _detect_manim_version() -> str:
+    """读取已安装的manim版本，版本变化时缓存自动失效"""
+    try:
+        from importlib.metadata import version
+        return version("manim")
+    except Exception:
+        return "unknown"
+
+class RenderCache:
+    """渲染视频的LRU缓存，按总大小和闲置时间淘汰"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int, max_age_seconds: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.manim_version = _detect_manim_version()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # key -> {"path": Path, "size": int, "last_used": float}，按最近使用排序
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        self._load()
+
+    def _load(self):
+        """从缓存目录恢复索引（按修改时间还原LRU顺序）"""
+        files = [p for p in self.cache_dir.iterdir() if p.is_file() and not p.name.startswith(".")]
+        files.sort(key=lambda p: p.stat().st_mtime)
+        for path in files:
+            stat = path.stat()
+            self._entries[path.stem] = {
+                "path": path,
+                "size": stat.st_size,
+                "last_used": stat.st_mtime
+            }
+            self._total_bytes += stat.st_size
+
+        with self._lock:
+            self._evict_locked()
+        manim_logger.info(f"渲染缓存已加载 - 条目: {len(self._entries)}, 大小: {self._total_bytes / 1024 / 1024:.1f}MB")
+
+    def make_key(self, code_fingerprint: str, scene_name: str, quality: QualityType) -> str:
+        """计算缓存键
+
+        code_fingerprint 由代码分析给出（AST指纹），只改动注释或空白的代码共用同一条缓存。
+        """
+        payload = json.dumps(
+            [code_fingerprint, scene_name, quality.value, self.manim_version],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _entry_id(key: str, variant: Optional[str]) -> str:
+        return f"{key}.{variant}" if variant else key
+
+    def get(self, key: str, variant: Optional[str] = None) -> Optional[Path]:
+        """查找缓存的视频（或其变体），命中时刷新其LRU位置"""
+        key = self._entry_id(key, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.time()
+
+            if entry and (not entry["path"].exists() or now - entry["last_used"] > self.max_age_seconds):
+                self._remove_locked(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            entry["last_used"] = now
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        try:
+            os.utime(entry["path"], (now, now))
+        except OSError:
+            pass
+        return entry["path"]
+
+    def put(self, key: str, video_path: Path, variant: Optional[str] = None) -> Path:
+        """将渲染结果移入缓存目录并返回缓存中的路径"""
+        key = self._entry_id(key, variant)
+        target = self.cache_dir / f"{key}{video_path.suffix}"
+        staging = self.cache_dir / f".{key}.{os.getpid()}.{threading.get_ident()}{video_path.suffix}"
+
+        shutil.move(str(video_path), str(staging))
+        os.replace(staging, target)
+        size = target.stat().st_size
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key]["size"]
+            self._entries[key] = {"path": target, "size": size, "last_used": time.time()}
+            self._entries.move_to_end(key)
+            self._total_bytes += size
+            self.stores += 1
+            self._evict_locked()
+
+        manim_logger.debug(f"渲染结果已缓存 - 键: {key[:12]}, 大小: {size}字节")
+        return target
+
+    def _evict_locked(self):
+        now = time.time()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            expired = now - entry["last_used"] > self.max_age_seconds
+            if not expired and self._total_bytes <= self.max_bytes:
+                break
+            self._remove_locked(key)
+            self.evictions += 1
+            manim_logger.debug(f"淘汰渲染缓存 - 键: {key[:12]}, 原因: {'过期' if expired else '超出容量'}")
+
+    def _remove_locked(self, key: str):
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry["size"]
+        try:
+            entry["path"].unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            manim_logger.warning(f"删除缓存文件失败: {entry['path']}, 错误: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self._total_bytes / 1024 / 1024, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions
+            }
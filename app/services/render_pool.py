@@ -0,0 +1,251 @@
+"""
+常驻Manim渲染进程池
+
+每个工作进程只导入一次manim，之后通过管道接收场景源码并渲染，
+避免每次请求都支付解释器启动和manim导入的固定开销。
+"""
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional
+
+from app.core.logger import manim_logger
+from app.services.render_worker import worker_main
+
+class RenderWorkerTimeout(Exception):
+    """渲染任务超过时间限制"""
+
+class RenderWorker:
+    """单个常驻渲染进程"""
+
+    def __init__(self, ctx, index: int, cpu_seconds: int = 0, memory_mb: int = 0):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=worker_main,
+            args=(child_conn, cpu_seconds, memory_mb),
+            name=f"manim-render-{index}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+        self.ready = False
+        self.jobs_done = 0
+        self.rss_mb = 0.0
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def exchange(
+        self,
+        job: Dict[str, Any],
+        timeout: float,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """发送任务并阻塞等待结果（在线程池中调用）"""
+        deadline = time.monotonic() + timeout
+        self.conn.send(job)
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.conn.poll(remaining):
+                raise RenderWorkerTimeout(f"渲染超时（{timeout}秒）")
+
+            kind, payload = self.conn.recv()
+            if kind == "ready":
+                self.ready = True
+                self.rss_mb = payload.get("rss_mb", 0.0)
+            elif kind == "progress":
+                if on_progress:
+                    on_progress(payload)
+            elif kind == "result":
+                return payload
+
+    def stop(self, timeout: float = 5.0):
+        """通知进程退出，超时则强制结束"""
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        """强制结束进程及其所在进程组（包括ffmpeg等子进程）"""
+        if self.process.is_alive():
+            if hasattr(os, "killpg"):
+                try:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                except (ProcessLookupError, PermissionError):
+                    self.process.kill()
+            else:
+                self.process.kill()
+        self.process.join(1)
+
+class RenderWorkerPool:
+    """管理一组常驻渲染进程"""
+
+    def __init__(
+        self,
+        size: int,
+        max_jobs_per_worker: int,
+        max_rss_mb: int,
+        job_timeout: int,
+        cpu_seconds: int = 0,
+        memory_mb: int = 0
+    ):
+        self.size = max(1, size)
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.job_timeout = job_timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+
+        # 使用spawn避免复制父进程中的事件循环和连接
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: List[RenderWorker] = []
+        self._lock = threading.Lock()
+        self._semaphore = asyncio.Semaphore(self.size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.size,
+            thread_name_prefix="manim-render"
+        )
+        self._spawned = 0
+
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.workers_recycled = 0
+        self.timeouts = 0
+
+    def start(self):
+        """预先启动全部工作进程，让manim导入在请求到来前完成"""
+        with self._lock:
+            while len(self._idle) < self.size:
+                self._idle.append(self._spawn())
+        manim_logger.info(f"渲染进程池已启动 - 进程数: {self.size}")
+
+    def _spawn(self) -> RenderWorker:
+        self._spawned += 1
+        worker = RenderWorker(self._ctx, self._spawned, self.cpu_seconds, self.memory_mb)
+        manim_logger.debug(f"启动渲染进程 - PID: {worker.pid}")
+        return worker
+
+    def _checkout(self) -> RenderWorker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.is_alive():
+                    return worker
+                manim_logger.warning(f"渲染进程已退出，丢弃 - PID: {worker.pid}")
+            return self._spawn()
+
+    def _checkin(self, worker: RenderWorker, succeeded: bool):
+        if not succeeded:
+            # 失败的任务可能留下了无法恢复的进程状态，不再复用该进程
+            reason = "任务失败"
+        elif worker.jobs_done >= self.max_jobs_per_worker:
+            reason = f"已完成 {worker.jobs_done} 个任务"
+        elif worker.rss_mb >= self.max_rss_mb:
+            reason = f"内存占用 {worker.rss_mb:.0f}MB"
+        else:
+            with self._lock:
+                self._idle.append(worker)
+            return
+
+        manim_logger.info(f"回收渲染进程 - PID: {worker.pid}, 原因: {reason}")
+        self.workers_recycled += 1
+        self._executor.submit(worker.stop)
+
+    async def render(
+        self,
+        job: Dict[str, Any],
+        timeout: Optional[float] = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """在空闲的工作进程中执行一个渲染任务
+
+        on_progress 会在事件循环线程中被调用。
+        """
+        timeout = timeout or self.job_timeout
+
+        async with self._semaphore:
+            worker = self._checkout()
+            manim_logger.debug(f"分配渲染进程 - PID: {worker.pid}, 场景: {job.get('scene_name')}")
+
+            loop = asyncio.get_running_loop()
+            forward_progress = None
+            if on_progress:
+                job = {**job, "report_progress": True}
+                def forward_progress(payload):
+                    loop.call_soon_threadsafe(on_progress, payload)
+
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, worker.exchange, job, timeout, forward_progress
+                )
+            except RenderWorkerTimeout as e:
+                self.timeouts += 1
+                self.jobs_failed += 1
+                manim_logger.error(f"渲染进程超时，强制结束 - PID: {worker.pid}")
+                worker.kill()
+                return {"success": False, "video_path": None, "error": str(e)}
+            except asyncio.CancelledError:
+                # 调用方取消（客户端断开或任务被取消）时结束进程，阻塞中的线程随之返回
+                self.jobs_failed += 1
+                manim_logger.warning(f"渲染任务被取消，结束渲染进程 - PID: {worker.pid}")
+                worker.kill()
+                raise
+            except (EOFError, OSError) as e:
+                self.jobs_failed += 1
+                worker.kill()
+                exitcode = worker.process.exitcode
+                manim_logger.error(f"渲染进程异常退出 - PID: {worker.pid}, 退出码: {exitcode}")
+                if hasattr(signal, "SIGXCPU") and exitcode == -signal.SIGXCPU:
+                    error = f"渲染超出CPU时间限制（{self.cpu_seconds}秒）"
+                else:
+                    error = f"渲染进程异常退出（退出码: {exitcode}）: {type(e).__name__}"
+                return {"success": False, "video_path": None, "error": error}
+
+            worker.jobs_done += 1
+            worker.rss_mb = result.pop("rss_mb", worker.rss_mb)
+            if result["success"]:
+                self.jobs_completed += 1
+            else:
+                self.jobs_failed += 1
+
+            self._checkin(worker, result["success"])
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """进程池运行统计"""
+        with self._lock:
+            idle = len(self._idle)
+        return {
+            "size": self.size,
+            "idle_workers": idle,
+            "workers_spawned": self._spawned,
+            "workers_recycled": self.workers_recycled,
+            "jobs_completed": self.jobs_completed,
+            "jobs_failed": self.jobs_failed,
+            "timeouts": self.timeouts
+        }
+
+    def shutdown(self):
+        """停止所有工作进程"""
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.stop()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        manim_logger.info("渲染进程池已关闭")
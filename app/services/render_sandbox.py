@@ -0,0 +1,131 @@
+"""
+渲染沙箱：为manim渲染设置资源限制并记录资源占用
+
+既可以作为脚本启动manim（子进程渲染模式），
+也会被常驻渲染进程导入复用其中的资源限制函数。只依赖标准库。
+
+脚本用法:
+    python render_sandbox.py --usage-file usage.json --cpu-seconds 240 --memory-mb 4096 -- -qm scene.py MyScene
+"""
+
+import argparse
+import json
+import os
+import runpy
+import sys
+import time
+from typing import Dict, Any, List
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def cpu_time_used() -> float:
+    """当前进程及已回收子进程消耗的CPU时间（秒）"""
+    if resource is None:
+        return time.process_time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def set_memory_limit(memory_mb: int) -> None:
+    """限制进程地址空间大小，0表示不限制"""
+    if resource is None or memory_mb <= 0:
+        return
+    limit = memory_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def set_cpu_limit(seconds: int) -> None:
+    """从当前已用CPU时间起再允许seconds秒，超出后进程收到SIGXCPU；0表示不限制"""
+    if resource is None or seconds <= 0:
+        return
+    # RLIMIT_CPU只统计本进程自身的CPU时间，不包括已回收的子进程
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(own.ru_utime + own.ru_stime) + 1 + seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def clear_cpu_limit() -> None:
+    """取消CPU时间软限制"""
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+def reset_peak_rss() -> None:
+    """重置内存峰值统计（Linux），让常驻进程按任务统计峰值"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb() -> float:
+    """进程内存峰值（MB），优先读取可重置的VmHWM"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    if resource is None:
+        return 0.0
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    # macOS返回字节，Linux返回KB
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _parse_args(argv: List[str]):
+    if "--" in argv:
+        split = argv.index("--")
+        own_args, manim_args = argv[:split], argv[split + 1:]
+    else:
+        own_args, manim_args = argv, []
+
+    parser = argparse.ArgumentParser(description="在资源限制下运行manim")
+    parser.add_argument("--usage-file", required=True)
+    parser.add_argument("--cpu-seconds", type=int, default=0)
+    parser.add_argument("--memory-mb", type=int, default=0)
+    return parser.parse_args(own_args), manim_args
+
+def main(argv: List[str]) -> int:
+    args, manim_args = _parse_args(argv)
+
+    set_memory_limit(args.memory_mb)
+    set_cpu_limit(args.cpu_seconds)
+
+    start = time.monotonic()
+    exit_code = 0
+    sys.argv = ["manim", *manim_args]
+    try:
+        runpy.run_module("manim", run_name="__main__", alter_sys=True)
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            exit_code = e.code
+        elif e.code is not None:
+            exit_code = 1
+    finally:
+        usage: Dict[str, Any] = {
+            "cpu_seconds": round(cpu_time_used(), 3),
+            "max_rss_mb": round(peak_rss_mb(), 1),
+            "wall_seconds": round(time.monotonic() - start, 3)
+        }
+        try:
+            with open(args.usage_file, "w", encoding="utf-8") as f:
+                json.dump(usage, f)
+        except OSError:
+            pass
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
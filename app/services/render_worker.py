@@ -0,0 +1,213 @@
+"""
+常驻Manim渲染进程的入口
+
+该模块运行在渲染进程池的子进程中：启动时预先导入manim，之后在同一进程里
+exec场景代码并调用manim渲染。除manim外只使用标准库和同样只依赖标准库的
+render_sandbox（资源限制与占用统计），不导入配置、日志和服务模块，
+避免在子进程里重复初始化应用的日志与服务实例。
+"""
+
+import os
+import sys
+import time
+import traceback
+from typing import Dict, Any, Callable, Optional
+
+from app.services.render_sandbox import (
+    clear_cpu_limit,
+    cpu_time_used,
+    peak_rss_mb,
+    reset_peak_rss,
+    set_cpu_limit,
+    set_memory_limit,
+)
+
+def _current_rss_mb() -> float:
+    """读取当前进程的常驻内存（MB）"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS返回字节，Linux返回KB
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return 0.0
+
+_MISSING = object()
+
+def _snapshot_globals() -> Dict[str, Any]:
+    """记录任务可能改动的进程级状态：manim各模块的全局变量、sys.path、环境变量和工作目录"""
+    return {
+        "modules": {
+            name: dict(vars(module))
+            for name, module in list(sys.modules.items())
+            if module is not None and (name == "manim" or name.startswith("manim."))
+        },
+        "sys_path": list(sys.path),
+        "environ": dict(os.environ),
+        "cwd": os.getcwd()
+    }
+
+def _restore_globals(snapshot: Dict[str, Any]) -> None:
+    """把进程级状态恢复到任务开始前，上一个任务的改动不会带入下一个任务"""
+    for name, saved in snapshot["modules"].items():
+        module = sys.modules.get(name)
+        if module is None:
+            continue
+        namespace = vars(module)
+        for key in set(namespace) - set(saved):
+            del namespace[key]
+        for key, value in saved.items():
+            if namespace.get(key, _MISSING) is not value:
+                namespace[key] = value
+
+    sys.path[:] = snapshot["sys_path"]
+    if dict(os.environ) != snapshot["environ"]:
+        os.environ.clear()
+        os.environ.update(snapshot["environ"])
+    if os.getcwd() != snapshot["cwd"]:
+        os.chdir(snapshot["cwd"])
+
+def _track_progress(scene, report: Callable[[Dict[str, Any]], None]) -> None:
+    """包装scene.play，每完成一段动画上报一次进度（wait也经由play执行）"""
+    original_play = scene.play
+
+    def play(*args, **kwargs):
+        result = original_play(*args, **kwargs)
+        report({"animations_done": scene.renderer.num_plays})
+        return result
+
+    scene.play = play
+
+def _render_job(
+    job: Dict[str, Any],
+    report: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Dict[str, Any]:
+    """在隔离的命名空间中执行场景代码并渲染"""
+    from manim import config, tempconfig
+
+    source_path = job["source_path"]
+    scene_name = job["scene_name"]
+
+    # 每个任务使用独立的模块命名空间，避免场景之间互相污染；
+    # 代码在模块级修改的全局配置和manim模块状态在任务结束后恢复
+    namespace = {"__name__": "__manim_scene__", "__file__": source_path}
+    config_snapshot = config.copy()
+    globals_snapshot = _snapshot_globals()
+
+    try:
+        exec(compile(job["code"], source_path, "exec"), namespace)
+
+        scene_class = namespace.get(scene_name)
+        if scene_class is None:
+            return {
+                "success": False,
+                "video_path": None,
+                "error": f"代码中未找到场景类: {scene_name}"
+            }
+
+        overrides = {
+            "input_file": source_path,
+            "media_dir": job["media_dir"],
+            "video_dir": job["video_dir"],
+            "output_file": job["output_file"],
+        }
+        if job.get("draft"):
+            # 草稿只保存最后一帧，跳过动画和视频编码
+            overrides.update({
+                "images_dir": job["images_dir"],
+                "save_last_frame": True,
+                "write_to_movie": False,
+            })
+
+        with tempconfig(overrides):
+            config.quality = job["quality"]
+            scene = scene_class()
+            if report and job.get("report_progress"):
+                _track_progress(scene, report)
+            scene.render()
+            if job.get("draft"):
+                video_path = scene.renderer.file_writer.image_file_path
+            else:
+                video_path = scene.renderer.file_writer.movie_file_path
+
+        return {
+            "success": True,
+            "video_path": str(video_path),
+            "error": None
+        }
+
+    except Exception:
+        return {
+            "success": False,
+            "video_path": None,
+            "error": traceback.format_exc()
+        }
+
+    finally:
+        config.update(config_snapshot)
+        _restore_globals(globals_snapshot)
+
+def _render_with_limits(
+    job: Dict[str, Any],
+    report: Callable[[Dict[str, Any]], None],
+    cpu_seconds: int
+) -> Dict[str, Any]:
+    """在CPU时间限制下执行任务，并记录本次任务的资源占用"""
+    reset_peak_rss()
+    cpu_before = cpu_time_used()
+    wall_start = time.monotonic()
+
+    set_cpu_limit(cpu_seconds)
+    try:
+        result = _render_job(job, report)
+    finally:
+        clear_cpu_limit()
+
+    result["resource_usage"] = {
+        "cpu_seconds": round(cpu_time_used() - cpu_before, 3),
+        "max_rss_mb": round(peak_rss_mb(), 1),
+        "wall_seconds": round(time.monotonic() - wall_start, 3)
+    }
+    return result
+
+def worker_main(conn, cpu_seconds: int = 0, memory_mb: int = 0) -> None:
+    """渲染进程主循环：预热manim后循环接收任务"""
+    # 成为独立进程组的组长，超时时父进程可以连同ffmpeg等子进程一起结束
+    if hasattr(os, "setsid"):
+        os.setsid()
+
+    # 预先导入manim，后续任务无需再支付导入和初始化的开销
+    import manim  # noqa: F401
+
+    set_memory_limit(memory_mb)
+
+    conn.send(("ready", {"pid": os.getpid(), "rss_mb": _current_rss_mb()}))
+
+    def report(payload: Dict[str, Any]) -> None:
+        conn.send(("progress", payload))
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        if job is None:
+            break
+
+        result = _render_with_limits(job, report, cpu_seconds)
+        result["rss_mb"] = _current_rss_mb()
+
+        try:
+            conn.send(("result", result))
+        except (BrokenPipeError, OSError):
+            break
+
+    conn.close()
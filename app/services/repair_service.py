@@ -0,0 +1,179 @@
+"""
+渲染失败后的自动修复
+
+把精简后的错误信息和代码交给LLM修复，验证后重新渲染，直到成功或用尽
+尝试次数、令牌预算、时间上限之一。每次尝试的耗时都会返回，便于衡量修复成功率与额外延迟。
+"""
+
+import asyncio
+import re
+import time
+from typing import Dict, Any, Awaitable, Callable, List
+
+from app.core.config import settings
+from app.core.logger import app_logger
+from app.models.schemas import ModelType
+from app.services.llm_service import llm_service
+from app.services.manim_service import manim_service
+
+# 渲染代码并返回 execute_manim_code 格式的结果
+RenderFunc = Callable[[str], Awaitable[Dict[str, Any]]]
+
+_ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+# 工作目录中的源码路径，如 /srv/temp/job_xxx/scene.py
+_WORKSPACE_PATH_RE = re.compile(r"""[^\s"'(]*[/\\]scene\.py""")
+
+def trim_error(error: str, max_chars: int) -> str:
+    """去掉颜色控制符和工作目录路径，只保留错误信息末尾（异常类型和出错行通常在最后）"""
+    text = _ANSI_RE.sub("", error or "")
+    text = _WORKSPACE_PATH_RE.sub("scene.py", text)
+    lines = [line.rstrip() for line in text.splitlines() if line.strip()]
+    text = "\n".join(lines)
+    if len(text) <= max_chars:
+        return text
+    tail = text[-max_chars:]
+    # 从完整的行开始
+    newline = tail.find("\n")
+    return tail[newline + 1:] if 0 <= newline < len(tail) - 1 else tail
+
+class RepairService:
+    """有上限的修复-验证-渲染循环"""
+
+    def __init__(self, max_attempts: int, token_budget: int, time_limit: float, error_max_chars: int):
+        self.max_attempts = max_attempts
+        self.token_budget = token_budget
+        self.time_limit = time_limit
+        self.error_max_chars = error_max_chars
+
+        self.repairs_started = 0
+        self.repairs_succeeded = 0
+        self.attempts_total = 0
+
+    async def repair(
+        self,
+        prompt: str,
+        code: str,
+        error: str,
+        render: RenderFunc,
+        model: ModelType = ModelType.DEEPSEEK_CHAT,
+        temperature: float = 0.2,
+        max_tokens: int = 4000
+    ) -> Dict[str, Any]:
+        """从失败的代码和错误开始修复
+
+        返回 {"success", "code", "render_result", "error", "attempts", "tokens_used"}，
+        attempts中每项记录一次尝试的各阶段耗时、令牌用量和结果。
+        """
+        self.repairs_started += 1
+        start = time.monotonic()
+        attempts: List[Dict[str, Any]] = []
+        tokens_used = 0
+        stop_reason = "attempts"
+        render_result = None
+
+        for number in range(1, self.max_attempts + 1):
+            remaining_time = self.time_limit - (time.monotonic() - start)
+            if remaining_time <= 0:
+                stop_reason = "time_limit"
+                break
+            remaining_tokens = self.token_budget - tokens_used
+            if remaining_tokens <= 0:
+                stop_reason = "token_budget"
+                break
+
+            attempt: Dict[str, Any] = {"attempt": number, "status": "failed"}
+            attempts.append(attempt)
+            self.attempts_total += 1
+            attempt_start = time.monotonic()
+            app_logger.info(f"开始第{number}次自动修复 - 剩余时间: {remaining_time:.1f}秒, 剩余令牌: {remaining_tokens}")
+
+            try:
+                # 1. 请求LLM修复
+                stage_start = time.monotonic()
+                llm_result = await asyncio.wait_for(
+                    llm_service.repair_manim_code(
+                        prompt=prompt,
+                        code=code,
+                        error=trim_error(error, self.error_max_chars),
+                        model=model,
+                        temperature=temperature,
+                        max_tokens=min(max_tokens, remaining_tokens)
+                    ),
+                    timeout=remaining_time
+                )
+                attempt["llm_seconds"] = round(time.monotonic() - stage_start, 3)
+                attempt["tokens"] = llm_result["usage"]["total_tokens"]
+                tokens_used += attempt["tokens"]
+
+                if not llm_result["success"]:
+                    attempt["error"] = llm_result["error"]
+                    stop_reason = "llm_error"
+                    break
+
+                code = llm_result["code"]
+
+                # 2. 验证修复后的代码，验证失败时把问题交给下一次尝试
+                stage_start = time.monotonic()
+                validation = manim_service.validate_code(code)
+                attempt["validate_seconds"] = round(time.monotonic() - stage_start, 3)
+                if not validation["valid"]:
+                    attempt["status"] = "invalid"
+                    attempt["error"] = error = validation["error"]
+                    continue
+
+                # 3. 重新渲染
+                stage_start = time.monotonic()
+                remaining_time = self.time_limit - (time.monotonic() - start)
+                render_result = await asyncio.wait_for(render(code), timeout=max(remaining_time, 0.001))
+                attempt["render_seconds"] = round(time.monotonic() - stage_start, 3)
+
+                if render_result["success"]:
+                    attempt["status"] = "success"
+                    self.repairs_succeeded += 1
+                    app_logger.success(f"自动修复成功 - 尝试次数: {number}, 令牌: {tokens_used}")
+                    return {
+                        "success": True,
+                        "code": code,
+                        "render_result": render_result,
+                        "error": None,
+                        "attempts": attempts,
+                        "tokens_used": tokens_used
+                    }
+
+                attempt["error"] = error = render_result["error"]
+
+            except asyncio.TimeoutError:
+                attempt["error"] = f"超出修复时间上限（{self.time_limit}秒）"
+                stop_reason = "time_limit"
+                break
+            finally:
+                attempt["total_seconds"] = round(time.monotonic() - attempt_start, 3)
+
+        app_logger.warning(
+            f"自动修复未成功 - 尝试次数: {len(attempts)}, 令牌: {tokens_used}, 停止原因: {stop_reason}"
+        )
+        return {
+            "success": False,
+            "code": code,
+            "render_result": render_result,
+            "error": error,
+            "attempts": attempts,
+            "tokens_used": tokens_used
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """修复成功率统计"""
+        return {
+            "repairs_started": self.repairs_started,
+            "repairs_succeeded": self.repairs_succeeded,
+            "attempts_total": self.attempts_total,
+            "success_rate": round(self.repairs_succeeded / self.repairs_started, 3) if self.repairs_started else 0.0
+        }
+
+# 全局自动修复实例
+repair_service = RepairService(
+    max_attempts=settings.repair_max_attempts,
+    token_budget=settings.repair_token_budget,
+    time_limit=settings.repair_time_limit,
+    error_max_chars=settings.repair_error_max_chars
+)
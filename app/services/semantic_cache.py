@@ -0,0 +1,279 @@
+"""
+语义提示词缓存
+
+对渲染成功过的描述建立向量索引，相似的历史代码作为参考示例交给模型；配置了本地
+sentence-transformers模型且相似度足够高，或规范化后的描述完全相同时直接复用当时的代码
+（视频由渲染缓存按代码指纹命中）。未安装模型时退回到不依赖网络的哈希向量化，哈希向量
+只反映字面重合（"sine"与"cosine"、"3个圆"与"5个圆"也很相似），因此不用于判断能否复用。
+条目按模型、质量和提示词版本分区，不同分区之间互不命中。
+全部向量保存在一个预分配的NumPy矩阵中，检索是一次矩阵乘法，超出容量时淘汰最久未使用的条目。
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.logger import llm_logger
+
+_WORD_RE = re.compile(r"[a-z0-9_]+")
+_SPACE_RE = re.compile(r"\s+")
+
+class HashingEmbedder:
+    """哈希向量化：英文按词和词对、所有文本按字符二元/三元组哈希到固定维度，再做L2归一化"""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+        # 相似度只反映字面重合，不能据此直接复用代码
+        self.semantic = False
+
+    def _features(self, text: str) -> List[str]:
+        text = unicodedata.normalize("NFKC", text).lower()
+        words = _WORD_RE.findall(text)
+        features = [f"w:{word}" for word in words]
+        features += [f"p:{a} {b}" for a, b in zip(words, words[1:])]
+        compact = _SPACE_RE.sub(" ", text).strip()
+        for n in (2, 3):
+            features += [f"c:{compact[i:i + n]}" for i in range(len(compact) - n + 1)]
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            # 使用稳定的哈希，重启后持久化的向量仍然可比
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if (digest >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class SentenceTransformerEmbedder:
+    """本地sentence-transformers模型，语义相近但用词不同的描述也能匹配"""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self._model = SentenceTransformer(model_name)
+        self.dim = self._model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+        self.semantic = True
+
+    def embed(self, text: str) -> np.ndarray:
+        return self._model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+def create_embedder(model_name: str, dim: int):
+    """按配置创建向量化器，模型不可用时退回到哈希向量化"""
+    if model_name:
+        try:
+            embedder = SentenceTransformerEmbedder(model_name)
+            llm_logger.info(f"语义缓存使用本地向量模型: {model_name}")
+            return embedder
+        except ImportError:
+            llm_logger.warning("未安装sentence-transformers，语义缓存改用哈希向量化")
+        except Exception as e:
+            llm_logger.warning(f"向量模型加载失败，语义缓存改用哈希向量化: {str(e)}")
+    return HashingEmbedder(dim)
+
+def normalize_prompt(prompt: str) -> str:
+    """规范化描述：统一字符宽度和大小写，合并空白"""
+    return _SPACE_RE.sub(" ", unicodedata.normalize("NFKC", prompt).lower()).strip()
+
+class SemanticCache:
+    """描述向量索引：NumPy矩阵 + SQLite持久化，按最近使用时间淘汰
+
+    scope 标识生成条件（模型、质量、提示词版本），检索只在同一scope的条目中进行。
+    """
+
+    # 相似度达到该值视为同一描述，更新已有条目而不是新增
+    DUPLICATE_SIMILARITY = 0.995
+
+    def __init__(
+        self,
+        embedder,
+        db_path: Path,
+        max_entries: int,
+        reuse_threshold: float,
+        few_shot_threshold: float
+    ):
+        self.embedder = embedder
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.reuse_threshold = reuse_threshold
+        self.few_shot_threshold = few_shot_threshold
+
+        # 第i行向量对应_entries[i]；有效行为前_count行
+        self._matrix = np.zeros((max_entries, embedder.dim), dtype=np.float32)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._scopes = np.empty(max_entries, dtype=object)
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * max_entries
+        # (scope, 规范化描述) -> 行号，用于判断描述是否完全相同
+        self._exact: Dict[Tuple[str, str], int] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+        self.reuse_hits = 0
+        self.few_shot_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=5)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_cache ("
+            "key TEXT PRIMARY KEY, embedder TEXT NOT NULL, prompt TEXT NOT NULL, code TEXT NOT NULL, "
+            "embedding BLOB NOT NULL, last_used REAL NOT NULL, scope TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(semantic_cache)")}
+        if "scope" not in columns:
+            # 旧版本的条目没有分区信息，保留但不会被命中，随淘汰逐渐清除
+            self._conn.execute("ALTER TABLE semantic_cache ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """加载同一向量化器生成的最近条目"""
+        rows = self._conn.execute(
+            "SELECT key, prompt, code, embedding, last_used, scope FROM semantic_cache "
+            "WHERE embedder = ? AND scope != '' ORDER BY last_used DESC LIMIT ?",
+            (self.embedder.name, self.max_entries)
+        ).fetchall()
+        for key, prompt, code, embedding, last_used, scope in rows:
+            vector = np.frombuffer(embedding, dtype=np.float32)
+            if vector.shape[0] != self.embedder.dim:
+                continue
+            index = self._count
+            self._store(index, key, scope, prompt, code, vector, last_used)
+            self._count += 1
+        llm_logger.info(f"语义缓存已加载 - 条目: {self._count}, 向量化: {self.embedder.name}")
+
+    def _store(
+        self,
+        index: int,
+        key: str,
+        scope: str,
+        prompt: str,
+        code: str,
+        vector: np.ndarray,
+        last_used: float
+    ) -> None:
+        """写入第index行，替换该行原有的条目"""
+        old = self._entries[index]
+        if old is not None:
+            self._exact.pop((self._scopes[index], normalize_prompt(old["prompt"])), None)
+        self._matrix[index] = vector
+        self._last_used[index] = last_used
+        self._scopes[index] = scope
+        self._entries[index] = {"key": key, "prompt": prompt, "code": code}
+        self._exact[(scope, normalize_prompt(prompt))] = index
+
+    def _search(self, vector: np.ndarray, scope: str) -> Tuple[Optional[int], float]:
+        """返回同一scope内余弦相似度最高的行号及相似度（向量均已归一化，点积即余弦相似度）"""
+        if self._count == 0:
+            return None, 0.0
+        similarities = self._matrix[:self._count] @ vector
+        similarities[self._scopes[:self._count] != scope] = -np.inf
+        index = int(np.argmax(similarities))
+        if similarities[index] == -np.inf:
+            return None, 0.0
+        return index, float(similarities[index])
+
+    def lookup(self, prompt: str, scope: str) -> Optional[Dict[str, Any]]:
+        """在同一scope中查找最相似的历史描述
+
+        规范化后完全相同，或使用语义向量模型且相似度达到reuse_threshold时，mode为reuse
+        （直接复用代码）；相似度达到few_shot_threshold时mode为few_shot（作为参考示例），
+        否则返回None。
+        """
+        vector = self.embedder.embed(prompt)
+        with self._lock:
+            exact = self._exact.get((scope, normalize_prompt(prompt)))
+            if exact is not None:
+                index, similarity = exact, 1.0
+            else:
+                index, similarity = self._search(vector, scope)
+            if index is None or similarity < self.few_shot_threshold:
+                self.misses += 1
+                return None
+
+            self._last_used[index] = time.time()
+            entry = self._entries[index]
+            if exact is not None or (self.embedder.semantic and similarity >= self.reuse_threshold):
+                mode = "reuse"
+                self.reuse_hits += 1
+            else:
+                mode = "few_shot"
+                self.few_shot_hits += 1
+
+        llm_logger.info(f"语义缓存命中 - 模式: {mode}, 相似度: {similarity:.3f}, 历史描述: {entry['prompt'][:50]}")
+        return {"prompt": entry["prompt"], "code": entry["code"], "similarity": round(similarity, 4), "mode": mode}
+
+    def add(self, prompt: str, code: str, scope: str) -> None:
+        """记录一个渲染成功的描述及其代码"""
+        vector = self.embedder.embed(prompt)
+        if not vector.any():
+            return
+        now = time.time()
+        key = hashlib.sha256(f"{self.embedder.name}:{scope}:{prompt}".encode("utf-8")).hexdigest()
+
+        with self._lock:
+            index = self._exact.get((scope, normalize_prompt(prompt)))
+            similarity = 1.0
+            if index is None:
+                index, similarity = self._search(vector, scope)
+            evicted = None
+            if index is not None and similarity >= self.DUPLICATE_SIMILARITY:
+                # 同一描述：用最新的成功代码替换
+                evicted = self._entries[index]["key"]
+            elif self._count < self.max_entries:
+                index = self._count
+                self._count += 1
+            else:
+                index = int(np.argmin(self._last_used[:self._count]))
+                evicted = self._entries[index]["key"]
+                self.evictions += 1
+
+            self._store(index, key, scope, prompt, code, vector, now)
+
+            if evicted and evicted != key:
+                self._conn.execute("DELETE FROM semantic_cache WHERE key = ?", (evicted,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO semantic_cache (key, embedder, prompt, code, embedding, last_used, scope) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, self.embedder.name, prompt, code, vector.tobytes(), now, scope)
+            )
+            self._conn.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "embedder": self.embedder.name,
+                "semantic_reuse": self.embedder.semantic,
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "reuse_hits": self.reuse_hits,
+                "few_shot_hits": self.few_shot_hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# 全局语义缓存实例，未启用时为None
+semantic_cache: Optional[SemanticCache] = None
+if settings.semantic_cache_enabled:
+    semantic_cache = SemanticCache(
+        embedder=create_embedder(settings.semantic_cache_model, settings.semantic_cache_dim),
+        db_path=settings.cache_dir / "semantic_cache.sqlite3",
+        max_entries=settings.semantic_cache_max_entries,
+        reuse_threshold=settings.semantic_cache_reuse_threshold,
+        few_shot_threshold=settings.semantic_cache_few_shot_threshold
+    )